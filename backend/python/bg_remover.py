@@ -9,6 +9,8 @@ from PIL import Image
 from transformers import AutoModelForImageSegmentation
 from torchvision import transforms
 
+from worker_pool import BoundedWorkerPool
+
 # --- Model Initialization ---
 MODEL = None
 MODEL_STATUS = "Not Loaded"
@@ -23,6 +25,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One model instance: a single worker by default, override with ECL_BG_REMOVER_WORKERS.
+# Threads only: MODEL is loaded by this process's startup hook, so a spawned
+# worker process would never see it.
+bg_pool = BoundedWorkerPool("bg_remover", max_workers=1, max_queue=8, thread_only=True)
+
 @app.on_event("startup")
 async def startup_event():
     global MODEL, MODEL_STATUS
@@ -50,9 +57,7 @@ class Request(BaseModel):
     image_b64: str
     threshold: float = 0.5
 
-@app.post("/remove-background")
-async def remove_background(req: Request):
-    if not MODEL: raise HTTPException(503, f"Model not ready: {MODEL_STATUS}")
+def remove_background_image(req: Request) -> dict:
     try:
         # Robust Base64 Decoding
         b64 = req.image_b64
@@ -77,6 +82,15 @@ async def remove_background(req: Request):
     except Exception as e:
         raise HTTPException(500, str(e))
 
+@app.post("/remove-background")
+async def remove_background(req: Request):
+    if not MODEL: raise HTTPException(503, f"Model not ready: {MODEL_STATUS}")
+    return await bg_pool.run(remove_background_image, req)
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return bg_pool.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8005)
@@ -2,54 +2,421 @@
 # RUN ON VPS: python digitizer_api.py
 # IP: 74.208.133.116 | Port: 8007
 
+import io
 import os
+import zipfile
 import numpy as np
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Request, request, send_file, jsonify
 from flask_cors import CORS
+from werkzeug.utils import secure_filename
 from PIL import Image
 import cv2
-from sklearn.cluster import MiniBatchKMeans
+from sklearn.cluster import KMeans
 import pyembroidery
-from shapely.geometry import Polygon, MultiPolygon
+from shapely.geometry import LineString, Polygon, MultiPolygon
 from shapely.ops import unary_union
 
+class InMemoryRequest(Request):
+    # Keep uploads in memory instead of spooling them to temp files; their
+    # size is bounded by MAX_CONTENT_LENGTH
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('ECL_DIGITIZER_MAX_UPLOAD_MB', 32)) * 1024 * 1024
 CORS(app)  # Enable Cross-Origin for your HTML frontend
 
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Machine formats the pattern can be written in
+WRITERS = {
+    'dst': pyembroidery.write_dst,
+    'pes': pyembroidery.write_pes,
+    'exp': pyembroidery.write_exp,
+    'jef': pyembroidery.write_jef,
+    'vp3': pyembroidery.write_vp3,
+}
+
+# Pixels sampled to fit the palette: one per cell of a regular grid
+PALETTE_SAMPLE_PIXELS = 1 << 18
+# Bits per channel of the color lookup table used to assign every pixel
+LABEL_LUT_BITS = 6
+
+# Pattern units (0.1 mm) per image pixel
+UNITS_PER_PIXEL = 2
+
+# Sewing-time model for path stats: needle speed, the longest single frame
+# move (as in DST), and the overheads of a trimmed jump and a color change
+MACHINE_SPM = 800
+MAX_FRAME_MOVE = 121
+TRIM_LENGTH = 30  # jumps longer than this (units) are trimmed
+TRIM_SECONDS = 3.0
+COLOR_CHANGE_SECONDS = 10.0
+
+# Improvement passes of the 2-opt object ordering per color block
+TWO_OPT_PASSES = 8
+
+# Thread charts a palette can be snapped to
+THREAD_CHARTS = {
+    "brother": pyembroidery.EmbThreadPec.get_thread_set,
+    "janome": pyembroidery.EmbThreadJef.get_thread_set,
+    "husqvarna": pyembroidery.EmbThreadHus.get_thread_set,
+    "viking": pyembroidery.EmbThreadShv.get_thread_set,
+}
+
+def rgb_to_lab(rgb):
+    """(n, 3) uint8 RGB to (n, 3) float32 CIE Lab."""
+    rgb = np.asarray(rgb, dtype=np.float32).reshape(-1, 1, 3) / 255
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB).reshape(-1, 3)
+
+def make_thread(rgb):
+    # EmbThread's positional arguments are (color, description, ...), not r, g, b
+    thread = pyembroidery.EmbThread()
+    thread.set_color(int(rgb[0]), int(rgb[1]), int(rgb[2]))
+    return thread
 
-def quantize_image(image_path, n_colors=8):
-    """Reduces image to n_colors using K-Means clustering."""
-    img = cv2.imread(image_path)
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    (h, w) = img.shape[:2]
+def stratified_sample(img, max_pixels=PALETTE_SAMPLE_PIXELS, seed=0):
+    """One pixel from each cell of a grid sized to max_pixels, at a seeded offset within the cell."""
+    h, w = img.shape[:2]
+    step = max(1, int(np.ceil(np.sqrt(h * w / max_pixels))))
+    rng = np.random.RandomState(seed)
+    ys, xs = np.arange(0, h, step), np.arange(0, w, step)
+    yy = np.minimum(ys[:, None] + rng.randint(0, step, (len(ys), len(xs))), h - 1)
+    xx = np.minimum(xs[None, :] + rng.randint(0, step, (len(ys), len(xs))), w - 1)
+    return img[yy, xx].reshape(-1, 3)
+
+def fit_palette(img, n_colors, seed=0):
+    """
+    K-Means in Lab over the unique colors of a stratified sample, weighted
+    by how often each occurs, so the fit costs the same for any image
+    size. Seeded, so the same artwork always gives the same palette.
+    Returns Lab centers, most used first.
+    """
+    sample = stratified_sample(img, seed=seed).astype(np.uint32)
+    keys = (sample[:, 0] << 16) | (sample[:, 1] << 8) | sample[:, 2]
+    keys, counts = np.unique(keys, return_counts=True)
+    colors = np.stack([keys >> 16, (keys >> 8) & 255, keys & 255], axis=1)
+    lab = rgb_to_lab(colors)
     
-    # Reshape for K-Means
-    img_reshaped = img.reshape((img.shape[0] * img.shape[1], 3))
+    k = min(n_colors, len(colors))
+    clt = KMeans(n_clusters=k, n_init=4, random_state=seed)
+    labels = clt.fit_predict(lab, sample_weight=counts)
+    usage = np.bincount(labels, weights=counts, minlength=k)
+    return clt.cluster_centers_[np.argsort(-usage, kind="stable")]
+
+def snap_to_chart(centers_lab, chart):
+    """
+    Replace each center with its nearest thread (Lab distance) from the
+    chart. Centers that land on the same thread merge. Returns the threads
+    and their Lab colors.
+    """
+    threads = [thread for thread in THREAD_CHARTS[chart]() if thread is not None]
+    chart_lab = rgb_to_lab([[t.get_red(), t.get_green(), t.get_blue()] for t in threads])
+    nearest = np.argmin(((centers_lab[:, None, :] - chart_lab[None, :, :]) ** 2).sum(axis=2), axis=1)
+    picked = list(dict.fromkeys(nearest.tolist()))
+    return [threads[i] for i in picked], chart_lab[picked]
+
+def assign_labels(img, centers_lab, bits=LABEL_LUT_BITS):
+    """
+    Nearest center for every pixel in one vectorized pass: centers are
+    matched once per cell of a 2^(3*bits) RGB lookup table, then pixels
+    index the table by their packed high bits.
+    """
+    levels = 1 << bits
+    shift = 8 - bits
+    cells = np.indices((levels, levels, levels)).reshape(3, -1).T
+    cell_lab = rgb_to_lab((cells << shift) + (1 << shift) // 2)
+    lut = np.empty(len(cell_lab), dtype=np.uint8)
+    for start in range(0, len(cell_lab), 1 << 16):
+        chunk = cell_lab[start:start + (1 << 16)]
+        lut[start:start + len(chunk)] = np.argmin(((chunk[:, None, :] - centers_lab[None, :, :]) ** 2).sum(axis=2), axis=1)
     
-    # Cluster
-    clt = MiniBatchKMeans(n_clusters=n_colors)
-    labels = clt.fit_predict(img_reshaped)
-    quant = clt.cluster_centers_.astype("uint8")[labels]
+    packed = img >> shift
+    keys = (packed[:, :, 0].astype(np.uint32) << (2 * bits)) | (packed[:, :, 1].astype(np.uint32) << bits) | packed[:, :, 2]
+    return lut[keys]
+
+def quantize_image(img_bgr, n_colors=8, thread_chart=None, seed=0):
+    """
+    Reduces a BGR image to n_colors using seeded K-Means in Lab, optionally
+    snapped to a thread chart. Returns the quantized BGR image, the RGB
+    centers (uint8) and the threads for each center.
+    """
+    img = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
     
-    # Reshape back
-    quant = quant.reshape((h, w, 3))
+    # Cluster a bounded sample, then label every pixel
+    centers_lab = fit_palette(img, n_colors, seed)
+    if thread_chart:
+        threads, centers_lab = snap_to_chart(centers_lab, thread_chart)
+        centers = np.array([[t.get_red(), t.get_green(), t.get_blue()] for t in threads], dtype=np.uint8)
+    else:
+        lab = centers_lab.reshape(-1, 1, 3).astype(np.float32)
+        centers = np.clip(np.rint(cv2.cvtColor(lab, cv2.COLOR_LAB2RGB).reshape(-1, 3) * 255), 0, 255).astype(np.uint8)
+        threads = [make_thread(c) for c in centers]
+    
+    labels = assign_labels(img, centers_lab)
+    quant = centers[labels]
     
     # Convert back to BGR for OpenCV processing later
-    return cv2.cvtColor(quant, cv2.COLOR_RGB2BGR), clt.cluster_centers_
+    return cv2.cvtColor(quant, cv2.COLOR_RGB2BGR), centers, threads
 
-def generate_stitches(quantized_img, centers, pull_comp=0.2, underlay_type='Center Run', density=0.4):
-    """Generates embroidery pattern from quantized image with Pro features."""
+def scanline_spans(rings, y0, spacing, rows):
+    """
+    Even-odd spans of every scan line y0 + k * spacing (k < rows) through
+    the given closed rings, for all lines at once: each edge is expanded
+    into the rows it crosses (half-open in y, so vertices count once),
+    crossings are sorted by row then x, and consecutive pairs are spans.
+    Returns (row, x_start, x_end) arrays.
+    """
+    edges = np.concatenate([np.stack([ring[:-1], ring[1:]], axis=1) for ring in rings])
+    p0, p1 = edges[:, 0], edges[:, 1]
+    ylo, yhi = np.minimum(p0[:, 1], p1[:, 1]), np.maximum(p0[:, 1], p1[:, 1])
+    k0 = np.clip(np.ceil((ylo - y0) / spacing), 0, rows).astype(np.int64)
+    k1 = np.clip(np.ceil((yhi - y0) / spacing), 0, rows).astype(np.int64)
+    counts = np.maximum(k1 - k0, 0)
+    
+    edge = np.repeat(np.arange(len(edges)), counts)
+    row = np.repeat(k0, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    y = y0 + row * spacing
+    t = (y - p0[edge, 1]) / (p1[edge, 1] - p0[edge, 1])
+    x = p0[edge, 0] + t * (p1[edge, 0] - p0[edge, 0])
+    
+    order = np.lexsort((x, row))
+    row, x = row[order], x[order]
+    return row[0::2], x[0::2], x[1::2]
+
+def tatami_fill(poly, spacing, angle=45.0, stitch_length=35.0, stagger=0.25, min_span=2.0):
+    """
+    Tatami fill of a (multi)polygon in embroidery units. Scan lines run at
+    `angle` degrees, `spacing` apart; needle points fall on a grid of
+    `stitch_length` shifted by `stagger` of a stitch per row, so the
+    penetrations form the usual offset brick pattern. Spans are chained
+    into regions where consecutive rows overlap, and each region is sewn
+    back and forth without leaving the shape. Returns one (n, 2) array of
+    needle points per region.
+    """
+    theta = np.deg2rad(angle)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    # Rotate by -angle so the fill rows are horizontal
+    to_rows = np.array([[cos_t, -sin_t], [sin_t, cos_t]])
+    rings = []
+    for part in getattr(poly, "geoms", [poly]):
+        if part.is_empty or part.geom_type != "Polygon":
+            continue
+        for ring in [part.exterior, *part.interiors]:
+            rings.append(np.asarray(ring.coords) @ to_rows)
+    if not rings:
+        return []
+    
+    y_min = min(ring[:, 1].min() for ring in rings) + spacing / 2
+    y_max = max(ring[:, 1].max() for ring in rings)
+    rows = int(np.floor((y_max - y_min) / spacing)) + 1
+    row, x_start, x_end = scanline_spans(rings, y_min, spacing, rows)
+    keep = x_end - x_start >= min_span
+    row, x_start, x_end = row[keep], x_start[keep], x_end[keep]
+    if not len(row):
+        return []
+    
+    # Chain spans into regions: a span continues the first region whose
+    # span on the previous row overlaps it and ends near it on the side
+    # where the row turns; otherwise it starts a new region
+    regions, open_regions = [], []
+    bounds = np.flatnonzero(np.diff(row)) + 1
+    for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(row)]):
+        k = row[start]
+        continuing = []
+        for i in range(start, stop):
+            for region in open_regions:
+                last = region[-1]
+                turn = x_end if len(region) % 2 else x_start
+                if (row[last] == k - 1 and x_start[i] < x_end[last] and x_end[i] > x_start[last]
+                        and abs(turn[i] - turn[last]) <= stitch_length):
+                    region.append(i)
+                    open_regions.remove(region)
+                    continuing.append(region)
+                    break
+            else:
+                regions.append([i])
+                continuing.append(regions[-1])
+        open_regions = continuing
+    
+    paths = []
+    for region in regions:
+        points = []
+        for n, i in enumerate(region):
+            k = row[i]
+            offset = (k * stagger % 1.0) * stitch_length
+            first = np.ceil((x_start[i] - offset) / stitch_length + 1e-9)
+            grid = offset + np.arange(first, np.floor((x_end[i] - offset) / stitch_length - 1e-9) + 1) * stitch_length
+            # Skip grid points that would make a tiny stitch at either end of the row
+            grid = grid[(grid - x_start[i] > stitch_length / 4) & (x_end[i] - grid > stitch_length / 4)]
+            xs = np.concatenate([[x_start[i]], grid, [x_end[i]]])
+            if n % 2:
+                xs = xs[::-1]
+            points.append(np.stack([xs, np.full(len(xs), y_min + k * spacing)], axis=1))
+        # Back from the row frame to the design frame
+        paths.append(np.concatenate(points) @ to_rows.T)
+    return paths
+
+def closed_run(run):
+    return len(run) > 3 and np.allclose(run[0], run[-1])
+
+def reverse_runs(runs):
+    """The same runs sewn backwards: last run first, each one reversed."""
+    return [run[::-1] for run in reversed(runs)]
+
+def chain_runs(runs, start):
+    """
+    Greedy nearest-neighbour chain from `start`: the next run is the one
+    whose entry point is nearest the current position. Open runs may be
+    entered from either end; closed runs (center-run rings) from any vertex.
+    """
+    # Every candidate entry point in one array, with the vertex it enters at
+    closed = [closed_run(run) for run in runs]
+    vertices = [np.arange(len(run) - 1) if ring else np.array([0, len(run) - 1]) for run, ring in zip(runs, closed)]
+    bounds = np.cumsum([0] + [len(v) for v in vertices])
+    points = np.concatenate([run[v] for run, v in zip(runs, vertices)])
+    vertex = np.concatenate(vertices)
+    available = np.ones(len(points), dtype=bool)
+    
+    chain, pos = [], np.asarray(start, dtype=float)
+    for _ in runs:
+        k = int(np.argmin(np.where(available, ((points - pos) ** 2).sum(axis=1), np.inf)))
+        n = int(np.searchsorted(bounds, k, side="right")) - 1
+        available[bounds[n]:bounds[n + 1]] = False
+        
+        run, v = runs[n], vertex[k]
+        if closed[n]:
+            run = np.vstack([np.roll(run[:-1], -v, axis=0), run[v:v + 1]])
+        elif v:
+            run = run[::-1]
+        chain.append(run)
+        pos = run[-1]
+    return chain
+
+def plan_object(underlay, fill):
+    """
+    Sewing order for one shape in both directions. The fill regions are
+    chained from the first one, and the underlay is chained backwards from
+    wherever the fill starts so it finishes right next to it. The reverse
+    plan runs the fill backwards, with its underlay re-chained to match.
+    """
+    top = chain_runs(fill, fill[0][0]) if fill else []
+    plans = []
+    for runs in (top, reverse_runs(top)):
+        entry = runs[0][0] if runs else underlay[0][0]
+        plans.append((reverse_runs(chain_runs(underlay, entry)) if underlay else []) + runs)
+    return plans
+
+def run_gaps(runs):
+    return [float(np.hypot(*(b[0] - a[-1]))) for a, b in zip(runs, runs[1:])]
+
+def order_objects(entries, exits, internal, start):
+    """
+    Visit order for the objects of one color block, as (object, direction)
+    pairs. A nearest-neighbour tour from `start` is improved with 2-opt
+    moves; reversing a stretch of the tour also flips the direction every
+    object in it is sewn, so entries and exits trade places.
+    """
+    # Points as complex numbers, so a distance is just abs(p - q)
+    entries = entries[..., 0] + 1j * entries[..., 1]
+    exits = exits[..., 0] + 1j * exits[..., 1]
+    start = complex(start[0], start[1])
+    
+    n = len(entries)
+    left = np.ones(n, dtype=bool)
+    order, orient = np.empty(n, dtype=int), np.empty(n, dtype=int)
+    pos = start
+    for step in range(n):
+        cost = np.abs(entries - pos) + internal
+        cost[~left] = np.inf
+        i, o = np.unravel_index(np.argmin(cost), cost.shape)
+        order[step], orient[step], left[i] = i, o, False
+        pos = exits[i, o]
+    
+    def tour():
+        """Per-position arrays of the current tour, sewn as is and flipped."""
+        entry, exit_, cost = entries[order, orient], exits[order, orient], internal[order, orient]
+        flip_entry, flip_exit, flip_cost = entries[order, 1 - orient], exits[order, 1 - orient], internal[order, 1 - orient]
+        # Running totals of the gaps between neighbours (as sewn now, and as
+        # they would be sewn reversed) and of the objects' own travel
+        gaps = np.r_[0.0, np.cumsum(np.abs(entry[1:] - exit_[:-1]))]
+        flip_gaps = np.r_[0.0, np.cumsum(np.abs(flip_entry[:-1] - flip_exit[1:]))]
+        costs, flip_costs = np.r_[0.0, np.cumsum(cost)], np.r_[0.0, np.cumsum(flip_cost)]
+        return entry, exit_, flip_entry, flip_exit, gaps, flip_gaps, costs, flip_costs
+    
+    # Successor entry for each end position (none after the last object)
+    after = np.r_[np.arange(1, n), n - 1]
+    tail = np.r_[np.ones(n - 1), 0.0]
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        entry, exit_, flip_entry, flip_exit, gaps, flip_gaps, costs, flip_costs = tour()
+        for a in range(n):
+            prev = start if a == 0 else exit_[a - 1]
+            b = slice(a, n)
+            old = (abs(entry[a] - prev) + tail[b] * np.abs(entry[after[b]] - exit_[b])
+                   + gaps[b] - gaps[a] + costs[a + 1:] - costs[a])
+            new = (np.abs(flip_entry[b] - prev) + tail[b] * np.abs(entry[after[b]] - flip_exit[a])
+                   + flip_gaps[b] - flip_gaps[a] + flip_costs[a + 1:] - flip_costs[a])
+            best = int(np.argmin(new - old))
+            if new[best] - old[best] < -1e-6:
+                end = a + best + 1
+                order[a:end], orient[a:end] = order[a:end][::-1], 1 - orient[a:end][::-1]
+                entry, exit_, flip_entry, flip_exit, gaps, flip_gaps, costs, flip_costs = tour()
+                improved = True
+        if not improved:
+            break
+    return list(zip(order.tolist(), orient.tolist()))
+
+def connect_runs(runs, cover, max_stitch):
+    """
+    Pair each run with whether the needle jumps to it. Inside one object a
+    short hop that stays within the shape is sewn as a travel stitch,
+    hidden under the fill, instead of a jump and trim.
+    """
+    steps = [(runs[0], True)]
+    for prev, run in zip(runs, runs[1:]):
+        gap = np.hypot(*(run[0] - prev[-1]))
+        sewn = gap <= 1e-6 or (gap <= max_stitch and cover.covers(LineString([prev[-1], run[0]])))
+        steps.append((run, not sewn))
+    return steps
+
+def path_stats(blocks, start=(0.0, 0.0)):
+    """
+    Jumps, trims, travel and an estimated sewing time for blocks of
+    (run, jump) steps, with the needle starting at `start`.
+    """
+    jumps = trims = stitches = frame_moves = 0
+    travel = 0.0
+    pos = np.asarray(start, dtype=float)
+    for steps in blocks:
+        for run, jump in steps:
+            gap = float(np.hypot(*(run[0] - pos)))
+            travel += gap
+            stitches += len(run)
+            if jump:
+                jumps += 1
+                frame_moves += max(1, int(np.ceil(gap / MAX_FRAME_MOVE)))
+                trims += gap > TRIM_LENGTH
+            pos = run[-1]
+    color_changes = max(0, len(blocks) - 1)
+    seconds = (stitches + frame_moves) * 60.0 / MACHINE_SPM + trims * TRIM_SECONDS + color_changes * COLOR_CHANGE_SECONDS
+    return {"jumps": jumps, "trims": trims, "travel_mm": round(travel / 10, 1), "run_seconds": round(seconds, 1)}
+
+def generate_stitches(quantized_img, centers, pull_comp=0.2, underlay_type='Center Run', density=0.4, threads=None,
+                      fill_angle=45.0, stitch_length=3.5, stagger=0.25):
+    """
+    Generates embroidery pattern from quantized image with Pro features.
+    Objects in each color block are sewn in a travel-minimizing order.
+    Returns the pattern and path stats before and after that ordering.
+    """
     pattern = pyembroidery.EmbPattern()
     
-    # Convert density (mm) to stitch points (0.1mm units)
-    # Standard density is ~4-5 points. Lower density value = closer stitches.
-    # 0.4mm = 4 points
-    stitch_spacing = int(density * 10) 
+    # All geometry is in pattern units (0.1 mm); each pixel is UNITS_PER_PIXEL units
+    row_spacing = density * 10  # density is the tatami row spacing in mm
+    stitch_units = stitch_length * 10
 
     # For each color center, create a mask and find contours
-    for center in centers:
+    blocks = []
+    for i, center in enumerate(centers):
         # Create mask for this color
         # Note: center is in RGB, image is in BGR (OpenCV standard)
         color_bgr = center[::-1].astype("uint8")
@@ -57,26 +424,20 @@ def generate_stitches(quantized_img, centers, pull_comp=0.2, underlay_type='Cent
         # Find pixels matching this color
         mask = cv2.inRange(quantized_img, color_bgr, color_bgr)
         
-        # Find contours
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Find outer contours and their holes
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+        if hierarchy is None:
+            continue
         
-        # Add Color Change to Pattern
-        pattern.add_thread(pyembroidery.EmbThread(int(center[0]), int(center[1]), int(center[2])))
-        
-        for contour in contours:
-            # Skip small noise
-            if cv2.contourArea(contour) < 50:
+        objects = []
+        for j, contour in enumerate(contours):
+            # Holes are handled with their outer contour; skip small noise
+            if hierarchy[0][j][3] != -1 or cv2.contourArea(contour) < 50:
                 continue
                 
-            # Simplify contour
-            epsilon = 0.01 * cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, epsilon, True)
-            
-            # Convert to Shapely Polygon
-            points = approx.reshape(-1, 2)
-            if len(points) < 3: continue
-            
-            poly = Polygon(points)
+            poly = contour_polygon(contour, [contours[h] for h in child_contours(hierarchy, j)])
+            if poly is None:
+                continue
             
             # --- PRO FEATURE: PULL COMPENSATION ---
             # Expand shape slightly to account for thread tension pulling fabric in
@@ -84,6 +445,7 @@ def generate_stitches(quantized_img, centers, pull_comp=0.2, underlay_type='Cent
             buffered_poly = poly.buffer(pull_comp * 10, join_style=2) # 2 = Miter join
             
             # --- PRO FEATURE: UNDERLAY ---
+            underlay = []
             if underlay_type != 'None':
                 # Underlay is usually smaller than the main shape
                 underlay_poly = poly.buffer(-5) # Shrink by 0.5mm
@@ -92,54 +454,81 @@ def generate_stitches(quantized_img, centers, pull_comp=0.2, underlay_type='Cent
                     if underlay_type == 'Center Run':
                         # Simple running stitch along the center/skeleton (simplified here as boundary)
                         # Ideally would use medial axis transform, but boundary walk is a basic underlay
-                        u_points = list(underlay_poly.exterior.coords)
-                        pattern.add_stitch_absolute(pyembroidery.JUMP, u_points[0][0] * 2, u_points[0][1] * 2)
-                        for pt in u_points:
-                            pattern.add_stitch_absolute(pyembroidery.STITCH, pt[0] * 2, pt[1] * 2)
+                        for part in getattr(underlay_poly, "geoms", [underlay_poly]):
+                            underlay.append(np.asarray(part.exterior.coords))
                             
                     elif underlay_type == 'Tatami (Full)':
-                         # Generate a sparse fill for underlay
-                         # (Simplified: just another outline for this demo, full tatami logic is complex)
-                         u_points = list(underlay_poly.exterior.coords)
-                         pattern.add_stitch_absolute(pyembroidery.JUMP, u_points[0][0] * 2, u_points[0][1] * 2)
-                         for pt in u_points:
-                            pattern.add_stitch_absolute(pyembroidery.STITCH, pt[0] * 2, pt[1] * 2)
-
-            # --- MAIN FILL (TATAMI / SATIN SIMULATION) ---
-            # For this engine, we will use a scan-line fill approach for Tatami
-            
-            # Get bounding box
-            minx, miny, maxx, maxy = buffered_poly.bounds
-            
-            # Generate scan lines
-            y = miny
-            while y < maxy:
-                # Create a horizontal line across the shape
-                line_string = [(minx, y), (maxx, y)]
-                # In a real implementation, we intersect this line with the polygon
-                # to find entry/exit points for stitches.
-                # Due to complexity of full Tatami math in a single file, we will stick to 
-                # a high-quality Outline/Satin simulation for the main visual.
-                
-                # Fallback to Outline (Satin-like) for robust demo
-                final_points = list(buffered_poly.exterior.coords)
-                
-                # Move to start
-                pattern.add_stitch_absolute(pyembroidery.JUMP, final_points[0][0] * 2, final_points[0][1] * 2)
-                
-                # Stitch the path
-                for pt in final_points:
-                     # Scale up (pixels -> 0.1mm units). Factor 2 is arbitrary for visibility scaling.
-                    pattern.add_stitch_absolute(pyembroidery.STITCH, pt[0] * 2, pt[1] * 2)
-                
-                # Close loop
-                pattern.add_stitch_absolute(pyembroidery.STITCH, final_points[0][0] * 2, final_points[0][1] * 2)
-                
-                # Break loop as we are doing outline mode for stability
-                break 
+                        # Sparse tatami across the main fill direction to lift the top stitches
+                        underlay = tatami_fill(underlay_poly, max(row_spacing * 4, 20), fill_angle + 90, stitch_units, 0.5)
+
+            # --- MAIN FILL (TATAMI) ---
+            fill = tatami_fill(buffered_poly, row_spacing, fill_angle, stitch_units, stagger)
+            if underlay or fill:
+                # Travel stitches may cross anything the fill will cover
+                objects.append((underlay, fill, buffered_poly.buffer(1)))
+        
+        if objects:
+            blocks.append((threads[i] if threads else make_thread(center), objects))
+    
+    # As traced: every run in contour order, each behind a jump
+    before = path_stats([[(run, True) for underlay, fill, _ in objects for run in underlay + fill]
+                         for _, objects in blocks])
+    
+    sewn, pos = [], np.zeros(2)
+    for thread, objects in blocks:
+        plans = [plan_object(underlay, fill) for underlay, fill, _ in objects]
+        entries = np.array([[plan[0][0] for plan in pair] for pair in plans])
+        exits = np.array([[plan[-1][-1] for plan in pair] for pair in plans])
+        internal = np.array([[sum(run_gaps(plan)) for plan in pair] for pair in plans])
+        
+        steps = []
+        for k, direction in order_objects(entries, exits, internal, pos):
+            steps += connect_runs(plans[k][direction], objects[k][2], stitch_units)
+        sewn.append(steps)
+        pos = steps[-1][0][-1]
+        
+        # Add Color Change to Pattern
+        if len(sewn) > 1:
+            pattern.add_command(pyembroidery.COLOR_CHANGE)
+        pattern.add_thread(thread)
+        for run, jump in steps:
+            if jump:
+                pattern.add_stitch_absolute(pyembroidery.JUMP, run[0][0], run[0][1])
+            for x, y in run:
+                pattern.add_stitch_absolute(pyembroidery.STITCH, x, y)
             
     pattern.end()
-    return pattern
+    return pattern, {"before": before, "after": path_stats(sewn)}
+
+def child_contours(hierarchy, parent):
+    """Indices of the holes of an outer RETR_CCOMP contour."""
+    holes = []
+    child = hierarchy[0][parent][2]
+    while child != -1:
+        holes.append(child)
+        child = hierarchy[0][child][0]
+    return holes
+
+def contour_polygon(contour, holes):
+    """Simplified Shapely polygon (pattern units) for a contour and its holes, or None if degenerate."""
+    def simplify(cnt):
+        epsilon = 0.01 * cv2.arcLength(cnt, True)
+        return cv2.approxPolyDP(cnt, epsilon, True).reshape(-1, 2) * UNITS_PER_PIXEL
+    
+    points = simplify(contour)
+    if len(points) < 3:
+        return None
+    interiors = [ring for ring in map(simplify, holes) if len(ring) >= 3 and cv2.contourArea(ring.astype(np.float32)) >= 50]
+    poly = Polygon(points, interiors)
+    # Self-intersections from the simplification would break the fill spans
+    return poly if poly.is_valid else poly.buffer(0)
+
+def write_pattern(pattern, fmt):
+    """Write the pattern in one machine format to an in-memory buffer, rewound for reading."""
+    buffer = io.BytesIO()
+    WRITERS[fmt](pattern, buffer)
+    buffer.seek(0)
+    return buffer
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -155,23 +544,54 @@ def digitize():
     pull_comp = float(request.form.get('pull_comp', 0.2))
     density = float(request.form.get('density', 0.4))
     underlay = request.form.get('underlay', 'Center Run')
+    fill_angle = float(request.form.get('fill_angle', 45))
+    stitch_length = float(request.form.get('stitch_length', 3.5))
+    stagger = float(request.form.get('stagger', 0.25))
+    if density <= 0 or stitch_length <= 0:
+        return jsonify({"error": "density and stitch_length must be positive"}), 400
+    thread_chart = request.form.get('thread_chart') or None
+    if thread_chart and thread_chart not in THREAD_CHARTS:
+        return jsonify({"error": f"Unknown thread chart '{thread_chart}' (expected one of {', '.join(THREAD_CHARTS)})"}), 400
+    
+    formats = [f.strip().lower() for f in request.form.get('formats', request.form.get('format', 'dst')).split(',') if f.strip()]
+    unknown = [f for f in formats if f not in WRITERS]
+    if not formats or unknown:
+        return jsonify({"error": f"Unknown format(s) {', '.join(unknown)} (expected one of {', '.join(WRITERS)})"}), 400
+    formats = list(dict.fromkeys(formats))
     
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    file.save(filepath)
+    # Decode straight from the upload buffer; nothing touches the disk
+    img = cv2.imdecode(np.frombuffer(file.read(), np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return jsonify({"error": "Could not decode the uploaded image"}), 400
+    name = os.path.splitext(secure_filename(file.filename or ''))[0] or 'design'
     
     try:
         # 1. Process Image
-        quantized, centers = quantize_image(filepath, n_colors=colors)
+        quantized, centers, threads = quantize_image(img, n_colors=colors, thread_chart=thread_chart)
         
         # 2. Generate Pattern with Pro Settings
-        pattern = generate_stitches(quantized, centers, pull_comp, underlay, density)
+        pattern, stats = generate_stitches(quantized, centers, pull_comp, underlay, density, threads,
+                                           fill_angle, stitch_length, stagger)
         
-        # 3. Save DST
-        output_filename = os.path.splitext(file.filename)[0] + ".dst"
-        output_path = os.path.join(UPLOAD_FOLDER, output_filename)
-        pyembroidery.write_dst(pattern, output_path)
+        # 3. Write each format to memory; several formats go out as one zip
+        if len(formats) == 1:
+            response = send_file(write_pattern(pattern, formats[0]), as_attachment=True,
+                                 download_name=f"{name}.{formats[0]}", mimetype='application/octet-stream')
+        else:
+            archive = io.BytesIO()
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for fmt in formats:
+                    zf.writestr(f"{name}.{fmt}", write_pattern(pattern, fmt).getvalue())
+            archive.seek(0)
+            response = send_file(archive, as_attachment=True, download_name=f"{name}.zip", mimetype='application/zip')
         
-        return send_file(output_path, as_attachment=True)
+        # Path stats, e.g. X-Stitch-Jumps: 412 and X-Stitch-Jumps-Before: 1630
+        for key, value in stats["after"].items():
+            header = "X-Stitch-" + key.replace("_", "-").title()
+            response.headers[header] = str(value)
+            response.headers[header + "-Before"] = str(stats["before"][key])
+        response.headers["Access-Control-Expose-Headers"] = ", ".join(h for h in response.headers.keys() if h.startswith("X-Stitch-"))
+        return response
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,11 +1,28 @@
 # halftone.py
-# This is a placeholder service for port 8006.
-# It will be expanded later to create halftone films.
+# Halftone film RIP for a full separation set (port 8006).
+# Screens every channel in parallel on a process pool and streams the films
+# back page by page, as one multi-page PDF or a zip of 1-bit G4 TIFFs.
 
-from fastapi import FastAPI, Body
+import asyncio
+import base64
+import io
+import time
+import zipfile
+import zlib
+from collections import deque
+from typing import AsyncIterator, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from PIL import Image
 import uvicorn
 
+from screening import StreamingPDF, screen_halftone
+from worker_pool import BoundedWorkerPool
+
 app = FastAPI()
 
 # Configure CORS
@@ -17,26 +34,185 @@ app.add_middleware(
     allow_headers=["*"], # Allows all headers
 )
 
+# One screened channel per task; the process pool spreads them across cores
+halftone_pool = BoundedWorkerPool("halftone", kind="process")
+
+# --- Pydantic Models ---
+class ChannelScreen(BaseModel):
+    name: str
+    image_b64: str
+    lpi: float = Field(55, gt=0)
+    angle: float = 22.5
+    dot_shape: str = "round"
+    print_order: Optional[int] = None
+    mesh_count: Optional[int] = None
+
+class HalftoneSetRequest(BaseModel):
+    design_name: str = "design"
+    channels: List[ChannelScreen] = Field(..., min_items=1)
+    # Resolution of the channel images, which is also the film resolution
+    dpi: float = Field(300, gt=0)
+    # "pdf" (one page per film) or "tiff" (zip of 1-bit TIFFs)
+    output: str = "pdf"
+    max_colors: Optional[int] = None
+
+# --- Screening (runs in the pool) ---
+def screen_channel(channel: dict, dpi: float, output: str) -> dict:
+    """
+    Decode and screen one channel. Returns only the compressed film: a G4
+    TIFF for zips, or Flate-compressed 1-bit rows for PDF pages, so the
+    parent never holds full-resolution bitmaps.
+    """
+    image_b64 = channel["image_b64"]
+    image_data = base64.b64decode(image_b64.split(',')[1] if ',' in image_b64 else image_b64)
+    gray = np.asarray(Image.open(io.BytesIO(image_data)).convert("L"))
+    ink = screen_halftone(gray, channel["lpi"], channel["angle"], channel["dot_shape"], dpi)
+    height, width = ink.shape
+
+    if output == "tiff":
+        buffer = io.BytesIO()
+        Image.fromarray(~ink).save(buffer, format="TIFF", compression="group4", dpi=(dpi, dpi))
+        return {"width": width, "height": height, "data": buffer.getvalue()}
+
+    # DeviceGray 1 bpc: 0 is black, so pack the paper (not the ink) as ones
+    return {"width": width, "height": height, "data": zlib.compress(np.packbits(~ink, axis=1).tobytes(), 6)}
+
+# --- Streaming writers ---
+def film_page(pdf: StreamingPDF, film: dict, dpi: float, label: str) -> bytes:
+    """One film page: the screened art centred in a half-inch margin, with registration marks and a label."""
+    margin = 36.0
+    art_w, art_h = film["width"] * 72.0 / dpi, film["height"] * 72.0 / dpi
+    page_w, page_h = art_w + 2 * margin, art_h + 2 * margin
+
+    marks = []
+    for x, y in ((page_w / 2, margin / 2), (page_w / 2, page_h - margin / 2),
+                 (margin / 2, page_h / 2), (page_w - margin / 2, page_h / 2)):
+        marks.append(b"%.2f %.2f m %.2f %.2f l %.2f %.2f m %.2f %.2f l S" % (
+            x - 10, y, x + 10, y, x, y - 10, x, y + 10))
+        # Circle of radius 5 from four Bezier quarter arcs
+        r, k = 5.0, 5.0 * 0.5523
+        marks.append(b"%.2f %.2f m %.2f %.2f %.2f %.2f %.2f %.2f c %.2f %.2f %.2f %.2f %.2f %.2f c "
+                     b"%.2f %.2f %.2f %.2f %.2f %.2f c %.2f %.2f %.2f %.2f %.2f %.2f c S" % (
+            x + r, y, x + r, y + k, x + k, y + r, x, y + r,
+            x - k, y + r, x - r, y + k, x - r, y,
+            x - r, y - k, x - k, y - r, x, y - r,
+            x + k, y - r, x + r, y - k, x + r, y))
+
+    text = label.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+    content = b"\n".join([
+        b"q %.4f 0 0 %.4f %.4f %.4f cm /Film Do Q" % (art_w, art_h, margin, margin),
+        b"0.5 w 0 G",
+    ] + marks + [
+        b"BT /F1 8 Tf %.2f %.2f Td (%s) Tj ET" % (margin, margin / 2 - 3, text),
+    ])
+
+    image_id, header = pdf.begin_image(film["width"], film["height"])
+    return b"".join([header, pdf.write(film["data"]), pdf.end_image(),
+                     pdf.add_page(page_w, page_h, image_id, content)])
+
+class ChunkSink(io.RawIOBase):
+    """Write-only, unseekable sink that lets zipfile stream entries out as they are written."""
+
+    def __init__(self):
+        self.chunks = deque()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# --- Core Logic ---
+def film_label(channel: ChannelScreen, index: int) -> str:
+    order = channel.print_order if channel.print_order is not None else index + 1
+    mesh = f" | Mesh: {channel.mesh_count}" if channel.mesh_count else ""
+    return f"Print Order: {order} | Channel: {channel.name} | {channel.lpi} LPI @ {channel.angle} deg{mesh}"
+
+def film_filename(channel: ChannelScreen, index: int) -> str:
+    order = channel.print_order if channel.print_order is not None else index + 1
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in channel.name)
+    return f"{order:02d}_{safe}.tif"
+
+async def screened_films(request: HalftoneSetRequest) -> AsyncIterator[dict]:
+    """
+    Screen the channels on the pool and yield films in request order. At
+    most one task per worker is in flight, so only that many compressed
+    films are buffered however long the set is. The request was admitted
+    by check_capacity before streaming, so its channels are never rejected.
+    """
+    pending = deque()
+    channels = iter(request.channels)
+    for channel in channels:
+        pending.append(asyncio.ensure_future(halftone_pool.run_admitted(
+            screen_channel, channel.dict(), request.dpi, request.output)))
+        if len(pending) >= halftone_pool.max_workers:
+            break
+
+    try:
+        while pending:
+            film = await pending.popleft()
+            next_channel = next(channels, None)
+            if next_channel is not None:
+                pending.append(asyncio.ensure_future(halftone_pool.run_admitted(
+                    screen_channel, next_channel.dict(), request.dpi, request.output)))
+            yield film
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def stream_pdf(request: HalftoneSetRequest) -> AsyncIterator[bytes]:
+    pdf = StreamingPDF()
+    yield pdf.open()
+    index = 0
+    async for film in screened_films(request):
+        yield film_page(pdf, film, request.dpi, film_label(request.channels[index], index))
+        index += 1
+    yield pdf.close()
+
+async def stream_tiff_zip(request: HalftoneSetRequest) -> AsyncIterator[bytes]:
+    sink = ChunkSink()
+    index = 0
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for film in screened_films(request):
+            # G4 data is already compressed; store it as-is
+            info = zipfile.ZipInfo(film_filename(request.channels[index], index), time.localtime()[:6])
+            archive.writestr(info, film["data"])
+            index += 1
+            yield sink.drain()
+    yield sink.drain()
+
 @app.get("/health")
 def health_check():
     """Health check endpoint."""
     return {"status": "ok", "service": "Halftone Service"}
 
 @app.post("/generate-halftones")
-async def generate_halftones(data: dict = Body(...)):
+async def generate_halftones(request: HalftoneSetRequest):
     """
-    Placeholder endpoint for generating halftone PDFs.
+    Screens every channel at its own LPI, angle and dot shape and streams
+    the film set back as a multi-page PDF or a zip of 1-bit TIFFs.
     """
-    # In the future, this will do real processing.
-    # For now, it just returns a success message.
-    print("Halftone generation request received.")
-    
-    # Simulating a successful response
-    return {
-        "message": "Halftone service is running, but PDF generation is not yet implemented.",
-        "received_max_colors": data.get("max_colors"),
-        "design_name": data.get("design_name")
-    }
+    if request.output not in ("pdf", "tiff"):
+        raise HTTPException(status_code=400, detail="output must be 'pdf' or 'tiff'")
+    # Reject before the response starts; once streaming, errors can only truncate it
+    halftone_pool.check_capacity()
+
+    name = "".join(c if c.isalnum() or c in "-_" else "_" for c in request.design_name) or "design"
+    if request.output == "tiff":
+        return StreamingResponse(stream_tiff_zip(request), media_type="application/zip",
+                                 headers={"Content-Disposition": f"attachment; filename={name}_films.zip"})
+    return StreamingResponse(stream_pdf(request), media_type="application/pdf",
+                             headers={"Content-Disposition": f"attachment; filename={name}_films.pdf"})
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return halftone_pool.stats()
 
 if __name__ == "__main__":
     print("--- Starting Halftone Service on port 8006 ---")
@@ -6,6 +6,7 @@ import os
 import io
 import base64
 import logging
+from functools import lru_cache
 from typing import Tuple
 
 from flask import Flask, request, jsonify
@@ -87,30 +88,189 @@ def knockout_black_pixels(img: Image.Image, tolerance: int) -> Image.Image:
 
 
 def dither_alpha(img: Image.Image) -> Image.Image:
-    arr = np.array(img).astype(float)
-    h, w, _ = arr.shape
-    alpha = arr[:, :, 3]
+    return dither_channel(img, "alpha", "floyd_steinberg")
 
-    for y in range(h):
-        for x in range(w):
-            old = alpha[y, x]
-            new = 255 if old > 127 else 0
-            alpha[y, x] = new
-            err = old - new
 
-            if x + 1 < w:
-                alpha[y, x + 1] += err * 7 / 16
-            if x - 1 >= 0 and y + 1 < h:
-                alpha[y + 1, x - 1] += err * 3 / 16
-            if y + 1 < h:
-                alpha[y + 1, x] += err * 5 / 16
-            if x + 1 < w and y + 1 < h:
-                alpha[y + 1, x + 1] += err * 1 / 16
+def dither_channel(img: Image.Image, channel: str = "alpha", method: str = "floyd_steinberg",
+                   serpentine: bool = False, threshold: int = 128, matrix_size: int = 8) -> Image.Image:
+    if channel not in CHANNELS:
+        raise ValueError(f"Unknown channel '{channel}' (expected one of {', '.join(CHANNELS)})")
 
-    alpha = np.clip(alpha, 0, 255).astype(np.uint8)
-    arr[:, :, 3] = alpha
+    arr = np.array(img)
+    plane = arr[:, :, CHANNELS[channel]]
+
+    if method in ERROR_DIFFUSION_KERNELS:
+        arr[:, :, CHANNELS[channel]] = error_diffusion(plane, method, threshold, serpentine)
+    elif method == "bayer":
+        arr[:, :, CHANNELS[channel]] = ordered_dither(plane, bayer_matrix(matrix_size))
+    elif method == "blue_noise":
+        arr[:, :, CHANNELS[channel]] = ordered_dither(plane, blue_noise_matrix())
+    else:
+        methods = list(ERROR_DIFFUSION_KERNELS) + ["bayer", "blue_noise"]
+        raise ValueError(f"Unknown dither method '{method}' (expected one of {', '.join(methods)})")
+
+    return Image.fromarray(arr)
 
-    return Image.fromarray(arr.astype(np.uint8))
+# -----------------------------------------------------------------------------
+# Dithering
+# -----------------------------------------------------------------------------
+CHANNELS = {"red": 0, "green": 1, "blue": 2, "alpha": 3}
+
+# name -> (divisor, [(dy, dx, weight), ...]) for left-to-right scanning
+ERROR_DIFFUSION_KERNELS = {
+    "floyd_steinberg": (16, [(0, 1, 7), (1, -1, 3), (1, 0, 5), (1, 1, 1)]),
+    "atkinson": (8, [(0, 1, 1), (0, 2, 1), (1, -1, 1), (1, 0, 1), (1, 1, 1), (2, 0, 1)]),
+    "stucki": (42, [(0, 1, 8), (0, 2, 4),
+                    (1, -2, 2), (1, -1, 4), (1, 0, 8), (1, 1, 4), (1, 2, 2),
+                    (2, -2, 1), (2, -1, 2), (2, 0, 4), (2, 1, 2), (2, 2, 1)]),
+}
+
+
+def error_diffusion(plane: np.ndarray, kernel: str = "floyd_steinberg", threshold: int = 128,
+                    serpentine: bool = False) -> np.ndarray:
+    """
+    Error-diffuse an 8-bit plane to 0/255. Errors are carried as integers
+    (each tap adds round(err * weight / divisor)), so the result is
+    bit-exact across runs and identical between the two schedulers.
+
+    Raster scans run as wavefronts: with a skew k chosen so every tap
+    source precedes its target, all pixels on x + k*y = t are independent,
+    and in a padded flat buffer each wavefront (and each tap target) is one
+    strided slice. Serpentine scans reverse every other row, which
+    serializes rows, so they run row by row with only the same-row taps
+    in Python and the lower-row taps vectorized.
+    """
+    divisor, taps = ERROR_DIFFUSION_KERNELS[kernel]
+    h, w = plane.shape
+    half = divisor // 2
+    pad = max(abs(dx) for _, dx, _ in taps)
+    depth = max(dy for dy, _, _ in taps)
+    stride = w + 2 * pad
+
+    buf = np.zeros((h + depth, stride), dtype=np.int32)
+    buf[:h, pad:pad + w] = plane
+    out = np.zeros((h + depth, stride), dtype=np.uint8)
+
+    if serpentine:
+        same_row = [(dx, weight) for dy, dx, weight in taps if dy == 0]
+        lower_rows = [(dy, dx, weight) for dy, dx, weight in taps if dy > 0]
+        for y in range(h):
+            direction = 1 if y % 2 == 0 else -1
+            values = buf[y].tolist()
+            errors = [0] * stride
+            inked = [0] * stride
+            xs = range(pad, pad + w) if direction == 1 else range(pad + w - 1, pad - 1, -1)
+            for x in xs:
+                value = values[x]
+                on = value >= threshold
+                error = value - 255 if on else value
+                inked[x] = 255 if on else 0
+                errors[x] = error
+                for dx, weight in same_row:
+                    values[x + dx * direction] += (error * weight + half) // divisor
+            out[y] = inked
+            errors = np.array(errors, dtype=np.int32)
+            for dy, dx, weight in lower_rows:
+                shift = dx * direction
+                buf[y + dy, pad + shift:pad + shift + w] += (errors[pad:pad + w] * weight + half) // divisor
+        return out[:h, pad:pad + w]
+
+    skew = max([1] + [-dx // dy + 1 for dy, dx, _ in taps if dy > 0])
+    step = stride - skew
+    flat, flat_out = buf.ravel(), out.ravel()
+    offsets = [(dy * stride + dx, weight) for dy, dx, weight in taps]
+
+    for t in range(w + skew * (h - 1)):
+        y_lo = max(0, -(-(t - w + 1) // skew))
+        y_hi = min(h - 1, t // skew)
+        if y_lo > y_hi:
+            continue
+        start = y_lo * stride + pad + t - skew * y_lo
+        stop = start + (y_hi - y_lo) * step + 1
+
+        values = flat[start:stop:step]
+        on = values >= threshold
+        errors = values - on * np.int32(255)
+        flat_out[start:stop:step] = on * np.uint8(255)
+        for offset, weight in offsets:
+            flat[start + offset:stop + offset:step] += (errors * weight + half) // divisor
+
+    return out[:h, pad:pad + w]
+
+
+@lru_cache(maxsize=8)
+def bayer_matrix(size: int = 8) -> np.ndarray:
+    """Recursive Bayer index matrix (size a power of two), as 0-255 thresholds."""
+    if size < 2 or size & (size - 1):
+        raise ValueError("Bayer matrix size must be a power of two >= 2")
+    matrix = np.array([[0, 2], [3, 1]])
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    thresholds = (matrix + 0.5) / matrix.size * 255
+    thresholds.setflags(write=False)
+    return thresholds
+
+
+@lru_cache(maxsize=2)
+def blue_noise_matrix(size: int = 64, sigma: float = 1.5) -> np.ndarray:
+    """
+    Blue-noise threshold matrix by Ulichney's void-and-cluster method, with
+    a toroidal Gaussian energy filter updated incrementally. Seeded, so the
+    matrix (and every dither using it) is identical across runs.
+    """
+    coords = np.minimum(np.arange(size), size - np.arange(size))
+    kernel = np.exp(-(coords[:, None] ** 2 + coords[None, :] ** 2) / (2 * sigma * sigma)).ravel()
+    n = size * size
+    rolled = lambda index: np.roll(kernel.reshape(size, size), divmod(index, size), axis=(0, 1)).ravel()
+
+    def energy_of(pattern):
+        spectrum = np.fft.fft2(kernel.reshape(size, size))
+        return np.real(np.fft.ifft2(np.fft.fft2(pattern.reshape(size, size)) * spectrum)).ravel()
+
+    # Initial pattern: 10% random points relaxed until no cluster/void swap helps
+    rng = np.random.RandomState(0)
+    pattern = np.zeros(n, dtype=bool)
+    pattern[rng.choice(n, n // 10, replace=False)] = True
+    energy = energy_of(pattern)
+    while True:
+        cluster = int(np.argmax(np.where(pattern, energy, -np.inf)))
+        pattern[cluster] = False
+        energy -= rolled(cluster)
+        void = int(np.argmin(np.where(pattern, np.inf, energy)))
+        pattern[void] = True
+        energy += rolled(void)
+        if void == cluster:
+            break
+
+    ranks = np.zeros(n, dtype=np.int64)
+    initial, initial_energy = pattern.copy(), energy.copy()
+
+    # Phase 1: rank the initial points by removing tightest clusters
+    for rank in range(int(pattern.sum()) - 1, -1, -1):
+        cluster = int(np.argmax(np.where(pattern, energy, -np.inf)))
+        pattern[cluster] = False
+        energy -= rolled(cluster)
+        ranks[cluster] = rank
+
+    # Phases 2 and 3: fill the largest voids until the matrix is full
+    pattern, energy = initial, initial_energy
+    for rank in range(int(pattern.sum()), n):
+        void = int(np.argmin(np.where(pattern, np.inf, energy)))
+        pattern[void] = True
+        energy += rolled(void)
+        ranks[void] = rank
+
+    thresholds = ((ranks + 0.5) / n * 255).reshape(size, size)
+    thresholds.setflags(write=False)
+    return thresholds
+
+
+def ordered_dither(plane: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    """Threshold an 8-bit plane against a tiled threshold matrix, to 0/255."""
+    h, w = plane.shape
+    th, tw = thresholds.shape
+    tiled = np.tile(thresholds, (-(-h // th), -(-w // tw)))[:h, :w]
+    return np.where(plane > tiled, 255, 0).astype(np.uint8)
 
 # -----------------------------------------------------------------------------
 # Routes
@@ -136,8 +296,16 @@ def route_fix_transparency():
     try:
         data = get_json()
         img = decode_base64_image(data.get("image"))
-
-        result = dither_alpha(img)
+        options = data.get("options", {})
+
+        result = dither_channel(
+            img,
+            "alpha",
+            options.get("method", "floyd_steinberg"),
+            bool(options.get("serpentine", False)),
+            max(1, min(255, int(options.get("threshold", 128)))),
+            int(options.get("matrix_size", 8))
+        )
         return jsonify({"image": encode_base64_image(result)})
 
     except Exception as e:
@@ -145,6 +313,30 @@ def route_fix_transparency():
         return fail(str(e), 500)
 
 
+@app.route("/dither", methods=["POST"])
+def route_dither():
+    try:
+        data = get_json()
+        img = decode_base64_image(data.get("image"))
+        options = data.get("options", {})
+
+        result = dither_channel(
+            img,
+            options.get("channel", "alpha"),
+            options.get("method", "floyd_steinberg"),
+            bool(options.get("serpentine", False)),
+            max(1, min(255, int(options.get("threshold", 128)))),
+            int(options.get("matrix_size", 8))
+        )
+        return jsonify({"image": encode_base64_image(result)})
+
+    except ValueError as e:
+        return fail(str(e), 400)
+    except Exception as e:
+        log.exception("dither failed")
+        return fail(str(e), 500)
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "online", "service": SERVICE_NAME})
@@ -8,23 +8,43 @@ import base64
 import json
 import asyncio
 import hashlib
+import heapq
 import io
+import multiprocessing
+import os
+import pickle
+import shutil
+import struct
+import threading
+import time
+import uuid
 import tempfile
 import warnings
+import weakref
+import zipfile
+import zlib
 warnings.filterwarnings('ignore')
 
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+from functools import lru_cache
 from datetime import datetime
 from pathlib import Path
 
 import numpy as np
 import cv2
-from fastapi import FastAPI, Body, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, Body, HTTPException, UploadFile, File, Form, BackgroundTasks, Header
 from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
+from worker_pool import BoundedWorkerPool
+
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 from scipy.ndimage import gaussian_filter, median_filter, distance_transform_edt
 import colorsys
@@ -40,14 +60,19 @@ from skimage.segmentation import felzenszwalb, slic, watershed
 from skimage.restoration import denoise_bilateral
 from skimage.color import rgb2hed, hed2rgb
 
+# Bump whenever separation output changes so stale cache spill files are ignored
+CACHE_VERSION = "3.0.5"
+
 # ============ MODELS & ENUMS ============
 
 class SeparationMethod(str, Enum):
     GRADIENT_AWARE = "gradient_aware"
     MEDIAN_CUT = "median_cut"
     WATERSHED = "watershed"
+    SUPERPIXEL = "superpixel"  # SLIC regions merged in Lab
     SIMULATED_PROCESS = "simulated_process"  # Fixed spot colors for dark garments
     OCTREE = "octree"
+    AUTO = "auto"  # Routed from the image fingerprint
 
 class ChannelType(str, Enum):
     UNDERBASE = "underbase"
@@ -70,6 +95,23 @@ class FabricType(str, Enum):
     DARK = "dark"
     LIGHT = "light"
 
+class DeltaEMetric(str, Enum):
+    CIE76 = "cie76"
+    CIEDE2000 = "ciede2000"
+
+class ColorCountMode(str, Enum):
+    AUTO = "auto"      # Exact below ECL_EXACT_COLOR_PIXELS, sketch above
+    EXACT = "exact"    # 2^24-entry presence bitmap
+    SKETCH = "sketch"  # HyperLogLog estimate (~1.6% error), 4K registers
+
+class ResponseFormat(str, Enum):
+    JSON = "json"  # Base64 PNG data URIs inline
+    ZIP = "zip"    # Streamed archive: manifest.json plus one file per plane
+
+class MaskEncoding(str, Enum):
+    PNG = "png"
+    RAW = "raw"  # Headerless uint8 rows; dimensions are in the manifest
+
 class ColorAdjustment(BaseModel):
     """Color adjustment parameters"""
     brightness: float = Field(0.0, ge=-100, le=100)
@@ -104,13 +146,18 @@ class ProcessRequest(BaseModel):
     color_adjustment: Optional[ColorAdjustment] = None
     custom_colors: Optional[List[str]] = None  # For manual color selection
     match_pantone: bool = False
+    full_resolution: bool = False  # Render films at native size instead of the 1200px proxy
+    tile_size: int = Field(1024, ge=256, le=4096)
+    session_id: Optional[str] = None  # Reuse cached pipeline stages across tweaks of one artwork
+    fast_palette: bool = True  # gradient_aware on a budget-sized proxy instead of full resolution
+    palette_budget_ms: int = Field(150, ge=20, le=10000)
 
 class ColorChannel(BaseModel):
     name: str
     color: str  # Hex color
     pantone: Optional[str] = None  # Pantone code if matched
     type: ChannelType
-    image: str  # Base64 mask
+    image: str = ""  # Base64 mask, filled in when the result is encoded
     opacity: float = 1.0
     blend_mode: str = "normal"
     printable: bool = True
@@ -119,6 +166,12 @@ class ColorChannel(BaseModel):
     halftone_pattern: Optional[str] = None
     coverage_percent: float = 0.0
     locked: bool = False
+    
+    # Raw uint8 planes kept in memory until the response is encoded
+    _mask: Optional[np.ndarray] = PrivateAttr(default=None)
+    _halftone: Optional[np.ndarray] = PrivateAttr(default=None)
+    # Backing files of memory-mapped planes (tiled results), kept alive with the channel
+    _files: Optional[Any] = PrivateAttr(default=None)
 
 class SeparationResult(BaseModel):
     channels: List[ColorChannel]
@@ -130,6 +183,8 @@ class SeparationResult(BaseModel):
     separation_quality: float
     recommendations: List[str]
     histogram: Optional[Dict[str, List[int]]] = None
+    
+    _preview: Optional[np.ndarray] = PrivateAttr(default=None)
 
 # ============ PANTONE MATCHING SERVICE ============
 
@@ -138,43 +193,63 @@ class PantoneMatchingService:
     
     def __init__(self, pantone_json_path='pantone-coated.json'):
         self.pantones = []
-        self.pantone_lab = []
+        # Contiguous (N, 3) Lab table and k-d tree over it, built once at load
+        self.lab_array = np.empty((0, 3), dtype=np.float64)
+        self.tree = None
         
         try:
             with open(pantone_json_path, 'r') as f:
                 self.pantones = json.load(f)
             
-            # Pre-convert all Pantone colors to Lab for fast matching
-            for p in self.pantones:
-                hex_color = p['hex'].lstrip('#')
-                rgb = np.array([int(hex_color[i:i+2], 16) for i in (0, 2, 4)])
-                lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
-                self.pantone_lab.append({
-                    'pantone': p['pantone'],
-                    'hex': p['hex'],
-                    'lab': lab
-                })
+            if self.pantones:
+                # Pre-convert the whole library to Lab in a single call
+                rgb = np.array([[int(p['hex'].lstrip('#')[i:i+2], 16) for i in (0, 2, 4)]
+                                for p in self.pantones], dtype=np.float64)
+                lab = color.rgb2lab(rgb.reshape(1, -1, 3) / 255.0)[0]
+                self.lab_array = np.ascontiguousarray(lab)
+                self.tree = cKDTree(self.lab_array)
         except FileNotFoundError:
             print("Warning: pantone-coated.json not found. Pantone matching disabled.")
     
-    def find_closest_pantone(self, color_lab: np.ndarray, max_distance: float = 20.0) -> Optional[dict]:
-        """Find closest Pantone match using Delta E (CIE76)"""
-        if not self.pantone_lab:
-            return None
+    def match_many(self, colors_lab, k: int = 1,
+                   metric: DeltaEMetric = DeltaEMetric.CIE76) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the top-k Pantone candidates for a whole palette in one pass.
+        Returns (distances, indices), both shaped (n_colors, k) and sorted
+        nearest first. CIE76 queries the k-d tree; CIEDE2000 is evaluated
+        exactly against the full library with broadcasting.
+        """
+        queries = np.asarray(colors_lab, dtype=np.float64).reshape(-1, 3)
+        k = max(1, min(int(k), len(self.lab_array)))
         
-        min_distance = float('inf')
-        closest = None
+        if self.tree is None or len(queries) == 0:
+            return np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype=np.intp)
         
-        for p in self.pantone_lab:
-            # Calculate Delta E (CIE76 - simple but effective)
-            distance = np.sqrt(np.sum((color_lab - p['lab']) ** 2))
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest = p
+        if DeltaEMetric(metric) == DeltaEMetric.CIEDE2000:
+            dist = color.deltaE_ciede2000(queries[:, None, :], self.lab_array[None, :, :])
+            if k < dist.shape[1]:
+                indices = np.argpartition(dist, k - 1, axis=1)[:, :k]
+            else:
+                indices = np.broadcast_to(np.arange(dist.shape[1]), dist.shape)
+            distances = np.take_along_axis(dist, indices, axis=1)
+            order = np.argsort(distances, axis=1, kind='stable')
+            return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+        
+        distances, indices = self.tree.query(queries, k=k)
+        return distances.reshape(len(queries), k), indices.reshape(len(queries), k)
+    
+    def find_closest_pantone(self, color_lab: np.ndarray, max_distance: float = 20.0,
+                             metric: DeltaEMetric = DeltaEMetric.CIE76) -> Optional[dict]:
+        """Find closest Pantone match using Delta E (CIE76 by default)"""
+        if self.tree is None:
+            return None
+        
+        distances, indices = self.match_many(color_lab, k=1, metric=metric)
+        min_distance = distances[0, 0]
         
         # Only return match if distance is reasonable
         if min_distance <= max_distance:
+            closest = self.pantones[indices[0, 0]]
             return {
                 'pantone': closest['pantone'],
                 'hex': closest['hex'],
@@ -183,128 +258,148 @@ class PantoneMatchingService:
         
         return None
     
-    def match_palette(self, colors_lab: List[np.ndarray]) -> List[Dict[str, Any]]:
+    def match_palette(self, colors_lab: List[np.ndarray], max_distance: float = 20.0,
+                      metric: DeltaEMetric = DeltaEMetric.CIE76) -> List[Dict[str, Any]]:
         """Match a list of colors to Pantone"""
+        if self.tree is None or len(colors_lab) == 0:
+            return []
+        
+        distances, indices = self.match_many(colors_lab, k=1, metric=metric)
         matches = []
-        for color_lab in colors_lab:
-            match = self.find_closest_pantone(color_lab)
-            if match:
-                matches.append(match)
+        for distance, index in zip(distances[:, 0], indices[:, 0]):
+            if distance <= max_distance:
+                closest = self.pantones[index]
+                matches.append({
+                    'pantone': closest['pantone'],
+                    'hex': closest['hex'],
+                    'distance': float(distance)
+                })
         return matches
 
 # ============ COLOR ADJUSTMENT ENGINE ============
 
 class ColorAdjustmentEngine:
-    """Professional color adjustment tools"""
+    """
+    Professional color adjustment tools.
+    
+    Every adjustment except HSL maps each 8-bit channel value independently,
+    so it is expressed as a 256-entry lookup table. apply_all_adjustments
+    composes those tables and applies them with cv2.LUT, so the whole
+    pipeline costs one pass over the image (three plus the HSV round trip
+    when HSL is active) instead of one float pass per adjustment.
+    """
     
     @staticmethod
-    def apply_brightness_contrast(img: np.ndarray, brightness: float, contrast: float) -> np.ndarray:
-        """Apply brightness and contrast adjustments"""
+    def _frozen(table: np.ndarray) -> np.ndarray:
+        # Tables are shared through lru_cache; make accidental mutation loud
+        table.setflags(write=False)
+        return table
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def brightness_contrast_lut(brightness: float, contrast: float) -> np.ndarray:
+        """Lookup table for brightness and contrast"""
         # Normalize to -1 to 1 range
         brightness = brightness / 100.0
         contrast = contrast / 100.0
         
-        # Convert to float
-        img_float = img.astype(np.float32) / 255.0
-        
-        # Apply brightness
-        img_float = img_float + brightness
-        
-        # Apply contrast
+        values = np.arange(256, dtype=np.float32) / 255.0 + brightness
         factor = (259 * (contrast + 1)) / (259 - contrast)
-        img_float = factor * (img_float - 0.5) + 0.5
-        
-        # Clip and convert back
-        img_float = np.clip(img_float * 255, 0, 255).astype(np.uint8)
-        return img_float
+        values = factor * (values - 0.5) + 0.5
+        return ColorAdjustmentEngine._frozen(np.clip(values * 255, 0, 255).astype(np.uint8))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def gamma_lut(gamma: float) -> np.ndarray:
+        """Lookup table for gamma correction"""
+        values = (np.arange(256) / 255.0) ** (1.0 / gamma) * 255
+        return ColorAdjustmentEngine._frozen(values.astype(np.uint8))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def levels_lut(input_black: int, input_white: int, gamma: float) -> np.ndarray:
+        """Lookup table for levels (input range and midtone gamma)"""
+        values = np.arange(256, dtype=np.float32)
+        values = np.clip((values - input_black) / max(input_white - input_black, 1), 0, 1)
+        values = np.power(values, 1.0 / gamma)
+        return ColorAdjustmentEngine._frozen((values * 255).astype(np.uint8))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def color_balance_lut(cyan_red: float, magenta_green: float, yellow_blue: float) -> np.ndarray:
+        """(1, 256, 3) lookup table shifting the R, G and B channels"""
+        values = np.arange(256, dtype=np.float32)
+        # -100 to 100 -> -255 to 255
+        shifts = [cyan_red * 2.55, magenta_green * 2.55, yellow_blue * 2.55]
+        table = np.stack([np.clip(values + shift, 0, 255) for shift in shifts], axis=-1)
+        return ColorAdjustmentEngine._frozen(table.astype(np.uint8).reshape(1, 256, 3))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def curves_lut(control_points: Tuple[Tuple[int, int], ...]) -> np.ndarray:
+        """Lookup table interpolating linearly between sorted control points"""
+        control_points = sorted(control_points, key=lambda p: p[0])
+        inputs = np.arange(256, dtype=np.float64)
+        lut = np.zeros(256, dtype=np.float64)
+        assigned = np.zeros(256, dtype=bool)
+        
+        # First matching segment wins, as when points share an x value
+        for (x1, y1), (x2, y2) in zip(control_points[:-1], control_points[1:]):
+            segment = (inputs >= x1) & (inputs <= x2) & ~assigned
+            t = (inputs[segment] - x1) / (x2 - x1) if x2 != x1 else 0
+            lut[segment] = y1 + t * (y2 - y1)
+            assigned |= segment
+        
+        return ColorAdjustmentEngine._frozen(np.clip(np.trunc(lut), 0, 255).astype(np.uint8))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def hsl_lut(hue: float, saturation: float, lightness: float) -> np.ndarray:
+        """
+        (1, 256, 3) lookup table over OpenCV's 8-bit HSV planes. Hue rotation
+        and saturation/value scaling are separable in HSV, so a per-plane
+        table between two cvtColor calls replaces a full 3D RGB table.
+        """
+        values = np.arange(256, dtype=np.float32)
+        h = (values + hue) % 180
+        s = np.clip(values * (1.0 + saturation / 100.0), 0, 255)
+        v = np.clip(values * (1.0 + lightness / 100.0), 0, 255)
+        return ColorAdjustmentEngine._frozen(np.stack([h, s, v], axis=-1).astype(np.uint8).reshape(1, 256, 3))
+    
+    @staticmethod
+    def apply_brightness_contrast(img: np.ndarray, brightness: float, contrast: float) -> np.ndarray:
+        """Apply brightness and contrast adjustments"""
+        return cv2.LUT(img, ColorAdjustmentEngine.brightness_contrast_lut(brightness, contrast))
     
     @staticmethod
     def apply_hsl(img_rgb: np.ndarray, hue: float, saturation: float, lightness: float) -> np.ndarray:
         """Apply HSL adjustments"""
-        # Convert to HSV (easier to work with)
-        img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV).astype(np.float32)
-        
-        # Adjust hue (-180 to 180 degrees)
-        img_hsv[:, :, 0] = (img_hsv[:, :, 0] + hue) % 180
-        
-        # Adjust saturation
-        sat_factor = 1.0 + (saturation / 100.0)
-        img_hsv[:, :, 1] = np.clip(img_hsv[:, :, 1] * sat_factor, 0, 255)
-        
-        # Adjust value (lightness)
-        light_factor = 1.0 + (lightness / 100.0)
-        img_hsv[:, :, 2] = np.clip(img_hsv[:, :, 2] * light_factor, 0, 255)
-        
-        # Convert back to RGB
-        img_hsv = img_hsv.astype(np.uint8)
-        img_rgb = cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB)
-        return img_rgb
+        # Work in HSV (easier to work with); hue is 0-180 in 8-bit OpenCV
+        img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+        img_hsv = cv2.LUT(img_hsv, ColorAdjustmentEngine.hsl_lut(hue, saturation, lightness))
+        return cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB)
     
     @staticmethod
     def apply_gamma(img: np.ndarray, gamma: float) -> np.ndarray:
         """Apply gamma correction"""
-        inv_gamma = 1.0 / gamma
-        table = np.array([((i / 255.0) ** inv_gamma) * 255 
-                         for i in range(256)]).astype(np.uint8)
-        return cv2.LUT(img, table)
+        return cv2.LUT(img, ColorAdjustmentEngine.gamma_lut(gamma))
     
     @staticmethod
     def apply_levels(img: np.ndarray, input_black: int, input_white: int, gamma: float) -> np.ndarray:
         """Apply levels adjustment (like Photoshop)"""
-        # Normalize input range
-        img_float = img.astype(np.float32)
-        
-        # Input levels
-        img_float = np.clip((img_float - input_black) / (input_white - input_black), 0, 1)
-        
-        # Gamma
-        img_float = np.power(img_float, 1.0 / gamma)
-        
-        # Scale back to 0-255
-        img_float = (img_float * 255).astype(np.uint8)
-        return img_float
+        return cv2.LUT(img, ColorAdjustmentEngine.levels_lut(input_black, input_white, gamma))
     
     @staticmethod
     def apply_color_balance(img_rgb: np.ndarray, cyan_red: float, magenta_green: float, yellow_blue: float) -> np.ndarray:
         """Apply color balance adjustments"""
-        img_float = img_rgb.astype(np.float32)
-        
-        # Red channel adjustment
-        img_float[:, :, 0] += cyan_red * 2.55  # -100 to 100 -> -255 to 255
-        
-        # Green channel adjustment
-        img_float[:, :, 1] += magenta_green * 2.55
-        
-        # Blue channel adjustment
-        img_float[:, :, 2] += yellow_blue * 2.55
-        
-        return np.clip(img_float, 0, 255).astype(np.uint8)
+        return cv2.LUT(img_rgb, ColorAdjustmentEngine.color_balance_lut(cyan_red, magenta_green, yellow_blue))
     
     @staticmethod
     def apply_curves(img: np.ndarray, control_points: List[Tuple[int, int]]) -> np.ndarray:
         """Apply curves adjustment using control points"""
         if not control_points or len(control_points) < 2:
             return img
-        
-        # Sort control points by x value
-        control_points = sorted(control_points, key=lambda p: p[0])
-        
-        # Create lookup table using linear interpolation
-        lut = np.zeros(256, dtype=np.uint8)
-        
-        for i in range(256):
-            # Find surrounding control points
-            for j in range(len(control_points) - 1):
-                x1, y1 = control_points[j]
-                x2, y2 = control_points[j + 1]
-                
-                if x1 <= i <= x2:
-                    # Linear interpolation
-                    t = (i - x1) / (x2 - x1) if x2 != x1 else 0
-                    lut[i] = int(y1 + t * (y2 - y1))
-                    break
-        
-        return cv2.LUT(img, lut)
+        return cv2.LUT(img, ColorAdjustmentEngine.curves_lut(tuple(map(tuple, control_points))))
     
     @staticmethod
     def calculate_histogram(img: np.ndarray) -> Dict[str, List[int]]:
@@ -316,31 +411,78 @@ class ColorAdjustmentEngine:
         }
         return histogram
     
-    def apply_all_adjustments(self, img_rgb: np.ndarray, adjustments: ColorAdjustment) -> np.ndarray:
-        """Apply all color adjustments in order"""
-        img = img_rgb.copy()
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def build_adjustment_luts(input_black: int, input_white: int, gamma: float,
+                              curves: Optional[Tuple[Tuple[int, int], ...]],
+                              brightness: float, contrast: float,
+                              hue: float, saturation: float, lightness: float,
+                              cyan_red: float, magenta_green: float, yellow_blue: float
+                              ) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], Optional[np.ndarray]]:
+        """
+        Compose the adjustment pipeline into (pre, hsl, post) tables, any of
+        which may be None when it would be the identity:
+        
+        - pre: levels -> curves -> brightness/contrast, shared by all channels
+        - hsl: per-plane HSV table, applied between cvtColor round trips
+        - post: color balance, per channel
+        
+        Without HSL the pre table is folded into post, leaving a single LUT.
+        """
+        engine = ColorAdjustmentEngine
+        pre = np.arange(256, dtype=np.uint8)
+        identity = True
         
         # 1. Levels
-        if adjustments.input_black != 0 or adjustments.input_white != 255 or adjustments.gamma != 1.0:
-            img = self.apply_levels(img, adjustments.input_black, adjustments.input_white, adjustments.gamma)
+        if input_black != 0 or input_white != 255 or gamma != 1.0:
+            pre = engine.levels_lut(input_black, input_white, gamma)[pre]
+            identity = False
         
         # 2. Curves
-        if adjustments.curves:
-            img = self.apply_curves(img, adjustments.curves)
+        if curves and len(curves) >= 2:
+            pre = engine.curves_lut(curves)[pre]
+            identity = False
         
         # 3. Brightness/Contrast
-        if adjustments.brightness != 0 or adjustments.contrast != 0:
-            img = self.apply_brightness_contrast(img, adjustments.brightness, adjustments.contrast)
+        if brightness != 0 or contrast != 0:
+            pre = engine.brightness_contrast_lut(brightness, contrast)[pre]
+            identity = False
         
         # 4. HSL
-        if adjustments.hue != 0 or adjustments.saturation != 0 or adjustments.lightness != 0:
-            img = self.apply_hsl(img, adjustments.hue, adjustments.saturation, adjustments.lightness)
+        hsl = None
+        if hue != 0 or saturation != 0 or lightness != 0:
+            hsl = engine.hsl_lut(hue, saturation, lightness)
         
         # 5. Color Balance
-        if adjustments.cyan_red != 0 or adjustments.magenta_green != 0 or adjustments.yellow_blue != 0:
-            img = self.apply_color_balance(img, adjustments.cyan_red, adjustments.magenta_green, adjustments.yellow_blue)
+        post = None
+        if cyan_red != 0 or magenta_green != 0 or yellow_blue != 0:
+            post = engine.color_balance_lut(cyan_red, magenta_green, yellow_blue)
+            if hsl is None and not identity:
+                post = np.stack([post[0, pre, c] for c in range(3)], axis=-1).reshape(1, 256, 3)
+                identity = True
+        
+        pre = None if identity else engine._frozen(pre)
+        return pre, hsl, None if post is None else engine._frozen(post)
+    
+    def apply_all_adjustments(self, img_rgb: np.ndarray, adjustments: ColorAdjustment) -> np.ndarray:
+        """Apply all color adjustments in order as fused lookup tables"""
+        curves = tuple(map(tuple, adjustments.curves)) if adjustments.curves else None
+        pre, hsl, post = self.build_adjustment_luts(
+            adjustments.input_black, adjustments.input_white, adjustments.gamma, curves,
+            adjustments.brightness, adjustments.contrast,
+            adjustments.hue, adjustments.saturation, adjustments.lightness,
+            adjustments.cyan_red, adjustments.magenta_green, adjustments.yellow_blue
+        )
+        
+        img = img_rgb
+        if pre is not None:
+            img = cv2.LUT(img, pre)
+        if hsl is not None:
+            img = self.apply_hsl(img, adjustments.hue, adjustments.saturation, adjustments.lightness)
+        if post is not None:
+            img = cv2.LUT(img, post)
         
-        return img
+        return img.copy() if img is img_rgb else img
 
 # ============ ADVANCED COLOR SEPARATION ALGORITHMS ============
 
@@ -360,81 +502,260 @@ class ColorSeparationAlgorithms:
         for i, (y, x) in enumerate(coordinates[:num_colors]):
             markers[y, x] = i + 1
         
-        labels = watershed(gradient, markers)
+        labels = watershed(gradient, markers).ravel()
         
-        colors_lab = []
-        for label in range(1, np.max(labels) + 1):
-            mask = labels == label
-            if np.sum(mask) > 100:
-                region_color = np.mean(img_lab[mask], axis=0)
-                colors_lab.append(region_color)
+        # Region means from one bincount per channel instead of a mask per label
+        counts = np.bincount(labels)
+        pixels = img_lab.reshape(-1, 3)
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(counts))
+                         for c in range(3)], axis=1)
         
+        colors_lab = [sums[label] / counts[label] for label in range(1, len(counts)) if counts[label] > 100]
         return colors_lab[:num_colors]
     
     @staticmethod
-    def color_quantization_median_cut(img_rgb: np.ndarray, num_colors: int = 8) -> List[np.ndarray]:
-        """Median cut algorithm - preserves color relationships."""
-        pixels = img_rgb.reshape(-1, 3).astype(np.float32)
+    def dominant_colors_superpixel(img_rgb: np.ndarray, num_colors: int = 8,
+                                   max_pixels: int = 384 * 384, n_segments: int = 300) -> List[np.ndarray]:
+        """
+        Region-based color extraction from SLIC superpixels on a proxy: region
+        means from one bincount per Lab channel, then Ward-style merging of
+        region means in Lab down to num_colors. Colors are returned largest
+        region first.
+        """
+        h, w = img_rgb.shape[:2]
+        if h * w > max_pixels:
+            scale = np.sqrt(max_pixels / (h * w))
+            img_rgb = cv2.resize(img_rgb, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                 interpolation=cv2.INTER_AREA)
         
-        def median_cut(pixels, depth=0, max_depth=4):
-            if depth >= max_depth or len(pixels) <= 1:
-                if len(pixels) > 0:
-                    return [np.mean(pixels, axis=0)]
-                return []
+        img_lab = color.rgb2lab(img_rgb / 255.0)
+        labels = slic(img_lab, n_segments=n_segments, compactness=10, max_num_iter=5, start_label=0,
+                      convert2lab=False, channel_axis=-1).ravel()
+        
+        weights = np.bincount(labels).astype(np.float64)
+        pixels = img_lab.reshape(-1, 3)
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=len(weights))
+                         for c in range(3)], axis=1)
+        present = weights > 0
+        centers, weights = sums[present] / weights[present, None], weights[present]
+        
+        centers, weights = ColorSeparationAlgorithms.ward_merge(centers, weights, num_colors)
+        
+        # Ignore specks under 100 px at full scale, but always keep the largest
+        # region so tiny images still get a palette
+        min_weight = min(100 * len(labels) / (h * w), weights[0]) if len(weights) else 0
+        return [center for center, weight in zip(centers, weights) if weight >= min_weight]
+    
+    @staticmethod
+    def ward_merge(centers: np.ndarray, weights: np.ndarray,
+                   num_colors: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Agglomerate weighted colors by smallest Ward cost until num_colors
+        remain, updating only the merged row/column of the cost matrix each
+        step. Returns (centers, weights) heaviest first.
+        """
+        centers = np.array(centers, dtype=np.float64)
+        weights = np.array(weights, dtype=np.float64)
+        active = np.ones(len(centers), dtype=bool)
+        
+        def ward_cost(k):
+            cost = ((centers - centers[k]) ** 2).sum(axis=1) * weights * weights[k] / (weights + weights[k])
+            cost[~active] = np.inf
+            cost[k] = np.inf
+            return cost
+        
+        cost = np.stack([ward_cost(k) for k in range(len(centers))]) if len(centers) else np.empty((0, 0))
+        for _ in range(len(centers) - num_colors):
+            i, j = np.unravel_index(np.argmin(cost), cost.shape)
+            total = weights[i] + weights[j]
+            centers[i] = (centers[i] * weights[i] + centers[j] * weights[j]) / total
+            weights[i] = total
+            active[j] = False
+            cost[j, :] = cost[:, j] = np.inf
+            cost[i, :] = cost[:, i] = ward_cost(i)
+        
+        order = [k for k in np.argsort(-weights, kind="stable") if active[k]]
+        return centers[order], weights[order]
+    
+    @staticmethod
+    def color_histogram(img_rgb: np.ndarray, bits: int = 5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Compact 3D color histogram: one vectorized pass over the pixels.
+        Returns the occupied bin coordinates (n, 3), pixel counts (n,) and the
+        per-channel pixel sums (n, 3) so bin means keep full precision.
+        """
+        pixels = img_rgb.reshape(-1, 3)
+        shift = 8 - bits
+        q = (pixels >> shift).astype(np.int32)
+        index = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+        
+        size = 1 << (3 * bits)
+        counts = np.bincount(index, minlength=size)
+        occupied = np.flatnonzero(counts)
+        sums = np.stack([np.bincount(index, weights=pixels[:, c], minlength=size)[occupied]
+                         for c in range(3)], axis=1)
+        
+        mask = (1 << bits) - 1
+        coords = np.stack([occupied >> (2 * bits), (occupied >> bits) & mask, occupied & mask], axis=1)
+        return coords, counts[occupied].astype(np.float64), sums
+    
+    @staticmethod
+    def histogram_median_cut(coords: np.ndarray, counts: np.ndarray, sums: np.ndarray,
+                             num_colors: int) -> List[np.ndarray]:
+        """
+        Variance-driven median cut over histogram bins: repeatedly split the
+        box with the largest squared error at the weighted median of its
+        widest-variance axis. Works for any palette size; cost depends on
+        the number of occupied bins, not pixels. Colors are returned most
+        populous first.
+        """
+        means = sums / counts[:, None]
+        
+        def box_stats(members):
+            weight = counts[members]
+            center = (sums[members].sum(axis=0)) / weight.sum()
+            variance = (weight[:, None] * (means[members] - center) ** 2).sum(axis=0)
+            return variance.sum(), variance
+        
+        boxes = [(np.arange(len(counts)),) + box_stats(np.arange(len(counts)))]
+        while len(boxes) < num_colors:
+            splittable = [i for i, box in enumerate(boxes) if box[1] > 0 and len(box[0]) > 1]
+            if not splittable:
+                break
+            members, _, variance = boxes.pop(max(splittable, key=lambda i: boxes[i][1]))
             
-            ranges = np.ptp(pixels, axis=0)
-            channel = np.argmax(ranges)
-            pixels = pixels[pixels[:, channel].argsort()]
-            median_idx = len(pixels) // 2
+            # Split between distinct bin coordinates on the chosen axis
+            axis = int(np.argmax(variance))
+            values = coords[members, axis]
+            if values.min() == values.max():
+                axis = int(np.argmax(np.ptp(coords[members], axis=0)))
+                values = coords[members, axis]
             
-            colors1 = median_cut(pixels[:median_idx], depth + 1, max_depth)
-            colors2 = median_cut(pixels[median_idx:], depth + 1, max_depth)
+            order = np.argsort(values, kind="stable")
+            cumulative = np.cumsum(counts[members][order])
+            median = values[order][np.searchsorted(cumulative, cumulative[-1] / 2)]
+            if median == values.max():
+                median = values[values < median].max()
             
-            return colors1 + colors2
+            left = members[values <= median]
+            right = members[values > median]
+            boxes.append((left,) + box_stats(left))
+            boxes.append((right,) + box_stats(right))
         
-        colors_rgb = median_cut(pixels, max_depth=int(np.log2(num_colors)))
-        
-        colors_lab = []
-        for rgb in colors_rgb[:num_colors]:
-            lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
-            colors_lab.append(lab)
+        boxes.sort(key=lambda box: -counts[box[0]].sum())
+        return [sums[box[0]].sum(axis=0) / counts[box[0]].sum() for box in boxes]
+    
+    @staticmethod
+    def color_quantization_median_cut(img_rgb: np.ndarray, num_colors: int = 8) -> List[np.ndarray]:
+        """Median cut algorithm - preserves color relationships."""
+        coords, counts, sums = ColorSeparationAlgorithms.color_histogram(img_rgb)
+        colors_rgb = ColorSeparationAlgorithms.histogram_median_cut(coords, counts, sums, num_colors)
         
-        return colors_lab
+        colors_lab = color.rgb2lab(np.array(colors_rgb).reshape(1, -1, 3) / 255.0)[0]
+        return list(colors_lab)
+    
+    # Morton interleave: bit i of a channel value moves to bit 3i
+    _MORTON_SPREAD = np.array([sum(((v >> i) & 1) << (3 * i) for i in range(8)) for v in range(256)],
+                              dtype=np.uint32)
+    
+    @staticmethod
+    def octree_leaves(img_rgb: np.ndarray, depth: int = 6, max_leaves: int = 4096,
+                      rows: int = 256) -> Tuple[int, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Streaming octree construction. Pixels are turned into Morton codes
+        (R, G, B bits interleaved, so the top 3d bits are the path to a node
+        at depth d) and accumulated block by block into fixed-size bincount
+        arrays at ``depth``. Levels are then folded up until at most
+        ``max_leaves`` nodes remain. Returns (depth, leaf codes, counts, sums).
+        """
+        spread = ColorSeparationAlgorithms._MORTON_SPREAD
+        shift = 3 * (8 - depth)
+        size = 1 << (3 * depth)
+        counts = np.zeros(size, dtype=np.float64)
+        sums = np.zeros((size, 3), dtype=np.float64)
+        
+        for y in range(0, img_rgb.shape[0], rows):
+            block = img_rgb[y:y + rows].reshape(-1, 3)
+            codes = ((spread[block[:, 0]] << 2) | (spread[block[:, 1]] << 1) | spread[block[:, 2]]) >> shift
+            counts += np.bincount(codes, minlength=size)
+            for c in range(3):
+                sums[:, c] += np.bincount(codes, weights=block[:, c], minlength=size)
+        
+        leaves = np.flatnonzero(counts)
+        counts, sums = counts[leaves], sums[leaves]
+        while len(leaves) > max_leaves and depth > 1:
+            leaves, inverse = np.unique(leaves >> 3, return_inverse=True)
+            counts = np.bincount(inverse, weights=counts)
+            sums = np.stack([np.bincount(inverse, weights=sums[:, c]) for c in range(3)], axis=1)
+            depth -= 1
+        return depth, leaves, counts, sums
+    
+    @staticmethod
+    def octree_reduce(depth: int, leaves: np.ndarray, counts: np.ndarray, sums: np.ndarray,
+                      num_colors: int) -> List[np.ndarray]:
+        """
+        Classic octree reduction: repeatedly fold the deepest, least populated
+        node whose children are all leaves into a single leaf. Folds that
+        would drop below num_colors are skipped; whatever excess remains
+        (typically a few top-level nodes) is Ward-merged to exactly
+        num_colors. Returns mean RGB colors, most populous first. Ties break
+        on node code, so output is stable.
+        """
+        # node (depth, code) -> [count, sums]; children per internal node
+        nodes = {(depth, int(code)): [counts[i], sums[i].copy()] for i, code in enumerate(leaves)}
+        children = {}
+        level = [int(code) for code in leaves]
+        for d in range(depth, 0, -1):
+            parents = set()
+            for code in level:
+                children.setdefault((d - 1, code >> 3), []).append((d, code))
+                parents.add(code >> 3)
+            level = sorted(parents)
+        
+        leaf_count = len(nodes)
+        
+        def subtree_total(node):
+            if node in nodes:
+                return nodes[node][0]
+            return sum(subtree_total(child) for child in children[node])
+        
+        def candidate(node):
+            return (-node[0], subtree_total(node), node[1], node)
+        
+        heap = [candidate(node) for node, kids in children.items() if all(k in nodes for k in kids)]
+        heapq.heapify(heap)
+        
+        while leaf_count > num_colors and heap:
+            node = heapq.heappop(heap)[3]
+            if len(children[node]) - 1 > leaf_count - num_colors:
+                continue
+            
+            kids = children.pop(node)
+            count = sum(nodes[k][0] for k in kids)
+            total = sum(nodes[k][1] for k in kids)
+            for k in kids:
+                del nodes[k]
+            nodes[node] = [count, total]
+            leaf_count -= len(kids) - 1
+            
+            parent = (node[0] - 1, node[1] >> 3)
+            if parent in children and all(k in nodes for k in children[parent]):
+                heapq.heappush(heap, candidate(parent))
+        
+        ordered = sorted(nodes.items(), key=lambda item: (-item[1][0], item[0]))
+        centers = np.array([total / count for _, (count, total) in ordered])
+        weights = np.array([count for _, (count, _) in ordered])
+        return list(ColorSeparationAlgorithms.ward_merge(centers, weights, num_colors)[0])
     
     @staticmethod
     def octree_color_quantization(img_rgb: np.ndarray, num_colors: int = 8) -> List[np.ndarray]:
         """Octree color quantization - preserves color gradients."""
-        from sklearn.preprocessing import KBinsDiscretizer
-        
-        pixels = img_rgb.reshape(-1, 3)
+        algorithms = ColorSeparationAlgorithms
+        depth, leaves, counts, sums = algorithms.octree_leaves(img_rgb)
+        colors_rgb = algorithms.octree_reduce(depth, leaves, counts, sums, num_colors)
         
-        if len(pixels) > 10000:
-            indices = np.random.choice(len(pixels), 10000, replace=False)
-            sample_pixels = pixels[indices]
-        else:
-            sample_pixels = pixels
-        
-        discretizer = KBinsDiscretizer(n_bins=num_colors, encode='ordinal', strategy='quantile')
-        
-        try:
-            discretized = discretizer.fit_transform(sample_pixels)
-            unique_colors = []
-            
-            for i in range(num_colors):
-                mask = discretized[:, 0] == i
-                if np.any(mask):
-                    bin_pixels = sample_pixels[mask]
-                    avg_color = np.mean(bin_pixels, axis=0)
-                    unique_colors.append(avg_color)
-            
-            colors_lab = []
-            for rgb in unique_colors[:num_colors]:
-                lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
-                colors_lab.append(lab)
-            
-            return colors_lab
-        except:
-            return ColorSeparationAlgorithms.color_quantization_median_cut(img_rgb, num_colors)
+        colors_lab = color.rgb2lab(np.array(colors_rgb).reshape(1, -1, 3) / 255.0)[0]
+        return list(colors_lab)
     
     @staticmethod
     def simulated_process_separation(img_rgb: np.ndarray) -> List[np.ndarray]:
@@ -461,9 +782,102 @@ class ColorSeparationAlgorithms:
         
         return simulated_process_palette
     
+    # Calibrated cost of the fast gradient_aware path, in proxy pixels per ms
+    GRADIENT_PIXELS_PER_MS = 4000
+    
+    @staticmethod
+    def guided_smooth(img_rgb: np.ndarray, radius: int = 3, eps: float = 0.01) -> np.ndarray:
+        """
+        Edge-preserving smoothing with a self-guided filter built from box
+        filters, so cost is independent of the radius (unlike bilateral).
+        """
+        img = img_rgb.astype(np.float32) / 255.0
+        ksize = (2 * radius + 1, 2 * radius + 1)
+        mean = cv2.boxFilter(img, -1, ksize)
+        variance = cv2.boxFilter(img * img, -1, ksize) - mean * mean
+        a = variance / (variance + eps)
+        b = mean - a * mean
+        smoothed = cv2.boxFilter(a, -1, ksize) * img + cv2.boxFilter(b, -1, ksize)
+        return np.clip(smoothed * 255 + 0.5, 0, 255).astype(np.uint8)
+    
+    @staticmethod
+    def refine_palette(counts: np.ndarray, sums: np.ndarray, palette_rgb: List[np.ndarray],
+                       iterations: int = 8) -> List[np.ndarray]:
+        """Weighted k-means over histogram bins, seeded with the given palette."""
+        if not palette_rgb:
+            return palette_rgb
+        means = sums / counts[:, None]
+        centers = np.array(palette_rgb, dtype=np.float64)
+        k = len(centers)
+        
+        for _ in range(iterations):
+            labels = np.argmin(((means[:, None, :] - centers[None]) ** 2).sum(axis=2), axis=1)
+            weight = np.bincount(labels, weights=counts, minlength=k)
+            updated = np.stack([np.bincount(labels, weights=sums[:, c], minlength=k) for c in range(3)], axis=1)
+            occupied = weight > 0
+            updated[occupied] /= weight[occupied, None]
+            updated[~occupied] = centers[~occupied]
+            
+            converged = np.abs(updated - centers).max() < 0.5
+            centers = updated
+            if converged:
+                break
+        return list(centers)
+    
+    @staticmethod
+    def fast_gradient_aware_separation(img_rgb: np.ndarray, num_colors: int = 8,
+                                       budget_ms: int = 150) -> List[np.ndarray]:
+        """
+        Budgeted gradient_aware: edge/flat classification and clustering on a
+        proxy whose size is derived from ``budget_ms`` (not measured time),
+        so a given budget always produces the same palette. Flat and edge
+        regions are quantized separately by histogram median cut, refined
+        with k-means over the histogram bins, then merged. The number of
+        refinement passes also follows from ``budget_ms`` alone, so the result
+        does not depend on host load and is safe to cache.
+        """
+        algorithms = ColorSeparationAlgorithms
+        iterations = int(np.clip(budget_ms // 20, 2, 8))
+        
+        h, w = img_rgb.shape[:2]
+        max_pixels = max(128 * 128, budget_ms * algorithms.GRADIENT_PIXELS_PER_MS)
+        if h * w > max_pixels:
+            scale = np.sqrt(max_pixels / (h * w))
+            img_rgb = cv2.resize(img_rgb, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                 interpolation=cv2.INTER_AREA)
+        
+        img_smoothed = algorithms.guided_smooth(img_rgb)
+        edges = cv2.Canny(cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY), 30, 100)
+        gradient_regions = cv2.dilate(edges, np.ones((3, 3), np.uint8), iterations=1) > 0
+        
+        colors_rgb = []
+        flat_colors = max(2, num_colors // 2)
+        for region, k in [(~gradient_regions, flat_colors), (gradient_regions, num_colors - flat_colors)]:
+            if k <= 0 or np.count_nonzero(region) <= 100:
+                continue
+            coords, counts, sums = algorithms.color_histogram(img_smoothed[region])
+            seeds = algorithms.histogram_median_cut(coords, counts, sums, k)
+            colors_rgb.extend(algorithms.refine_palette(counts, sums, seeds, iterations=iterations))
+        
+        # Whole-image candidates (most populous first) top up slots lost to
+        # empty regions or to near-duplicates merged below
+        coords, counts, sums = algorithms.color_histogram(img_smoothed)
+        colors_rgb.extend(algorithms.histogram_median_cut(coords, counts, sums, num_colors * 2))
+        
+        colors_lab = color.rgb2lab(np.array(colors_rgb).reshape(1, -1, 3) / 255.0)[0]
+        unique_colors = []
+        for color_lab in colors_lab:
+            if len(unique_colors) == num_colors:
+                break
+            if not any(np.linalg.norm(color_lab - uc) < 20 for uc in unique_colors):
+                unique_colors.append(color_lab)
+        
+        return unique_colors
+    
     @staticmethod
     def gradient_aware_separation(img_rgb: np.ndarray, num_colors: int = 8) -> List[np.ndarray]:
         """Separation that preserves gradients using edge-aware filtering."""
+        rng = np.random.RandomState(0)
         img_smoothed = cv2.bilateralFilter(img_rgb, 9, 75, 75)
         gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
         edges = cv2.Canny(gray, 30, 100)
@@ -490,7 +904,7 @@ class ColorSeparationAlgorithms:
             gradient_pixels = img_smoothed[gradient_regions]
             if len(gradient_pixels) > 100:
                 if len(gradient_pixels) > 1000:
-                    indices = np.random.choice(len(gradient_pixels), 1000, replace=False)
+                    indices = rng.choice(len(gradient_pixels), 1000, replace=False)
                     sample_pixels = gradient_pixels[indices]
                 else:
                     sample_pixels = gradient_pixels
@@ -521,12 +935,20 @@ class ColorSeparationAlgorithms:
 
 # ============ IMAGE PROCESSING UTILITIES ============
 
+# Underbase specks and pinholes smaller than this (pixels, 4-connected) are cleaned up
+UNDERBASE_MIN_REGION = 100
+
 class ImageProcessor:
     """Image processing utilities for screen printing"""
     
     @staticmethod
     def base64_to_cv2(base64_string: str) -> np.ndarray:
         """Convert base64 to OpenCV image with alpha handling."""
+        return ImageProcessor.decode_with_alpha(base64_string)[0]
+    
+    @staticmethod
+    def decode_with_alpha(base64_string: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Decode to BGR composited over white, plus the alpha plane if there was one."""
         try:
             if "base64," in base64_string:
                 base64_string = base64_string.split("base64,")[1]
@@ -534,19 +956,49 @@ class ImageProcessor:
             img_data = base64.b64decode(base64_string)
             pil_img = Image.open(io.BytesIO(img_data))
             
+            alpha = None
             if pil_img.mode == 'RGBA':
+                alpha_band = pil_img.split()[3]
+                alpha = np.array(alpha_band)
                 background = Image.new('RGB', pil_img.size, (255, 255, 255))
-                background.paste(pil_img, mask=pil_img.split()[3])
+                background.paste(pil_img, mask=alpha_band)
                 pil_img = background
             elif pil_img.mode != 'RGB':
                 pil_img = pil_img.convert('RGB')
             
             img_np = np.array(pil_img)
             img_bgr = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
-            return img_bgr
+            return img_bgr, alpha
         except Exception as e:
             raise ValueError(f"Image decode failed: {str(e)}")
     
+    @staticmethod
+    def open_base64_image(base64_string: str) -> Image.Image:
+        """Open a base64 image lazily: only the header is parsed until pixels are read."""
+        try:
+            if "base64," in base64_string:
+                base64_string = base64_string.split("base64,")[1]
+            return Image.open(io.BytesIO(base64.b64decode(base64_string)))
+        except Exception as e:
+            raise ValueError(f"Image decode failed: {str(e)}")
+    
+    @staticmethod
+    def iter_bgr_strips(pil_img: Image.Image, rows: int = 256):
+        """
+        Yield (y, BGR strip) down the image, converted exactly like
+        decode_with_alpha but never holding a full-size converted copy.
+        """
+        w, h = pil_img.size
+        for y in range(0, h, rows):
+            strip = pil_img.crop((0, y, w, min(y + rows, h)))
+            if strip.mode == 'RGBA':
+                background = Image.new('RGB', strip.size, (255, 255, 255))
+                background.paste(strip, mask=strip.split()[3])
+                strip = background
+            elif strip.mode != 'RGB':
+                strip = strip.convert('RGB')
+            yield y, cv2.cvtColor(np.asarray(strip), cv2.COLOR_RGB2BGR)
+    
     @staticmethod
     def cv2_to_base64(img: np.ndarray, format: str = 'png') -> str:
         """Convert OpenCV image to base64."""
@@ -567,6 +1019,109 @@ class ImageProcessor:
         
         return f"data:{mime_type};base64," + base64.b64encode(buffer.getvalue()).decode('utf-8')
     
+    @staticmethod
+    def encode_png(img: np.ndarray, compression: int = 1) -> bytes:
+        """Fast PNG encode of a grayscale plane or BGR image."""
+        if isinstance(img, np.memmap):
+            return b"".join(ImageProcessor.iter_png(img, compression))
+        ok, buffer = cv2.imencode('.png', np.ascontiguousarray(img), [cv2.IMWRITE_PNG_COMPRESSION, compression])
+        if not ok:
+            raise ValueError("PNG encode failed")
+        return buffer.tobytes()
+    
+    @staticmethod
+    def iter_png(plane: np.ndarray, compression: int = 1, rows: int = 256):
+        """
+        Encode a grayscale uint8 plane as PNG a strip of rows at a time,
+        yielding the file in chunks, so a memory-mapped plane is never read
+        into memory whole. Each row gets the PNG filter with the smallest
+        sum of absolute residuals, as libpng does.
+        """
+        h, w = plane.shape
+        
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+        
+        yield b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0))
+        compressor = zlib.compressobj(compression)
+        above = np.zeros((1, w), dtype=np.int16)
+        for y in range(0, h, rows):
+            x = np.asarray(plane[y:y + rows], dtype=np.int16)
+            a = np.pad(x[:, :-1], ((0, 0), (1, 0)))  # left
+            b = np.vstack([above, x[:-1]])  # up
+            c = np.pad(b[:, :-1], ((0, 0), (1, 0)))  # up-left
+            p = a + b - c
+            pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+            paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+            # None, Sub, Up, Average, Paeth residuals (mod 256)
+            filtered = np.stack([x, x - a, x - b, x - (a + b) // 2, x - paeth]).astype(np.uint8)
+            cost = np.abs(filtered.astype(np.int8).astype(np.int16)).sum(axis=2)
+            best = np.argmin(cost, axis=0)
+            
+            strip = np.empty((len(x), w + 1), dtype=np.uint8)
+            strip[:, 0] = best
+            strip[:, 1:] = filtered[best, np.arange(len(x))]
+            data = compressor.compress(strip.tobytes())
+            if data:
+                yield chunk(b"IDAT", data)
+            above = x[-1:]
+        yield chunk(b"IDAT", compressor.flush()) + chunk(b"IEND", b"")
+    
+    @staticmethod
+    def png_data_uri(png: bytes) -> str:
+        """Wrap encoded PNG bytes as a base64 data URI."""
+        return "data:image/png;base64," + base64.b64encode(png).decode('utf-8')
+    
+    @staticmethod
+    def pack_rgb(img_rgb: np.ndarray) -> np.ndarray:
+        """One 24-bit key per pixel (R << 16 | G << 8 | B) as uint32."""
+        return ((img_rgb[..., 0].astype(np.uint32) << 16) |
+                (img_rgb[..., 1].astype(np.uint32) << 8) |
+                img_rgb[..., 2]).ravel()
+    
+    @staticmethod
+    def count_unique_colors(img_rgb: np.ndarray, rows: int = 256) -> int:
+        """Exact distinct RGB count via a presence bitmap over packed keys."""
+        seen = np.zeros(1 << 24, dtype=bool)
+        for y in range(0, img_rgb.shape[0], rows):
+            seen[ImageProcessor.pack_rgb(img_rgb[y:y + rows])] = True
+        return int(np.count_nonzero(seen))
+    
+    @staticmethod
+    def sketch_unique_colors(img_rgb: np.ndarray, precision: int = 12, rows: int = 256) -> int:
+        """
+        HyperLogLog estimate of the distinct RGB count (standard error about
+        1.04 / sqrt(2^precision)). State is a few KB regardless of image size.
+        """
+        m = 1 << precision
+        max_rank = 32 - precision + 1
+        present = np.zeros((m, max_rank + 1), dtype=bool)
+        
+        for y in range(0, img_rgb.shape[0], rows):
+            # murmur3 finalizer: bijective mix of the 24-bit key into 32 bits
+            h = ImageProcessor.pack_rgb(img_rgb[y:y + rows])
+            h ^= h >> 16
+            h *= np.uint32(0x85EBCA6B)
+            h ^= h >> 13
+            h *= np.uint32(0xC2B2AE35)
+            h ^= h >> 16
+            
+            register = h >> (32 - precision)
+            rest = h << precision
+            # Rank = leading zeros + 1; frexp exponent gives floor(log2) + 1
+            rank = np.where(rest == 0, max_rank, 33 - np.frexp(rest.astype(np.float64))[1])
+            present[register, rank] = True
+        
+        registers = np.where(present.any(axis=1), max_rank - np.argmax(present[:, ::-1], axis=1), 0)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -registers)
+        
+        empty = int(np.sum(registers == 0))
+        if estimate <= 2.5 * m and empty:
+            # Small-range correction (linear counting)
+            estimate = m * np.log(m / empty)
+        return int(min(round(estimate), img_rgb.shape[0] * img_rgb.shape[1], 1 << 24))
+    
     @staticmethod
     def rgb_to_hex(rgb: np.ndarray) -> str:
         """Convert RGB array to hex string."""
@@ -602,37 +1157,79 @@ class ImageProcessor:
         return spread_factors.get(ink_type, {}).get(fabric_type, 1.0)
     
     @staticmethod
-    def create_underbase_mask(img_rgb: np.ndarray, fabric_color: str = "#000000") -> np.ndarray:
-        """Create optimized underbase mask."""
-        lab = color.rgb2lab(img_rgb / 255.0)
-        l_channel = (lab[:, :, 0] / 100 * 255).astype(np.uint8)
+    def underbase_threshold(img_lab: np.ndarray) -> np.ndarray:
+        """Raw underbase coverage (bool): adaptive threshold on L*, before speck cleanup."""
+        l_channel = (img_lab[:, :, 0] / 100 * 255).astype(np.uint8)
         
         underbase = cv2.adaptiveThreshold(
             l_channel, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
             cv2.THRESH_BINARY, 11, 2
         )
+        return underbase > 0
+    
+    @staticmethod
+    def create_underbase_mask(img_rgb: np.ndarray, fabric_color: str = "#000000",
+                              img_lab: Optional[np.ndarray] = None) -> np.ndarray:
+        """Create optimized underbase mask."""
+        lab = img_lab if img_lab is not None else color.rgb2lab(img_rgb / 255.0)
+        underbase = ImageProcessor.underbase_threshold(lab)
         
-        underbase = morphology.remove_small_objects(underbase.astype(bool), min_size=100)
-        underbase = morphology.remove_small_holes(underbase, area_threshold=100)
+        underbase = ImageProcessor.remove_small_regions(underbase, UNDERBASE_MIN_REGION)
+        underbase = ~ImageProcessor.remove_small_regions(~underbase, UNDERBASE_MIN_REGION)
+        return ImageProcessor.finish_underbase(underbase)
+    
+    @staticmethod
+    def remove_small_regions(mask: np.ndarray, min_size: int) -> np.ndarray:
+        """
+        Drop 4-connected regions of a bool mask smaller than min_size. Same
+        rule as the tiled seam passes, and independent of the scikit-image
+        version (0.26 made its min_size inclusive).
+        """
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=4)
+        small = stats[:, cv2.CC_STAT_AREA] < min_size
+        small[0] = False
+        return mask & ~small[labels]
+    
+    @staticmethod
+    def finish_underbase(underbase: np.ndarray) -> np.ndarray:
+        """Cleaned bool underbase to a softened uint8 mask."""
         underbase = underbase.astype(np.uint8) * 255
-        
-        underbase = cv2.GaussianBlur(underbase, (3, 3), 0.5)
-        
-        return underbase
+        return cv2.GaussianBlur(underbase, (3, 3), 0.5)
     
     @staticmethod
-    def create_halftone_pattern(mask: np.ndarray, frequency: float = 45.0) -> np.ndarray:
-        """Create halftone pattern for gradient printing."""
-        h, w = mask.shape
-        mask_norm = mask.astype(np.float32) / 255.0
-        
-        x = np.arange(w)
-        y = np.arange(h)
+    @lru_cache(maxsize=4)
+    def halftone_screen(h: int, w: int, frequency: float, offset: Tuple[int, int] = (0, 0),
+                        full_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """45-degree line screen threshold field for create_halftone_pattern."""
+        full_h, full_w = full_shape if full_shape else (h, w)
+        
+        x = np.arange(w) + offset[0]
+        y = np.arange(h) + offset[1]
         X, Y = np.meshgrid(x, y)
         
         Xr = X * 0.7071 - Y * 0.7071
-        period = max(h, w) / frequency
+        period = max(full_h, full_w) / frequency
         pattern = 0.5 + 0.5 * np.sin(2 * np.pi * Xr / period)
+        pattern.setflags(write=False)
+        return pattern
+    
+    @staticmethod
+    def create_halftone_pattern(mask: np.ndarray, frequency: float = 45.0,
+                                offset: Tuple[int, int] = (0, 0),
+                                full_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Create halftone pattern for gradient printing.
+        ``offset`` (x, y) and ``full_shape`` (h, w) place a tile within the
+        full artwork so the screen lines up across tile seams.
+        """
+        h, w = mask.shape
+        mask_norm = mask.astype(np.float32) / 255.0
+        
+        if offset == (0, 0) and full_shape is None:
+            # Whole-image screens repeat for every channel of a separation
+            pattern = ImageProcessor.halftone_screen(h, w, frequency)
+        else:
+            pattern = ImageProcessor.halftone_screen.__wrapped__(h, w, frequency, offset, full_shape)
         
         halftone = np.where(mask_norm > pattern, 255, 0).astype(np.uint8)
         halftone = cv2.GaussianBlur(halftone, (3, 3), 0.5)
@@ -655,109 +1252,415 @@ class ImageProcessor:
             # Choke (erode)
             return cv2.erode(mask, kernel, iterations=1)
 
+# ============ TILED FULL-RESOLUTION RENDERING ============
+
+# Halo read around each tile. Covers the mask bilateral filter (4px), the
+# underbase adaptive threshold (5px), trapping (<=3px) and the final blurs.
+TILE_OVERLAP = 16
+
+class PlaneFiles:
+    """
+    Temporary directory backing a tiled result's memory-mapped planes.
+    Channels hold a reference, so the files live exactly as long as some
+    channel (or a cached copy of it) can still read them.
+    """
+    
+    def __init__(self, prefix: str = "ecl_tiles_"):
+        self.path = Path(tempfile.mkdtemp(prefix=prefix))
+        self._cleanup = weakref.finalize(self, shutil.rmtree, str(self.path), True)
+    
+    def __getstate__(self):
+        # Pickling a channel (cache spill) copies the plane data, not the files
+        return {"path": None}
+    
+    def plane(self, name: str, shape: Tuple[int, ...]) -> str:
+        """Create a zeroed uint8 .npy plane and return its path."""
+        path = str(self.path / f"{name}.npy")
+        np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=shape).flush()
+        return path
+
+def tile_grid(h: int, w: int, tile_size: int, overlap: int) -> List[Dict[str, Tuple[int, int, int, int]]]:
+    """Split an image into core tiles plus overlap-padded read windows (y0, y1, x0, x1)."""
+    tiles = []
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            y1, x1 = min(y0 + tile_size, h), min(x0 + tile_size, w)
+            tiles.append({
+                "core": (y0, y1, x0, x1),
+                "padded": (max(0, y0 - overlap), min(h, y1 + overlap),
+                           max(0, x0 - overlap), min(w, x1 + overlap))
+            })
+    return tiles
+
+def load_tile_rgb(job: Dict[str, Any], window: str) -> np.ndarray:
+    """Read one tile window from the memory-mapped source and color-adjust it."""
+    y0, y1, x0, x1 = job["tile"][window]
+    source = np.load(job["source"], mmap_mode="r")
+    img_rgb = cv2.cvtColor(np.ascontiguousarray(source[y0:y1, x0:x1]), cv2.COLOR_BGR2RGB)
+    if job["adjustment"]:
+        img_rgb = engine.color_adjuster.apply_all_adjustments(img_rgb, ColorAdjustment(**job["adjustment"]))
+    return img_rgb
+
+def read_tile_plane(path: str, window: Tuple[int, int, int, int]) -> np.ndarray:
+    """Read one window of a memory-mapped plane."""
+    y0, y1, x0, x1 = window
+    return np.array(np.load(path, mmap_mode="r")[y0:y1, x0:x1])
+
+def write_tile_plane(path: str, core: Tuple[int, int, int, int], data: np.ndarray):
+    """Write a tile's core region into a memory-mapped output plane."""
+    y0, y1, x0, x1 = core
+    plane = np.load(path, mmap_mode="r+")
+    plane[y0:y1, x0:x1] = data
+    plane.flush()
+
+def tile_components(region: np.ndarray) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    4-connected components of a tile core: the label map, plus each
+    label's area and the labels along the four core edges, which is all
+    seam_small_components needs to join components across tiles.
+    """
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(region.astype(np.uint8), connectivity=4)
+    return labels, {
+        "areas": stats[:, cv2.CC_STAT_AREA],
+        "top": labels[0], "bottom": labels[-1],
+        "left": labels[:, 0], "right": labels[:, -1],
+    }
+
+def seam_small_components(tiles: List[Dict[str, Any]], summaries: List[Dict[str, np.ndarray]],
+                          min_size: int) -> List[np.ndarray]:
+    """
+    Join per-tile components that touch across tile seams into image-wide
+    components and return, for each tile, a table over its labels of which
+    belong to a component smaller than min_size. Applying the tables tile by
+    tile gives exactly a whole-image remove_small_objects.
+    """
+    offsets = np.cumsum([0] + [len(summary["areas"]) for summary in summaries])
+    by_origin = {(tile["core"][0], tile["core"][2]): n for n, tile in enumerate(tiles)}
+    
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    for n, tile in enumerate(tiles):
+        y0, y1, x0, x1 = tile["core"]
+        for neighbor, edge, facing in ((by_origin.get((y0, x1)), "right", "left"),
+                                       (by_origin.get((y1, x0)), "bottom", "top")):
+            if neighbor is None:
+                continue
+            here, there = summaries[n][edge], summaries[neighbor][facing]
+            touching = (here > 0) & (there > 0)
+            pairs.append(np.stack([here[touching] + offsets[n], there[touching] + offsets[neighbor]], axis=1))
+    pairs = np.concatenate(pairs)
+    
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(offsets[-1], offsets[-1]))
+    _, component = connected_components(graph, directed=False)
+    areas = np.bincount(component, weights=np.concatenate([summary["areas"] for summary in summaries]))
+    small = areas[component] < min_size
+    
+    tables = []
+    for n in range(len(tiles)):
+        table = small[offsets[n]:offsets[n + 1]].copy()
+        table[0] = False  # background of the pass
+        tables.append(table)
+    return tables
+
+def tile_distance_max(job: Dict[str, Any]) -> np.ndarray:
+    """Process-pool task: per-color maximum Lab distance over one tile."""
+    img_lab = engine.compute_lab_buffer(load_tile_rgb(job, "core"))
+    return engine.color_distance_max(img_lab, job["colors_lab"])
+
+def render_separation_tile(job: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, Optional[Dict[str, np.ndarray]]]:
+    """
+    Process-pool task: render the color masks and halftones for one tile,
+    and threshold its raw underbase. Returns inked pixel counts per color,
+    the RGB histogram of the tile core and the components of the raw
+    underbase (None without one).
+    """
+    h, w = job["shape"]
+    y0, y1, x0, x1 = job["tile"]["core"]
+    py0, py1, px0, px1 = job["tile"]["padded"]
+    core = (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+    outputs = job["outputs"]
+    processor = engine.processor
+    
+    img_rgb = load_tile_rgb(job, "padded")
+    img_lab = engine.compute_lab_buffer(img_rgb)
+    counts = np.zeros(len(job["colors_lab"]), dtype=np.int64)
+    
+    # Speck cleanup needs whole-image components, so the underbase is only
+    # thresholded here and finished by the seam passes
+    components = None
+    if outputs["underbase"]:
+        raw = processor.underbase_threshold(img_lab)[core]
+        write_tile_plane(outputs["underbase_raw"], job["tile"]["core"], raw)
+        components = tile_components(raw)[1]
+    
+    masks = engine.create_color_masks(img_lab, job["colors_lab"], job["softness"], job["max_dist"])
+    for i, mask in enumerate(masks):
+        mask = processor.apply_choke_spread(mask, job["choke_spread"])
+        if job["min_dot"] > 0:
+            mask = np.where(mask < job["min_dot"] * 2.55, 0, mask).astype(np.uint8)
+        write_tile_plane(outputs["masks"][i], job["tile"]["core"], mask[core])
+        counts[i] = np.sum(mask[core] > 10)
+        
+        if outputs["halftones"]:
+            halftone = processor.create_halftone_pattern(mask, job["halftone_frequency"],
+                                                         offset=(px0, py0), full_shape=(h, w))
+            write_tile_plane(outputs["halftones"][i], job["tile"]["core"], halftone[core])
+    
+    core_rgb = np.ascontiguousarray(img_rgb[core])
+    hist = np.stack([cv2.calcHist([core_rgb], [c], None, [256], [0, 256]).ravel() for c in range(3)])
+    return counts, hist, components
+
+def remove_underbase_specks_tile(job: Dict[str, Any]) -> Dict[str, np.ndarray]:
+    """
+    Process-pool task: drop this tile's share of the small underbase
+    objects, then return the components of what is left uncovered, for
+    the pinhole pass.
+    """
+    path, core = job["outputs"]["underbase_raw"], job["tile"]["core"]
+    underbase = read_tile_plane(path, core) > 0
+    labels, _ = tile_components(underbase)
+    underbase &= ~job["small"][labels]
+    write_tile_plane(path, core, underbase)
+    return tile_components(~underbase)[1]
+
+def fill_underbase_holes_tile(job: Dict[str, Any]):
+    """Process-pool task: fill this tile's share of the small underbase holes."""
+    path, core = job["outputs"]["underbase_raw"], job["tile"]["core"]
+    underbase = read_tile_plane(path, core) > 0
+    labels, _ = tile_components(~underbase)
+    write_tile_plane(path, core, underbase | job["small"][labels])
+
+def finish_underbase_tile(job: Dict[str, Any]) -> int:
+    """
+    Process-pool task: soften, spread and choke the cleaned underbase over
+    the padded window and write the tile core. Returns inked pixels.
+    """
+    y0, y1, x0, x1 = job["tile"]["core"]
+    py0, py1, px0, px1 = job["tile"]["padded"]
+    processor = engine.processor
+    
+    underbase = processor.finish_underbase(read_tile_plane(job["outputs"]["underbase_raw"], job["tile"]["padded"]) > 0)
+    if job["spread_factor"] > 1.0:
+        kernel_size = int(job["spread_factor"])
+        underbase = cv2.dilate(underbase, np.ones((kernel_size, kernel_size), np.uint8), iterations=1)
+    underbase = processor.apply_choke_spread(underbase, job["choke_spread"])[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+    write_tile_plane(job["outputs"]["underbase"], job["tile"]["core"], underbase)
+    return int(np.sum(underbase > 10))
+
+def compare_method_task(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Process-pool task: score one method on the shared preprocessed buffers."""
+    img_rgb = np.load(job["rgb"], mmap_mode="r")
+    img_lab = np.load(job["lab"], mmap_mode="r")
+    request = ProcessRequest(image_base64="", **job["request"])
+    return engine.summarize_method(np.ascontiguousarray(img_rgb), img_lab, request, job["underbase_coverage"])
+
+# ============ SEPARATION SESSIONS ============
+
+class SeparationSessionStore:
+    """
+    Per-session cache of separation pipeline intermediates (decoded proxy,
+    adjusted image, Lab buffer, palette, distance maps, masks).
+    
+    Each stage is stored under a key built from its own parameters plus the
+    keys of the stages it depends on, so a request that only changes a
+    downstream parameter (choke/spread, min dot, halftone frequency) reuses
+    everything upstream. A session keeps only the latest value per stage.
+    Sessions are evicted LRU beyond ``max_bytes`` and expire after
+    ``ttl_seconds`` without a request.
+    """
+    
+    def __init__(self, max_bytes: int = 1024 * 1024 * 1024, ttl_seconds: float = 1800.0):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sessions = OrderedDict()  # session_id -> {"stages": {name: (key, value, size)}, "bytes", "touched"}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+    
+    @staticmethod
+    def value_size(value: Any) -> int:
+        """Approximate resident bytes of a stage value (arrays dominate)."""
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (list, tuple)):
+            return sum(SeparationSessionStore.value_size(item) for item in value) + 64
+        if isinstance(value, dict):
+            return sum(SeparationSessionStore.value_size(item) for item in value.values()) + 64
+        return 64
+    
+    def stage(self, session_id: Optional[str], name: str, key: Any, compute: Callable[[], Any]) -> Any:
+        """Return the session's value for a stage if its key matches, else compute and store it."""
+        if session_id is None:
+            return compute()
+        
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session["touched"] = time.time()
+                self.sessions.move_to_end(session_id)
+                cached = session["stages"].get(name)
+                if cached is not None and cached[0] == key:
+                    self.stats["hits"] += 1
+                    return cached[1]
+            self.stats["misses"] += 1
+        
+        value = compute()
+        size = self.value_size(value)
+        
+        with self.lock:
+            session = self.sessions.setdefault(session_id, {"stages": {}, "bytes": 0, "touched": time.time()})
+            self.sessions.move_to_end(session_id)
+            previous = session["stages"].pop(name, None)
+            if previous is not None:
+                session["bytes"] -= previous[2]
+                self.bytes -= previous[2]
+            session["stages"][name] = (key, value, size)
+            session["bytes"] += size
+            self.bytes += size
+            self._evict(keep=session_id)
+        return value
+    
+    def drop(self, session_id: str) -> bool:
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self.bytes -= session["bytes"]
+            return True
+    
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self.lock:
+            for session_id in [sid for sid, s in self.sessions.items() if s["touched"] < cutoff]:
+                self.bytes -= self.sessions.pop(session_id)["bytes"]
+                self.stats["expired"] += 1
+    
+    def get_stats(self) -> Dict[str, Any]:
+        self.purge_expired()
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                sessions=len(self.sessions),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes
+            )
+    
+    def _evict(self, keep: str):
+        # Caller holds self.lock; the active session is never evicted
+        while self.bytes > self.max_bytes and len(self.sessions) > 1:
+            oldest = next(iter(self.sessions))
+            if oldest == keep:
+                self.sessions.move_to_end(keep)
+                continue
+            self.bytes -= self.sessions.pop(oldest)["bytes"]
+            self.stats["evictions"] += 1
+
 # ============ SEPARATION ENGINE ============
 
 class ProfessionalSeparationEngine:
     """Main separation engine using advanced algorithms"""
     
-    def __init__(self):
+    def __init__(self, chunk_pixels: int = 65536, max_dim: int = 1200,
+                 process_workers: Optional[int] = None,
+                 sessions: Optional[SeparationSessionStore] = None):
+        # Upper bound on pixels per vectorized chunk (caps temporary memory)
+        self.chunk_pixels = chunk_pixels
+        # Working resolution for interactive separations and palette proxies
+        self.max_dim = max_dim
+        self.process_workers = process_workers
+        # Intermediates reused across requests that share a session_id
+        self.sessions = sessions or SeparationSessionStore()
+        # Image fingerprints by payload hash, shared by /analyze and auto routing
+        self.fingerprints = OrderedDict()
+        self.max_fingerprints = 1024
+        self.exact_color_pixels = int(os.getenv("ECL_EXACT_COLOR_PIXELS", str(64 * 1024 * 1024)))
+        self._fingerprint_lock = threading.Lock()
+        self._process_pool = None
+        self._process_pool_lock = threading.Lock()
         self.algorithms = ColorSeparationAlgorithms()
         self.processor = ImageProcessor()
         self.color_adjuster = ColorAdjustmentEngine()
         self.pantone_matcher = PantoneMatchingService()
     
-    async def separate_image(self, request: ProcessRequest) -> SeparationResult:
-        """Main separation function with all pro features."""
+    def separate_image(self, request: ProcessRequest,
+                       progress: Optional[Callable[..., None]] = None) -> SeparationResult:
+        """
+        Main separation function with all pro features.
+        ``progress(stage, fraction, channel=None)`` is called as each stage
+        finishes, and once per channel as soon as its planes are ready.
+        """
+        report = progress or (lambda *args, **kwargs: None)
+        session = request.session_id
+        stage = self.sessions.stage
+        if session is not None:
+            self.sessions.purge_expired()
         try:
-            # Decode image
-            img_bgr = self.processor.base64_to_cv2(request.image_base64)
+            image_key = hashlib.sha256(request.image_base64.encode()).hexdigest()
             
-            # Resize for processing
-            h, w = img_bgr.shape[:2]
-            max_dim = 1200
-            if h > max_dim or w > max_dim:
-                scale = max_dim / max(h, w)
-                new_size = (int(w * scale), int(h * scale))
-                img_bgr = cv2.resize(img_bgr, new_size, interpolation=cv2.INTER_AREA)
+            if request.separation_method == SeparationMethod.AUTO:
+                fingerprint = self.get_fingerprint(request.image_base64, image_key=image_key)
+                request = request.copy(update={"separation_method": fingerprint["suggested_method"]})
             
-            # Convert to RGB
-            img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+            # Print-size artwork: palette from a proxy, films at native resolution
+            if request.full_resolution:
+                result = self.separate_image_tiled(request, report)
+                if result is not None:
+                    return result
+            
+            # Decode image and resize for processing
+            img_bgr, (h, w) = stage(session, "decode", image_key, lambda: self.decode_image(request.image_base64))
+            report("decode", 0.05)
             
-            # Apply color adjustments if provided
-            if request.color_adjustment:
-                img_rgb = self.color_adjuster.apply_all_adjustments(img_rgb, request.color_adjustment)
+            # Convert to RGB, apply color adjustments, histogram for metadata
+            adjust_key = (image_key, request.color_adjustment.json() if request.color_adjustment else None)
+            img_rgb, histogram = stage(session, "adjust", adjust_key,
+                                       lambda: self.prepare_rgb(img_bgr, request.color_adjustment))
+            report("adjust", 0.1)
             
-            # Calculate histogram for metadata
-            histogram = self.color_adjuster.calculate_histogram(img_rgb)
+            # Single shared Lab conversion for underbase and all channel masks
+            img_lab = stage(session, "lab", adjust_key, lambda: self.compute_lab_buffer(img_rgb))
             
             channels = []
             order_counter = 0
             
             # Add underbase if needed
             if request.use_underbase and request.fabric_color != "#FFFFFF":
-                underbase_mask = self.processor.create_underbase_mask(img_rgb, request.fabric_color)
-                
-                spread_factor = self.processor.calculate_ink_spread(request.ink_type, request.fabric_type)
-                if spread_factor > 1.0:
-                    kernel_size = int(spread_factor)
-                    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-                    underbase_mask = cv2.dilate(underbase_mask, kernel, iterations=1)
-                
-                # Apply choke/spread
-                underbase_mask = self.processor.apply_choke_spread(underbase_mask, request.choke_spread)
-                
+                base_mask = stage(session, "underbase", (adjust_key, request.fabric_color),
+                                  lambda: self.processor.create_underbase_mask(img_rgb, request.fabric_color, img_lab))
+                underbase_mask = self.create_underbase_plane(img_rgb, img_lab, request, base_mask)
                 coverage = np.sum(underbase_mask > 10) / (underbase_mask.shape[0] * underbase_mask.shape[1]) * 100
                 
-                channels.append(ColorChannel(
-                    name="Underbase White",
-                    color="#FFFFFF",
-                    type=ChannelType.UNDERBASE,
-                    image=self.processor.cv2_to_base64(underbase_mask),
-                    opacity=1.0,
-                    blend_mode="normal",
-                    order=order_counter,
-                    printable=True,
-                    ink_volume=1.0 if request.ink_type != InkType.DISCHARGE else 0.8,
-                    coverage_percent=round(coverage, 2)
-                ))
+                channels.append(self.create_underbase_channel(request, underbase_mask, coverage, order_counter))
                 order_counter += 1
+                report("underbase", 0.2, channel=channels[-1])
             
-            # Get dominant colors based on method or custom colors
-            if request.custom_colors:
-                # MANUAL COLOR SELECTION
-                colors_lab = []
-                for hex_color in request.custom_colors:
-                    rgb = np.array([int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)])
-                    lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
-                    colors_lab.append(lab)
-            else:
-                # AUTOMATIC COLOR EXTRACTION
-                if request.separation_method == SeparationMethod.WATERSHED:
-                    colors_lab = self.algorithms.dominant_colors_watershed(img_rgb, request.max_colors)
-                elif request.separation_method == SeparationMethod.MEDIAN_CUT:
-                    colors_lab = self.algorithms.color_quantization_median_cut(img_rgb, request.max_colors)
-                elif request.separation_method == SeparationMethod.OCTREE:
-                    colors_lab = self.algorithms.octree_color_quantization(img_rgb, request.max_colors)
-                elif request.separation_method == SeparationMethod.SIMULATED_PROCESS:
-                    colors_lab = self.algorithms.simulated_process_separation(img_rgb)
-                else:  # GRADIENT_AWARE (default)
-                    colors_lab = self.algorithms.gradient_aware_separation(img_rgb, request.max_colors)
+            palette_key = (adjust_key, request.separation_method.value, request.max_colors,
+                           tuple(request.custom_colors or ()), request.fast_palette, request.palette_budget_ms)
+            colors_lab = stage(session, "palette", palette_key, lambda: self.extract_palette(img_rgb, request))
+            report("palette", 0.35)
             
             # Match to Pantone if requested
             pantone_matches = []
             if request.match_pantone:
                 pantone_matches = self.pantone_matcher.match_palette(colors_lab)
             
-            # Create masks for each color
+            # Create masks for all colors; sessions keep the raw distance maps
+            # so a softness change skips the Lab distance pass
+            if session is None:
+                masks = self.create_color_masks(img_lab, colors_lab, request.softness)
+            else:
+                distances = stage(session, "distances", palette_key,
+                                  lambda: self.compute_color_distances(img_lab, colors_lab))
+                masks = stage(session, "masks", (palette_key, self.softness_profile(request.softness)),
+                              lambda: self.masks_from_distances(distances, img_lab.shape[:2], request.softness))
+            report("masks", 0.5)
+            
             for i, color_lab in enumerate(colors_lab):
-                # Convert to RGB for display
-                color_rgb = (color.lab2rgb(color_lab.reshape(1, 1, 3)) * 255).astype(np.uint8)[0, 0]
-                
-                # Create mask
-                mask = self.create_color_mask(img_rgb, color_lab, request.softness)
+                channel_progress = 0.5 + 0.4 * (i + 1) / len(colors_lab)
                 
                 # Apply choke/spread
-                mask = self.processor.apply_choke_spread(mask, request.choke_spread)
+                mask = self.processor.apply_choke_spread(masks[i], request.choke_spread)
                 
                 # Apply minimum dot
                 if request.min_dot > 0:
@@ -768,166 +1671,705 @@ class ProfessionalSeparationEngine:
                 
                 # Apply minimum coverage threshold
                 if coverage < request.min_ink_coverage * 100:
+                    report("channel", channel_progress)
                     continue
                 
-                # Convert to hex
-                color_hex = self.processor.rgb_to_hex(color_rgb)
-                
-                # Get Pantone match if available
-                pantone_code = None
-                if request.match_pantone and i < len(pantone_matches):
-                    pantone_code = pantone_matches[i]['pantone']
-                    color_hex = pantone_matches[i]['hex']  # Use Pantone hex instead
-                
                 # Apply halftone for gradient methods
-                halftone_pattern = None
+                halftone = None
                 if request.separation_method in [SeparationMethod.GRADIENT_AWARE, SeparationMethod.OCTREE]:
                     halftone = self.processor.create_halftone_pattern(mask, request.halftone_frequency)
-                    halftone_pattern = self.processor.cv2_to_base64(halftone)
-                
-                # Determine channel type
-                channel_type = ChannelType.GRADIENT if request.softness > 0.3 else ChannelType.SPOT_COLOR
-                if request.separation_method == SeparationMethod.SIMULATED_PROCESS:
-                    channel_type = ChannelType.PROCESS_COLOR
                 
-                channel_name = f"PMS {pantone_code}" if pantone_code else f"Color {i+1}"
-                
-                channels.append(ColorChannel(
-                    name=channel_name,
-                    color=color_hex,
-                    pantone=pantone_code,
-                    type=channel_type,
-                    image=self.processor.cv2_to_base64(mask),
-                    opacity=1.0,
-                    blend_mode="normal",
-                    order=order_counter,
-                    printable=True,
-                    ink_volume=1.0,
-                    halftone_pattern=halftone_pattern,
-                    coverage_percent=round(coverage, 2),
-                    locked=False
+                channels.append(self.create_spot_channel(
+                    request, i, color_lab, pantone_matches, mask, halftone, coverage, order_counter
                 ))
                 order_counter += 1
+                report("channel", channel_progress, channel=channels[-1])
             
             # Create preview
             preview = self.create_preview_composite(img_rgb, channels, request.fabric_color)
-            preview_base64 = self.processor.cv2_to_base64(preview)
+            report("preview", 0.95)
             
-            # Calculate results
-            ink_estimate = self.calculate_ink_estimate(channels, img_rgb.shape[:2])
-            quality_score = self.calculate_separation_quality(channels, img_rgb)
-            recommendations = self.generate_recommendations(channels, request, ink_estimate, quality_score)
+            return self.build_result(request, channels, preview, img_rgb.shape[:2], histogram,
+                                     pantone_matches, {"image_dimensions": f"{h}x{w}"})
             
-            # Extract palette
-            palette = list(set([ch.color for ch in channels if ch.type not in [
+        except Exception as e:
+            raise Exception(f"Separation failed: {str(e)}")
+    
+    def get_fingerprint(self, image_base64: str, img_rgb: Optional[np.ndarray] = None,
+                        alpha: Optional[np.ndarray] = None, count_mode: ColorCountMode = ColorCountMode.AUTO,
+                        image_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Cached image fingerprint: unique colors, edge density, alpha coverage,
+        dominant hues and the suggested method. Decodes the payload only if
+        the caller has not already.
+        """
+        image_key = image_key or hashlib.sha256(image_base64.encode()).hexdigest()
+        key = (image_key, count_mode.value)
+        with self._fingerprint_lock:
+            if key in self.fingerprints:
+                self.fingerprints.move_to_end(key)
+                return self.fingerprints[key]
+        
+        if img_rgb is None:
+            img_bgr, alpha = self.processor.decode_with_alpha(image_base64)
+            img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        fingerprint = self.compute_fingerprint(img_rgb, alpha, count_mode)
+        
+        with self._fingerprint_lock:
+            self.fingerprints[key] = fingerprint
+            while len(self.fingerprints) > self.max_fingerprints:
+                self.fingerprints.popitem(last=False)
+        return fingerprint
+    
+    def compute_fingerprint(self, img_rgb: np.ndarray, alpha: Optional[np.ndarray] = None,
+                            count_mode: ColorCountMode = ColorCountMode.AUTO) -> Dict[str, Any]:
+        """Cheap whole-image statistics used for method routing."""
+        h, w = img_rgb.shape[:2]
+        
+        if count_mode == ColorCountMode.AUTO:
+            count_mode = ColorCountMode.EXACT if h * w <= self.exact_color_pixels else ColorCountMode.SKETCH
+        if count_mode == ColorCountMode.EXACT:
+            unique_colors = self.processor.count_unique_colors(img_rgb)
+        else:
+            unique_colors = self.processor.sketch_unique_colors(img_rgb)
+        
+        gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
+        edges = cv2.Canny(gray, 50, 150)
+        edge_density = np.count_nonzero(edges) / (h * w)
+        
+        # Hue histogram in 30-degree bins over reasonably saturated, lit pixels
+        hsv = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2HSV)
+        chromatic = (hsv[:, :, 1] > 50) & (hsv[:, :, 2] > 50)
+        hue_counts = np.bincount(hsv[:, :, 0][chromatic] // 15, minlength=12)[:12]
+        dominant_hues = [
+            {"hue": int(b * 30 + 15), "share": round(float(hue_counts[b]) / (h * w), 3)}
+            for b in np.argsort(-hue_counts, kind="stable")[:3]
+            if hue_counts[b] / (h * w) >= 0.05
+        ]
+        
+        alpha_coverage = 1.0 if alpha is None else np.count_nonzero(alpha) / alpha.size
+        
+        method, colors = self.suggest_method(edge_density, unique_colors)
+        return {
+            "unique_colors": unique_colors,
+            "unique_colors_exact": count_mode == ColorCountMode.EXACT,
+            "edge_density": edge_density,
+            "alpha_coverage": round(float(alpha_coverage), 4),
+            "chromatic_ratio": round(float(np.count_nonzero(chromatic)) / (h * w), 4),
+            "dominant_hues": dominant_hues,
+            "image_size": (h, w),
+            "suggested_method": method,
+            "suggested_colors": colors
+        }
+    
+    @staticmethod
+    def suggest_method(edge_density: float, unique_colors: int) -> Tuple[SeparationMethod, int]:
+        """Route to a separation method and color count from fingerprint stats."""
+        if edge_density > 0.3:
+            suggested_method = SeparationMethod.GRADIENT_AWARE
+        elif unique_colors > 100:
+            suggested_method = SeparationMethod.SIMULATED_PROCESS
+        else:
+            suggested_method = SeparationMethod.MEDIAN_CUT
+        
+        if unique_colors > 500:
+            suggested_colors = 8
+        elif unique_colors > 100:
+            suggested_colors = 6
+        else:
+            suggested_colors = 4
+        return suggested_method, suggested_colors
+    
+    def decode_image(self, image_base64: str) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """Decode to the working-resolution proxy plus the original (h, w)."""
+        full_bgr, img_bgr = self.decode_proxy(image_base64)
+        return img_bgr, full_bgr.shape[:2]
+    
+    def decode_proxy(self, image_base64: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Decode an image and downscale it to max_dim (same array if it already fits)."""
+        full_bgr = self.processor.base64_to_cv2(image_base64)
+        h, w = full_bgr.shape[:2]
+        if h > self.max_dim or w > self.max_dim:
+            scale = self.max_dim / max(h, w)
+            new_size = (int(w * scale), int(h * scale))
+            return full_bgr, cv2.resize(full_bgr, new_size, interpolation=cv2.INTER_AREA)
+        return full_bgr, full_bgr
+    
+    def prepare_rgb(self, img_bgr: np.ndarray,
+                    adjustments: Optional[ColorAdjustment]) -> Tuple[np.ndarray, Dict[str, List[int]]]:
+        """Convert to RGB, apply color adjustments and take the histogram."""
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        if adjustments:
+            img_rgb = self.color_adjuster.apply_all_adjustments(img_rgb, adjustments)
+        return img_rgb, self.color_adjuster.calculate_histogram(img_rgb)
+    
+    def create_underbase_plane(self, img_rgb: np.ndarray, img_lab: np.ndarray,
+                               request: ProcessRequest, base_mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Underbase mask with ink spread and choke/spread applied."""
+        underbase_mask = base_mask
+        if underbase_mask is None:
+            underbase_mask = self.processor.create_underbase_mask(img_rgb, request.fabric_color, img_lab)
+        
+        spread_factor = self.processor.calculate_ink_spread(request.ink_type, request.fabric_type)
+        if spread_factor > 1.0:
+            kernel_size = int(spread_factor)
+            kernel = np.ones((kernel_size, kernel_size), np.uint8)
+            underbase_mask = cv2.dilate(underbase_mask, kernel, iterations=1)
+        
+        # Apply choke/spread
+        return self.processor.apply_choke_spread(underbase_mask, request.choke_spread)
+    
+    def extract_palette(self, img_rgb: np.ndarray, request: ProcessRequest) -> List[np.ndarray]:
+        """Get dominant colors based on method or custom colors."""
+        if request.custom_colors:
+            # MANUAL COLOR SELECTION
+            colors_lab = []
+            for hex_color in request.custom_colors:
+                rgb = np.array([int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)])
+                lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
+                colors_lab.append(lab)
+            return colors_lab
+        
+        # AUTOMATIC COLOR EXTRACTION
+        if request.separation_method == SeparationMethod.WATERSHED:
+            return self.algorithms.dominant_colors_watershed(img_rgb, request.max_colors)
+        elif request.separation_method == SeparationMethod.SUPERPIXEL:
+            return self.algorithms.dominant_colors_superpixel(img_rgb, request.max_colors)
+        elif request.separation_method == SeparationMethod.MEDIAN_CUT:
+            return self.algorithms.color_quantization_median_cut(img_rgb, request.max_colors)
+        elif request.separation_method == SeparationMethod.OCTREE:
+            return self.algorithms.octree_color_quantization(img_rgb, request.max_colors)
+        elif request.separation_method == SeparationMethod.SIMULATED_PROCESS:
+            return self.algorithms.simulated_process_separation(img_rgb)
+        elif request.fast_palette:  # GRADIENT_AWARE (default)
+            return self.algorithms.fast_gradient_aware_separation(img_rgb, request.max_colors,
+                                                                  request.palette_budget_ms)
+        else:
+            return self.algorithms.gradient_aware_separation(img_rgb, request.max_colors)
+    
+    def create_underbase_channel(self, request: ProcessRequest, mask: np.ndarray, coverage: float,
+                                 order: int) -> ColorChannel:
+        """Build the underbase white channel record."""
+        channel = ColorChannel(
+            name="Underbase White",
+            color="#FFFFFF",
+            type=ChannelType.UNDERBASE,
+            opacity=1.0,
+            blend_mode="normal",
+            order=order,
+            printable=True,
+            ink_volume=1.0 if request.ink_type != InkType.DISCHARGE else 0.8,
+            coverage_percent=round(coverage, 2)
+        )
+        channel._mask = mask
+        return channel
+    
+    def create_spot_channel(self, request: ProcessRequest, index: int, color_lab: np.ndarray,
+                            pantone_matches: List[Dict[str, Any]], mask: np.ndarray,
+                            halftone: Optional[np.ndarray], coverage: float, order: int) -> ColorChannel:
+        """Build the channel record for one palette color."""
+        # Convert to RGB for display
+        color_rgb = (color.lab2rgb(color_lab.reshape(1, 1, 3)) * 255).astype(np.uint8)[0, 0]
+        color_hex = self.processor.rgb_to_hex(color_rgb)
+        
+        # Get Pantone match if available
+        pantone_code = None
+        if request.match_pantone and index < len(pantone_matches):
+            pantone_code = pantone_matches[index]['pantone']
+            color_hex = pantone_matches[index]['hex']  # Use Pantone hex instead
+        
+        # Determine channel type
+        channel_type = ChannelType.GRADIENT if request.softness > 0.3 else ChannelType.SPOT_COLOR
+        if request.separation_method == SeparationMethod.SIMULATED_PROCESS:
+            channel_type = ChannelType.PROCESS_COLOR
+        
+        channel_name = f"PMS {pantone_code}" if pantone_code else f"Color {index+1}"
+        
+        channel = ColorChannel(
+            name=channel_name,
+            color=color_hex,
+            pantone=pantone_code,
+            type=channel_type,
+            opacity=1.0,
+            blend_mode="normal",
+            order=order,
+            printable=True,
+            ink_volume=1.0,
+            coverage_percent=round(coverage, 2),
+            locked=False
+        )
+        channel._mask = mask
+        channel._halftone = halftone
+        return channel
+    
+    def build_result(self, request: ProcessRequest, channels: List[ColorChannel], preview: np.ndarray,
+                     image_size: Tuple[int, int], histogram: Dict[str, List[int]],
+                     pantone_matches: List[Dict[str, Any]], extra_metadata: Dict[str, Any]) -> SeparationResult:
+        """Score the channels and assemble the API result (planes stay unencoded)."""
+        # Calculate results
+        ink_estimate = self.calculate_ink_estimate(channels, image_size)
+        quality_score = self.calculate_separation_quality(channels, np.empty(image_size))
+        recommendations = self.generate_recommendations(channels, request, ink_estimate, quality_score)
+        
+        # Extract palette
+        palette = list(set([ch.color for ch in channels if ch.type not in [
+            ChannelType.UNDERBASE, ChannelType.HIGHLIGHT_WHITE
+        ]]))
+        
+        # Create metadata
+        metadata = {
+            "method": request.separation_method.value,
+            "total_channels": len(channels),
+            "color_channels": len([ch for ch in channels if ch.type in [
+                ChannelType.SPOT_COLOR, ChannelType.PROCESS_COLOR, 
+                ChannelType.GRADIENT, ChannelType.HALFTONE
+            ]]),
+            "white_channels": len([ch for ch in channels if ch.type in [
                 ChannelType.UNDERBASE, ChannelType.HIGHLIGHT_WHITE
-            ]]))
+            ]]),
+            "ink_type": request.ink_type.value,
+            "fabric_type": request.fabric_type.value,
+            "choke_spread": request.choke_spread,
+            "min_dot": request.min_dot,
+            "pantone_matched": request.match_pantone,
+            "timestamp": datetime.now().isoformat()
+        }
+        metadata.update(extra_metadata)
+        
+        result = SeparationResult(
+            channels=channels,
+            metadata=metadata,
+            palette=palette,
+            pantone_matches=pantone_matches if request.match_pantone else None,
+            ink_estimate=ink_estimate,
+            separation_quality=quality_score,
+            recommendations=recommendations,
+            histogram=histogram
+        )
+        result._preview = preview
+        return result
+    
+    def get_process_pool(self) -> ProcessPoolExecutor:
+        """Lazily start the process pool used for tiles and method comparison."""
+        with self._process_pool_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=self.process_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+        return self._process_pool
+    
+    def summarize_method(self, img_rgb: np.ndarray, img_lab: np.ndarray, request: ProcessRequest,
+                         underbase_coverage: Optional[float]) -> Dict[str, Any]:
+        """
+        Score one separation method on preprocessed buffers. Mirrors the
+        channel logic of separate_image but skips halftones, previews and
+        image encoding since only the metrics are reported.
+        """
+        channels = []
+        if underbase_coverage is not None:
+            channels.append(self.create_underbase_channel(request, None, underbase_coverage, 0))
+        
+        colors_lab = self.extract_palette(img_rgb, request)
+        masks = self.create_color_masks(img_lab, colors_lab, request.softness)
+        
+        for i, color_lab in enumerate(colors_lab):
+            mask = self.processor.apply_choke_spread(masks[i], request.choke_spread)
+            if request.min_dot > 0:
+                mask = np.where(mask < request.min_dot * 2.55, 0, mask).astype(np.uint8)
             
-            # Create metadata
-            metadata = {
-                "method": request.separation_method.value,
-                "total_channels": len(channels),
-                "color_channels": len([ch for ch in channels if ch.type in [
-                    ChannelType.SPOT_COLOR, ChannelType.PROCESS_COLOR, 
-                    ChannelType.GRADIENT, ChannelType.HALFTONE
-                ]]),
-                "white_channels": len([ch for ch in channels if ch.type in [
-                    ChannelType.UNDERBASE, ChannelType.HIGHLIGHT_WHITE
-                ]]),
-                "image_dimensions": f"{h}x{w}",
-                "ink_type": request.ink_type.value,
-                "fabric_type": request.fabric_type.value,
-                "choke_spread": request.choke_spread,
-                "min_dot": request.min_dot,
-                "pantone_matched": request.match_pantone,
-                "timestamp": datetime.now().isoformat()
-            }
+            coverage = np.sum(mask > 10) / (mask.shape[0] * mask.shape[1]) * 100
+            if coverage < request.min_ink_coverage * 100:
+                continue
             
-            return SeparationResult(
-                channels=channels,
-                preview=preview_base64,
-                metadata=metadata,
-                palette=palette,
-                pantone_matches=pantone_matches if request.match_pantone else None,
-                ink_estimate=ink_estimate,
-                separation_quality=quality_score,
-                recommendations=recommendations,
-                histogram=histogram
-            )
+            channels.append(self.create_spot_channel(request, i, color_lab, [], None, None, coverage, len(channels)))
+        
+        ink_estimate = self.calculate_ink_estimate(channels, img_rgb.shape[:2])
+        quality_score = self.calculate_separation_quality(channels, img_rgb)
+        recommendations = self.generate_recommendations(channels, request, ink_estimate, quality_score)
+        
+        return {
+            "method": request.separation_method.value,
+            "channel_count": len(channels),
+            "quality_score": quality_score,
+            "ink_estimate": ink_estimate,
+            "recommendations": recommendations[:2]
+        }
+    
+    def compare_methods(self, image_base64: str, methods: List[SeparationMethod],
+                        base_request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Decode, resize, convert to Lab and build the underbase once, then
+        score every method in parallel on the process pool. Shared buffers
+        are handed to workers as memory-mapped files. Methods that fail are
+        left out, as before.
+        """
+        img_bgr = self.processor.base64_to_cv2(image_base64)
+        h, w = img_bgr.shape[:2]
+        if h > self.max_dim or w > self.max_dim:
+            scale = self.max_dim / max(h, w)
+            img_bgr = cv2.resize(img_bgr, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        img_lab = self.compute_lab_buffer(img_rgb)
+        
+        requests = [ProcessRequest(image_base64="", separation_method=method, **base_request)
+                    for method in methods]
+        if not requests:
+            return []
+        
+        underbase_coverage = None
+        if requests[0].use_underbase and requests[0].fabric_color != "#FFFFFF":
+            underbase_mask = self.create_underbase_plane(img_rgb, img_lab, requests[0])
+            underbase_coverage = np.sum(underbase_mask > 10) / underbase_mask.size * 100
+        
+        with tempfile.TemporaryDirectory(prefix="ecl_compare_") as workdir:
+            rgb_path = str(Path(workdir) / "rgb.npy")
+            lab_path = str(Path(workdir) / "lab.npy")
+            np.save(rgb_path, img_rgb)
+            np.save(lab_path, img_lab)
             
-        except Exception as e:
-            raise Exception(f"Separation failed: {str(e)}")
+            pool = self.get_process_pool()
+            futures = [pool.submit(compare_method_task, {
+                "rgb": rgb_path,
+                "lab": lab_path,
+                "request": request.dict(exclude={"image_base64"}),
+                "underbase_coverage": underbase_coverage
+            }) for request in requests]
+            
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception:
+                    continue
+        
+        return results
     
-    def create_color_mask(self, img_rgb: np.ndarray, target_lab: np.ndarray, 
-                         softness: float = 0.5) -> np.ndarray:
-        """Create color mask with smooth transitions."""
-        img_lab = color.rgb2lab(img_rgb / 255.0)
-        dist = np.sqrt(np.sum((img_lab - target_lab) ** 2, axis=2))
+    def separate_image_tiled(self, request: ProcessRequest,
+                             report: Callable[..., None]) -> Optional[SeparationResult]:
+        """
+        Full-resolution separation for print-size artwork, or None if the
+        image already fits the working size.
+        The palette comes from the downscaled proxy; masks, trapping, min-dot
+        and halftones are rendered tile by tile at native resolution across
+        the process pool. The source is decoded in strips straight into a
+        memory-mapped file and every plane is one too, so apart from the
+        image decoder's own buffer, resident memory is bounded by tile size.
+        Underbase speck cleanup joins components across tile seams, so the
+        films match a single-pass render.
+        """
+        pil_img = self.processor.open_base64_image(request.image_base64)
+        w, h = pil_img.size
+        if h <= self.max_dim and w <= self.max_dim:
+            return None
+        
+        use_underbase = request.use_underbase and request.fabric_color != "#FFFFFF"
+        use_halftone = request.separation_method in [SeparationMethod.GRADIENT_AWARE, SeparationMethod.OCTREE]
+        
+        # Channels keep the files alive for as long as their planes are used
+        files = PlaneFiles()
+        source_path = files.plane("source", (h, w, 3))
+        source = np.load(source_path, mmap_mode="r+")
+        for y, strip in self.processor.iter_bgr_strips(pil_img):
+            source[y:y + len(strip)] = strip
+        source.flush()
+        del pil_img
         
-        max_dist = np.max(dist) if np.max(dist) > 0 else 1
-        dist_norm = dist / max_dist
+        scale = self.max_dim / max(h, w)
+        proxy_bgr = cv2.resize(source, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        del source
+        report("decode", 0.05)
         
+        proxy_rgb = cv2.cvtColor(proxy_bgr, cv2.COLOR_BGR2RGB)
+        if request.color_adjustment:
+            proxy_rgb = self.color_adjuster.apply_all_adjustments(proxy_rgb, request.color_adjustment)
+        
+        report("adjust", 0.1)
+        
+        colors_lab = self.extract_palette(proxy_rgb, request)
+        report("palette", 0.2)
+        
+        pantone_matches = []
+        if request.match_pantone:
+            pantone_matches = self.pantone_matcher.match_palette(colors_lab)
+        
+        outputs = {
+            "underbase": files.plane("underbase", (h, w)) if use_underbase else None,
+            "underbase_raw": files.plane("underbase_raw", (h, w)) if use_underbase else None,
+            "masks": [files.plane(f"mask_{i}", (h, w)) for i in range(len(colors_lab))],
+            "halftones": [files.plane(f"halftone_{i}", (h, w)) for i in range(len(colors_lab))] if use_halftone else [],
+        }
+        
+        base_job = {
+            "source": source_path,
+            "shape": (h, w),
+            "colors_lab": np.asarray(colors_lab, dtype=np.float64).reshape(-1, 3),
+            "adjustment": request.color_adjustment.dict() if request.color_adjustment else None,
+        }
+        tiles = tile_grid(h, w, request.tile_size, TILE_OVERLAP)
+        pool = self.get_process_pool()
+        
+        # Pass 1: global per-color distance normalization
+        max_dist = np.zeros(len(colors_lab))
+        for tile_max in pool.map(tile_distance_max, [dict(base_job, tile=t) for t in tiles]):
+            max_dist = np.maximum(max_dist, tile_max)
+        max_dist[max_dist == 0] = 1
+        report("masks", 0.3)
+        
+        # Pass 2: render every plane tile by tile
+        render_job = dict(
+            base_job,
+            outputs=outputs,
+            max_dist=max_dist,
+            softness=request.softness,
+            choke_spread=request.choke_spread,
+            min_dot=request.min_dot,
+            halftone_frequency=request.halftone_frequency,
+            spread_factor=self.processor.calculate_ink_spread(request.ink_type, request.fabric_type),
+        )
+        counts = np.zeros(len(colors_lab), dtype=np.int64)
+        hist = np.zeros((3, 256), dtype=np.float64)
+        components = []
+        tile_results = pool.map(render_separation_tile, [dict(render_job, tile=t) for t in tiles])
+        for done, (tile_counts, tile_hist, tile_components) in enumerate(tile_results, start=1):
+            counts += tile_counts
+            hist += tile_hist
+            components.append(tile_components)
+            report("tile", 0.3 + 0.45 * done / len(tiles))
+        os.remove(source_path)
+        
+        # Passes 3-5: remove specks, then fill pinholes, each judged on its
+        # image-wide component, then soften and spread the underbase
+        underbase_count = 0
+        if use_underbase:
+            small = seam_small_components(tiles, components, UNDERBASE_MIN_REGION)
+            holes = list(pool.map(remove_underbase_specks_tile,
+                                  [dict(render_job, tile=t, small=s) for t, s in zip(tiles, small)]))
+            small = seam_small_components(tiles, holes, UNDERBASE_MIN_REGION)
+            list(pool.map(fill_underbase_holes_tile,
+                          [dict(render_job, tile=t, small=s) for t, s in zip(tiles, small)]))
+            underbase_count = sum(pool.map(finish_underbase_tile, [dict(render_job, tile=t) for t in tiles]))
+            os.remove(outputs["underbase_raw"])
+        
+        total_pixels = float(h * w)
+        channels = []
+        order_counter = 0
+        
+        # Planes stay memory-mapped for encoding at the edge
+        if use_underbase:
+            channels.append(self.create_underbase_channel(
+                request, np.load(outputs["underbase"], mmap_mode="r"),
+                underbase_count / total_pixels * 100, order_counter
+            ))
+            channels[-1]._files = files
+            order_counter += 1
+            report("underbase", 0.85, channel=channels[-1])
+        
+        for i, color_lab in enumerate(colors_lab):
+            coverage = counts[i] / total_pixels * 100
+            if coverage < request.min_ink_coverage * 100:
+                continue
+            
+            halftone = np.load(outputs["halftones"][i], mmap_mode="r") if use_halftone else None
+            
+            channels.append(self.create_spot_channel(
+                request, i, color_lab, pantone_matches,
+                np.load(outputs["masks"][i], mmap_mode="r"), halftone, coverage, order_counter
+            ))
+            channels[-1]._files = files
+            order_counter += 1
+            report("channel", 0.9, channel=channels[-1])
+        
+        # Preview is composited at proxy resolution from downsampled planes
+        proxy_size = (proxy_rgb.shape[1], proxy_rgb.shape[0])
+        preview_masks = [cv2.resize(channel._mask, proxy_size, interpolation=cv2.INTER_AREA)
+                         for channel in channels]
+        preview = self.create_preview_composite(proxy_rgb, channels, request.fabric_color, preview_masks)
+        report("preview", 0.95)
+        
+        histogram = {
+            'red': hist[0].tolist(),
+            'green': hist[1].tolist(),
+            'blue': hist[2].tolist()
+        }
+        
+        return self.build_result(request, channels, preview, (h, w), histogram, pantone_matches, {
+            "image_dimensions": f"{h}x{w}",
+            "full_resolution": True,
+            "tile_size": request.tile_size,
+            "tiles": len(tiles)
+        })
+    
+    def compute_lab_buffer(self, img_rgb: np.ndarray) -> np.ndarray:
+        """Convert an RGB image to a float64 Lab buffer once, chunk by chunk."""
+        h, w = img_rgb.shape[:2]
+        img_lab = np.empty((h, w, 3), dtype=np.float64)
+        rows = max(1, self.chunk_pixels // max(w, 1))
+        
+        for y in range(0, h, rows):
+            img_lab[y:y + rows] = color.rgb2lab(img_rgb[y:y + rows] / 255.0)
+        
+        return img_lab
+    
+    def color_distance_max(self, img_lab: np.ndarray, colors_lab) -> np.ndarray:
+        """Largest Lab distance from each palette color to any pixel, chunked."""
+        pixels = img_lab.reshape(-1, 3)
+        targets = np.asarray(colors_lab, dtype=np.float64).reshape(-1, 3)
+        step = max(1, self.chunk_pixels)
+        
+        max_dist = np.zeros(len(targets))
+        for start in range(0, len(pixels), step):
+            block = pixels[start:start + step]
+            for c, target in enumerate(targets):
+                max_dist[c] = max(max_dist[c], np.sqrt(np.sum((block - target) ** 2, axis=1)).max())
+        return max_dist
+    
+    def create_color_masks(self, img_lab: np.ndarray, colors_lab: List[np.ndarray],
+                           softness: float = 0.5, max_dist: Optional[np.ndarray] = None) -> List[np.ndarray]:
+        """
+        Create masks for every palette color from a shared Lab buffer.
+        Distances are evaluated in chunks of ``chunk_pixels`` so temporary
+        memory stays bounded regardless of image size or palette length.
+        """
+        h, w = img_lab.shape[:2]
+        if len(colors_lab) == 0:
+            return []
+        
+        pixels = img_lab.reshape(-1, 3)
+        targets = np.asarray(colors_lab, dtype=np.float64).reshape(-1, 3)
+        step = max(1, self.chunk_pixels)
+        
+        # Pass 1: per-color normalization constant (callers rendering tiles
+        # pass the image-wide maximum instead)
+        if max_dist is None:
+            max_dist = self.color_distance_max(img_lab, targets)
+            max_dist[max_dist == 0] = 1
+        
+        # Pass 2: soft masks written straight into uint8 output
+        masks = np.empty((len(targets), h * w), dtype=np.uint8)
+        for start in range(0, len(pixels), step):
+            block = pixels[start:start + step]
+            for c, target in enumerate(targets):
+                dist_norm = np.sqrt(np.sum((block - target) ** 2, axis=1)) / max_dist[c]
+                masks[c, start:start + step] = self.soft_mask_values(dist_norm, softness)
+        
+        return [cv2.bilateralFilter(mask.reshape(h, w), 9, 75, 75) for mask in masks]
+    
+    def compute_color_distances(self, img_lab: np.ndarray, colors_lab: List[np.ndarray]) -> np.ndarray:
+        """
+        Normalized Lab distance from every pixel to every palette color, as a
+        float64 (colors, pixels) array: the values create_color_masks derives
+        chunk by chunk. Only the session "distances" stage uses this, trading
+        8 bytes per pixel per color for skipping the Lab pass on softness edits.
+        """
+        pixels = img_lab.reshape(-1, 3)
+        targets = np.asarray(colors_lab, dtype=np.float64).reshape(-1, 3)
+        step = max(1, self.chunk_pixels)
+        
+        max_dist = self.color_distance_max(img_lab, targets)
+        max_dist[max_dist == 0] = 1
+        
+        distances = np.empty((len(targets), len(pixels)), dtype=np.float64)
+        for start in range(0, len(pixels), step):
+            block = pixels[start:start + step]
+            for c, target in enumerate(targets):
+                distances[c, start:start + step] = np.sqrt(np.sum((block - target) ** 2, axis=1)) / max_dist[c]
+        return distances
+    
+    def masks_from_distances(self, distances: np.ndarray, shape: Tuple[int, int],
+                             softness: float) -> List[np.ndarray]:
+        """Soft masks from precomputed normalized distances (see compute_color_distances)."""
+        h, w = shape
+        step = max(1, self.chunk_pixels)
+        masks = np.empty(distances.shape, dtype=np.uint8)
+        for start in range(0, distances.shape[1], step):
+            for c in range(len(distances)):
+                masks[c, start:start + step] = self.soft_mask_values(distances[c, start:start + step], softness)
+        
+        return [cv2.bilateralFilter(mask.reshape(h, w), 9, 75, 75) for mask in masks]
+    
+    @staticmethod
+    def softness_profile(softness: float) -> str:
+        """Mask falloff curve selected by softness."""
         if softness > 0.7:
-            mask = 1 / (1 + np.exp(12 * (dist_norm - 0.4)))
+            return "sigmoid"
         elif softness > 0.3:
+            return "smoothstep"
+        return "hard"
+    
+    @staticmethod
+    def soft_mask_values(dist_norm: np.ndarray, softness: float) -> np.ndarray:
+        """Map normalized distances to uint8 mask values."""
+        dist_norm = dist_norm.astype(np.float64)
+        profile = ProfessionalSeparationEngine.softness_profile(softness)
+        
+        if profile == "sigmoid":
+            mask = 1 / (1 + np.exp(12 * (dist_norm - 0.4)))
+        elif profile == "smoothstep":
             t = np.clip(1 - dist_norm, 0, 1)
             mask = t * t * (3 - 2 * t)
         else:
             mask = np.where(dist_norm < 0.5, 1, 0)
         
-        mask = (mask * 255).astype(np.uint8)
-        mask = cv2.bilateralFilter(mask, 9, 75, 75)
-        
-        return mask
+        return (mask * 255).astype(np.uint8)
+    
+    def create_color_mask(self, img_rgb: np.ndarray, target_lab: np.ndarray, 
+                         softness: float = 0.5) -> np.ndarray:
+        """Create color mask with smooth transitions."""
+        img_lab = self.compute_lab_buffer(img_rgb)
+        return self.create_color_masks(img_lab, [target_lab], softness)[0]
     
     def create_preview_composite(self, img_rgb: np.ndarray, channels: List[ColorChannel], 
-                                fabric_color: str = "#000000") -> np.ndarray:
-        """Create preview composite image."""
+                                fabric_color: str = "#000000",
+                                masks: Optional[List[np.ndarray]] = None) -> np.ndarray:
+        """Create preview composite image (from in-memory planes unless masks are given)."""
         h, w = img_rgb.shape[:2]
-        preview = np.ones((h, w, 3), dtype=np.float32)
         
-        # Set fabric color
+        # Set fabric color; one contiguous float plane per RGB channel
         hex_color = fabric_color.lstrip('#')
-        fabric_r = int(hex_color[0:2], 16) / 255.0
-        fabric_g = int(hex_color[2:4], 16) / 255.0
-        fabric_b = int(hex_color[4:6], 16) / 255.0
+        fabric_rgb = [int(hex_color[i:i + 2], 16) / 255.0 for i in (0, 2, 4)]
+        preview = [np.full((h, w), value, dtype=np.float32) for value in fabric_rgb]
         
-        preview[:,:,0] = fabric_r
-        preview[:,:,1] = fabric_g
-        preview[:,:,2] = fabric_b
+        if masks is None:
+            masks = [channel._mask for channel in channels]
         
-        sorted_channels = sorted(channels, key=lambda x: x.order)
+        mask_norm = np.empty((h, w), dtype=np.float32)
+        inverse = np.empty((h, w), dtype=np.float32)
+        scratch = np.empty((h, w), dtype=np.float32)
         
-        for channel in sorted_channels:
+        for channel, mask in sorted(zip(channels, masks), key=lambda x: x[0].order):
             if not channel.printable:
                 continue
             
-            mask_base64 = channel.image.split(",")[1]
-            mask_data = base64.b64decode(mask_base64)
-            mask_np = np.frombuffer(mask_data, np.uint8)
-            mask = cv2.imdecode(mask_np, cv2.IMREAD_GRAYSCALE)
+            if mask is None and channel.image:
+                mask_data = base64.b64decode(channel.image.split(",")[1])
+                mask = cv2.imdecode(np.frombuffer(mask_data, np.uint8), cv2.IMREAD_GRAYSCALE)
             
             if mask is None or mask.shape[:2] != (h, w):
                 continue
             
-            mask_norm = mask.astype(np.float32) / 255.0 * channel.opacity
+            np.divide(mask, np.float32(255.0), out=mask_norm, dtype=np.float32)
+            mask_norm *= np.float32(channel.opacity)
+            np.subtract(np.float32(1), mask_norm, out=inverse)
             
             hex_color = channel.color.lstrip('#')
-            r = int(hex_color[0:2], 16) / 255.0
-            g = int(hex_color[2:4], 16) / 255.0
-            b = int(hex_color[4:6], 16) / 255.0
+            rgb = [int(hex_color[i:i + 2], 16) / 255.0 for i in (0, 2, 4)]
             
             # Apply blend mode
-            if channel.blend_mode == "multiply":
-                preview[:,:,0] *= (1 - mask_norm + r * mask_norm)
-                preview[:,:,1] *= (1 - mask_norm + g * mask_norm)
-                preview[:,:,2] *= (1 - mask_norm + b * mask_norm)
-            else:  # normal
-                for c, color_val in enumerate([r, g, b]):
-                    preview[:,:,c] = preview[:,:,c] * (1 - mask_norm) + color_val * mask_norm
-        
-        preview = np.clip(preview * 255, 0, 255).astype(np.uint8)
-        return preview
+            for plane, color_val in zip(preview, rgb):
+                np.multiply(mask_norm, np.float32(color_val), out=scratch)
+                if channel.blend_mode == "multiply":
+                    scratch += inverse
+                    plane *= scratch
+                else:  # normal
+                    plane *= inverse
+                    plane += scratch
+        
+        for plane in preview:
+            plane *= np.float32(255)
+            np.clip(plane, 0, 255, out=plane)
+        return cv2.merge([plane.astype(np.uint8) for plane in preview])
     
     def calculate_ink_estimate(self, channels: List[ColorChannel], image_size: Tuple[int, int]) -> Dict[str, float]:
         """Calculate ink usage estimates."""
@@ -1032,6 +2474,408 @@ class ProfessionalSeparationEngine:
         
         return recommendations[:7]
 
+# ============ RESULT CACHE ============
+
+class ResultCache:
+    """
+    Content-addressed LRU cache for endpoint results, bounded in bytes.
+    Entries evicted from memory are optionally spilled to a local directory
+    (itself LRU-bounded) and promoted back on the next hit.
+    """
+    
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, spill_dir: Optional[str] = None,
+                 max_disk_bytes: int = 4 * 1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.disk_entries = OrderedDict()  # key -> file size
+        self.bytes = 0
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                      "evictions": 0, "spills": 0, "disk_evictions": 0}
+        
+        if self.spill_dir:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Adopt spill files from a previous run, oldest first
+            for path in sorted(self.spill_dir.glob("*.pkl"), key=lambda p: p.stat().st_mtime):
+                size = path.stat().st_size
+                self.disk_entries[path.stem] = size
+                self.disk_bytes += size
+    
+    @staticmethod
+    def make_key(namespace: str, image_base64: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Hash the image payload plus normalized parameters into a cache key."""
+        if "base64," in image_base64:
+            image_base64 = image_base64.split("base64,")[1]
+        
+        digest = hashlib.sha256()
+        digest.update(f"{namespace}:{CACHE_VERSION}:".encode())
+        digest.update(image_base64.strip().encode())
+        digest.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def estimate_size(value: Any) -> int:
+        """Approximate resident bytes of a cached value."""
+        if isinstance(value, SeparationResult):
+            size = sum(plane.nbytes for _, _, plane in SeparationResultEncoder.channel_planes(value))
+            if value._preview is not None:
+                size += value._preview.nbytes
+            return size + 64 * 1024
+        return len(json.dumps(value, default=str))
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["memory_hits"] += 1
+                return self.entries[key][0]
+            
+            if key in self.disk_entries:
+                try:
+                    with open(self.spill_dir / f"{key}.pkl", "rb") as f:
+                        value = pickle.load(f)
+                except (OSError, pickle.UnpicklingError, EOFError):
+                    self._drop_disk(key)
+                else:
+                    self._drop_disk(key)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                    self._store(key, value, self.estimate_size(value))
+                    return value
+            
+            self.stats["misses"] += 1
+            return None
+    
+    def put(self, key: str, value: Any):
+        size = self.estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self._store(key, value, size)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            for key in list(self.disk_entries):
+                self._drop_disk(key)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+                entries=len(self.entries),
+                bytes=self.bytes,
+                max_bytes=self.max_bytes,
+                disk_entries=len(self.disk_entries),
+                disk_bytes=self.disk_bytes,
+                spill_dir=str(self.spill_dir) if self.spill_dir else None
+            )
+    
+    def _store(self, key: str, value: Any, size: int):
+        if size > self.max_bytes:
+            self._spill(key, value)
+            return
+        
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            old_key, (old_value, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            self.stats["evictions"] += 1
+            self._spill(old_key, old_value)
+    
+    def _spill(self, key: str, value: Any):
+        if not self.spill_dir:
+            return
+        
+        path = self.spill_dir / f"{key}.pkl"
+        try:
+            with open(path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            return
+        
+        size = path.stat().st_size
+        self.disk_entries[key] = size
+        self.disk_bytes += size
+        self.stats["spills"] += 1
+        while self.disk_bytes > self.max_disk_bytes and self.disk_entries:
+            self._drop_disk(next(iter(self.disk_entries)))
+            self.stats["disk_evictions"] += 1
+    
+    def _drop_disk(self, key: str):
+        self.disk_bytes -= self.disk_entries.pop(key, 0)
+        try:
+            (self.spill_dir / f"{key}.pkl").unlink()
+        except OSError:
+            pass
+
+# ============ RESULT TRANSPORT ============
+
+class ZipStreamBuffer(io.RawIOBase):
+    """Unseekable sink that lets zipfile emit an archive incrementally."""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+class SeparationResultEncoder:
+    """Encode in-memory separation planes only at the response edge"""
+    
+    @staticmethod
+    def channel_planes(result: SeparationResult):
+        """Yield (channel index, plane kind, array) for every plane in the result."""
+        for i, channel in enumerate(result.channels):
+            if channel._mask is not None:
+                yield i, "mask", channel._mask
+            if channel._halftone is not None:
+                yield i, "halftone", channel._halftone
+    
+    @staticmethod
+    def encode_channel(channel: ColorChannel, compression: int = 1) -> ColorChannel:
+        """Return a copy of one channel with its base64 PNG fields filled in."""
+        processor = ImageProcessor
+        update = {}
+        if channel._mask is not None:
+            update["image"] = processor.png_data_uri(processor.encode_png(channel._mask, compression))
+        if channel._halftone is not None:
+            update["halftone_pattern"] = processor.png_data_uri(processor.encode_png(channel._halftone, compression))
+        return channel.copy(update=update)
+    
+    @staticmethod
+    def encode_json(result: SeparationResult, compression: int = 1,
+                    encoded_channels: Optional[List[ColorChannel]] = None) -> SeparationResult:
+        """
+        Return a copy of the result with its base64 PNG fields filled in.
+        Channels already encoded (e.g. streamed by a job) can be passed in.
+        """
+        processor = ImageProcessor
+        if encoded_channels is None or len(encoded_channels) != len(result.channels):
+            encoded_channels = [SeparationResultEncoder.encode_channel(channel, compression)
+                                for channel in result.channels]
+        
+        encoded = {"channels": encoded_channels}
+        if result._preview is not None:
+            preview_bgr = cv2.cvtColor(result._preview, cv2.COLOR_RGB2BGR)
+            encoded["preview"] = processor.png_data_uri(processor.encode_png(preview_bgr, compression))
+        return result.copy(update=encoded)
+    
+    @staticmethod
+    def iter_zip(result: SeparationResult, mask_encoding: MaskEncoding = MaskEncoding.PNG,
+                 compression: int = 1):
+        """
+        Stream the result as a zip: one entry per plane, written and flushed
+        as it is encoded, then manifest.json (the JSON result with file
+        references instead of base64 images). PNG entries are stored;
+        raw entries use fast deflate.
+        """
+        sink = ZipStreamBuffer()
+        manifest = json.loads(result.json())
+        files = []
+        
+        # Entries opened by name (streamed raw planes) use fast deflate
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for i, kind, plane in SeparationResultEncoder.channel_planes(result):
+                stem = f"channels/{result.channels[i].order:02d}_{kind}"
+                extension = "raw" if mask_encoding == MaskEncoding.RAW else "png"
+                name = f"{stem}.{extension}"
+                
+                if isinstance(plane, np.memmap):
+                    # Full-resolution planes are streamed a strip at a time
+                    if mask_encoding == MaskEncoding.RAW:
+                        entry, pieces = name, (np.asarray(plane[y:y + 256]).tobytes() for y in range(0, len(plane), 256))
+                    else:
+                        entry = zipfile.ZipInfo(name, time.localtime()[:6])
+                        pieces = ImageProcessor.iter_png(plane, compression)
+                    with archive.open(entry, mode="w") as out:
+                        for piece in pieces:
+                            out.write(piece)
+                            yield sink.drain()
+                elif mask_encoding == MaskEncoding.RAW:
+                    archive.writestr(name, np.ascontiguousarray(plane).tobytes(),
+                                     compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+                else:
+                    archive.writestr(name, ImageProcessor.encode_png(plane, compression),
+                                     compress_type=zipfile.ZIP_STORED)
+                
+                field = "image" if kind == "mask" else "halftone_pattern"
+                manifest["channels"][i][field] = name
+                files.append({"name": name, "channel": i, "kind": kind,
+                              "width": plane.shape[1], "height": plane.shape[0], "dtype": "uint8"})
+                yield sink.drain()
+            
+            if result._preview is not None:
+                preview_bgr = cv2.cvtColor(result._preview, cv2.COLOR_RGB2BGR)
+                archive.writestr("preview.png", ImageProcessor.encode_png(preview_bgr, compression),
+                                 compress_type=zipfile.ZIP_STORED)
+                manifest["preview"] = "preview.png"
+            
+            manifest["files"] = files
+            manifest["mask_encoding"] = MaskEncoding(mask_encoding).value
+            archive.writestr("manifest.json", json.dumps(manifest), compress_type=zipfile.ZIP_DEFLATED)
+        
+        yield sink.drain()
+
+# ============ ASYNC JOBS ============
+
+class SeparationJobManager:
+    """
+    In-memory registry of asynchronous separation jobs. Each job keeps an
+    append-only event log (stage progress, finished channels, completion)
+    that backs both status polling and the Server-Sent Events stream.
+    Finished jobs are dropped once they are older than the TTL.
+    """
+    
+    def __init__(self, ttl_seconds: float = 900.0):
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+    
+    def create(self) -> Dict[str, Any]:
+        self.purge_expired()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "stage": None,
+            "progress": 0.0,
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+            "result": None,
+            "events": []
+        }
+        with self.lock:
+            self.jobs[job["id"]] = job
+        return job
+    
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        self.purge_expired()
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def delete(self, job_id: str) -> bool:
+        with self.lock:
+            return self.jobs.pop(job_id, None) is not None
+    
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job["finished_at"] is not None and job["finished_at"] < cutoff]
+            for job_id in expired:
+                del self.jobs[job_id]
+    
+    def emit(self, job: Dict[str, Any], event: str, data: Dict[str, Any]):
+        with self.lock:
+            job["events"].append({"id": len(job["events"]), "event": event, "data": data})
+    
+    def status(self, job: Dict[str, Any], include_result: bool = True) -> Dict[str, Any]:
+        """Public view of a job for polling."""
+        with self.lock:
+            status = {key: job[key] for key in
+                      ("id", "status", "stage", "progress", "created_at", "finished_at", "error")}
+            status["events"] = len(job["events"])
+            result = job["result"]
+        if include_result and result is not None:
+            status["result"] = json.loads(result.json())
+        return status
+    
+    def run(self, job: Dict[str, Any], request: ProcessRequest):
+        """Execute a job on the calling worker thread, emitting events as it goes."""
+        encoded_channels = []
+        
+        def progress(stage: str, fraction: float, channel: Optional[ColorChannel] = None):
+            with self.lock:
+                job["stage"] = stage
+                job["progress"] = round(fraction, 3)
+            self.emit(job, "stage", {"stage": stage, "progress": round(fraction, 3)})
+            
+            if channel is not None:
+                encoded = SeparationResultEncoder.encode_channel(channel)
+                encoded_channels.append(encoded)
+                self.emit(job, "channel", {"index": len(encoded_channels) - 1,
+                                           "channel": json.loads(encoded.json())})
+        
+        with self.lock:
+            job["status"] = "running"
+        
+        try:
+            cache_key = result_cache.make_key("process", request.image_base64,
+                                              request.dict(exclude={"image_base64", "session_id"}))
+            result = result_cache.get(cache_key)
+            if result is None:
+                result = engine.separate_image(request, progress)
+                result_cache.put(cache_key, result)
+            else:
+                for channel in result.channels:
+                    progress("channel", 0.9, channel=channel)
+            
+            final = SeparationResultEncoder.encode_json(result, encoded_channels=encoded_channels)
+            with self.lock:
+                job["result"] = final
+                job["status"] = "completed"
+                job["stage"] = "complete"
+                job["progress"] = 1.0
+                job["finished_at"] = time.time()
+            self.emit(job, "complete", json.loads(final.json(exclude={"channels"})))
+        except Exception as e:
+            self.fail(job, str(e))
+    
+    def fail(self, job: Dict[str, Any], error: str):
+        with self.lock:
+            job["status"] = "failed"
+            job["error"] = error
+            job["finished_at"] = time.time()
+        self.emit(job, "error", {"error": error})
+    
+    async def stream(self, job_id: str, last_event_id: int = -1, keepalive_seconds: float = 15.0):
+        """Yield the job's events as SSE frames until it completes or fails."""
+        cursor = last_event_id + 1
+        idle = 0.0
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield "event: error\ndata: {\"error\": \"Job not found or expired\"}\n\n"
+                return
+            
+            with self.lock:
+                pending = job["events"][cursor:]
+                finished = job["status"] in ("completed", "failed")
+            
+            for event in pending:
+                yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                cursor += 1
+            
+            if finished and not pending:
+                return
+            if pending:
+                idle = 0.0
+            elif idle >= keepalive_seconds:
+                # Comment frame keeps proxies from timing out an idle stream
+                yield ": keep-alive\n\n"
+                idle = 0.0
+            
+            await asyncio.sleep(0.1)
+            idle += 0.1
+
 # ============ FASTAPI APP ============
 
 app = FastAPI(
@@ -1040,7 +2884,23 @@ app = FastAPI(
     version="3.0"
 )
 
-engine = ProfessionalSeparationEngine()
+engine = ProfessionalSeparationEngine(sessions=SeparationSessionStore(
+    max_bytes=int(os.getenv("ECL_SESSION_MAX_BYTES", str(1024 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("ECL_SESSION_TTL", "1800"))
+))
+
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("ECL_CACHE_MAX_BYTES", str(512 * 1024 * 1024))),
+    spill_dir=os.getenv("ECL_CACHE_DIR") or None,
+    max_disk_bytes=int(os.getenv("ECL_CACHE_DISK_BYTES", str(4 * 1024 * 1024 * 1024)))
+)
+
+# CPU-bound endpoint work runs here, off the event loop. Threads only: /jobs
+# hands the pool the job manager and its progress callbacks, which share
+# in-process state and cannot be pickled to a worker process.
+separation_pool = BoundedWorkerPool("separation", thread_only=True)
+
+jobs = SeparationJobManager(ttl_seconds=float(os.getenv("ECL_JOB_TTL", "900")))
 
 app.add_middleware(
     CORSMiddleware,
@@ -1050,6 +2910,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============ ENDPOINT JOBS ============
+# Synchronous bodies of the heavy endpoints, executed on separation_pool
+
+def process_job(request: ProcessRequest, format: ResponseFormat) -> SeparationResult:
+    """Separate (or fetch from cache) and JSON-encode unless streaming a zip."""
+    try:
+        cache_key = result_cache.make_key("process", request.image_base64,
+                                          request.dict(exclude={"image_base64", "session_id"}))
+        result = result_cache.get(cache_key)
+        if result is None:
+            result = engine.separate_image(request)
+            result_cache.put(cache_key, result)
+        
+        if format == ResponseFormat.ZIP:
+            return result
+        return SeparationResultEncoder.encode_json(result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def adjust_colors_job(image_base64: str, adjustments: ColorAdjustment) -> Dict[str, Any]:
+    """Apply color adjustments to image and return adjusted image with histogram."""
+    try:
+        img_bgr = engine.processor.base64_to_cv2(image_base64)
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        
+        adjusted_rgb = engine.color_adjuster.apply_all_adjustments(img_rgb, adjustments)
+        histogram = engine.color_adjuster.calculate_histogram(adjusted_rgb)
+        
+        adjusted_base64 = engine.processor.cv2_to_base64(cv2.cvtColor(adjusted_rgb, cv2.COLOR_RGB2BGR))
+        
+        return {
+            "adjusted_image": adjusted_base64,
+            "histogram": histogram
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def analyze_job(image_base64: str, count_mode: ColorCountMode = ColorCountMode.AUTO) -> Dict[str, Any]:
+    """Analyze image and suggest best separation method."""
+    try:
+        cache_key = result_cache.make_key("analyze", image_base64, {"count_mode": count_mode.value})
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        img_bgr, alpha = engine.processor.decode_with_alpha(image_base64)
+        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        
+        # Also primes the fingerprint that separation_method=auto routes on
+        fingerprint = engine.get_fingerprint(image_base64, img_rgb, alpha, count_mode)
+        
+        # Calculate histogram
+        histogram = engine.color_adjuster.calculate_histogram(img_rgb)
+        
+        analysis = {
+            "edge_density": round(fingerprint["edge_density"] * 100, 1),
+            "unique_colors": fingerprint["unique_colors"],
+            "unique_colors_exact": fingerprint["unique_colors_exact"],
+            "alpha_coverage": fingerprint["alpha_coverage"],
+            "chromatic_ratio": fingerprint["chromatic_ratio"],
+            "dominant_hues": fingerprint["dominant_hues"],
+            "suggested_method": fingerprint["suggested_method"].value,
+            "suggested_colors": fingerprint["suggested_colors"],
+            "image_size": f"{img_rgb.shape[1]}x{img_rgb.shape[0]}",
+            "histogram": histogram
+        }
+        result_cache.put(cache_key, analysis)
+        return analysis
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def compare_job(image_base64: str, methods: List[str]) -> Dict[str, Any]:
+    """Compare different separation methods."""
+    try:
+        cache_key = result_cache.make_key("compare", image_base64, {"methods": methods})
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        
+        valid_methods = []
+        for method_name in methods:
+            try:
+                valid_methods.append(SeparationMethod(method_name))
+            except ValueError:
+                continue
+        
+        results = engine.compare_methods(image_base64, valid_methods, {
+            "max_colors": 6,
+            "use_underbase": True,
+            "fabric_color": "#000000"
+        })
+        
+        results.sort(key=lambda x: x["quality_score"], reverse=True)
+        
+        comparison = {
+            "comparison": results,
+            "best_method": results[0]["method"] if results else None
+        }
+        result_cache.put(cache_key, comparison)
+        return comparison
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ============ ENDPOINTS ============
 
 @app.get("/")
@@ -1070,8 +3035,10 @@ async def root():
             "gradient_aware - Best for gradients and smooth transitions",
             "median_cut - Preserves color relationships",
             "watershed - Natural color boundaries",
+            "superpixel - Region colors from SLIC superpixels, fast on large artwork",
             "simulated_process - Fixed spot color palette for dark garments",
-            "octree - Gradient-preserving quantization"
+            "octree - Gradient-preserving quantization",
+            "auto - Picks one of the above from the image fingerprint"
         ]
     }
 
@@ -1080,17 +3047,105 @@ async def health_check():
     return {
         "status": "healthy",
         "engine": "ProfessionalSeparationEngine",
-        "pantone_loaded": len(engine.pantone_matcher.pantones) > 0
+        "pantone_loaded": len(engine.pantone_matcher.pantones) > 0,
+        "cache": result_cache.get_stats(),
+        "sessions": engine.sessions.get_stats(),
+        "pool": separation_pool.stats()
     }
 
+@app.get("/pool/stats")
+async def pool_stats():
+    """Worker pool queue depth, wait time and run time."""
+    return separation_pool.stats()
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """Stage cache hit/miss counters and memory held by separation sessions."""
+    return engine.sessions.get_stats()
+
+@app.delete("/sessions/{session_id}")
+async def drop_session(session_id: str):
+    """Release the cached pipeline stages of a separator session."""
+    if not engine.sessions.drop(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return {"deleted": session_id}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result cache hit/miss counters and memory/disk usage."""
+    return result_cache.get_stats()
+
+@app.post("/cache/clear")
+async def cache_clear():
+    """Drop every cached result from memory and the spill directory."""
+    result_cache.clear()
+    return result_cache.get_stats()
+
 @app.post("/process", response_model=SeparationResult)
-async def process_image(request: ProcessRequest):
+async def process_image(
+    request: ProcessRequest,
+    format: ResponseFormat = ResponseFormat.JSON,
+    mask_encoding: MaskEncoding = MaskEncoding.PNG
+):
     """Main separation endpoint with all pro features."""
+    result = await separation_pool.run(process_job, request, format)
+    
+    if format == ResponseFormat.ZIP:
+        return StreamingResponse(
+            SeparationResultEncoder.iter_zip(result, mask_encoding),
+            media_type="application/zip",
+            headers={"Content-Disposition": "attachment; filename=separation.zip"}
+        )
+    
+    return result
+
+async def run_separation_job(job: Dict[str, Any], request: ProcessRequest):
+    """Background task: run a submitted job on the separation pool."""
     try:
-        result = await engine.separate_image(request)
-        return result
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        await separation_pool.run(jobs.run, job, request)
+    except HTTPException as e:
+        jobs.fail(job, str(e.detail))
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: ProcessRequest, background_tasks: BackgroundTasks):
+    """Queue a separation and return immediately with the job ID."""
+    separation_pool.check_capacity()
+    job = jobs.create()
+    background_tasks.add_task(run_separation_job, job, request)
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events"
+    }
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, include_result: bool = True):
+    """Poll a job's stage and progress; includes the result once completed."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return jobs.status(job, include_result)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events: stage progress, each finished channel, then completion."""
+    if jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    
+    cursor = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    return StreamingResponse(
+        jobs.stream(job_id, cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Discard a job and its retained results."""
+    if not jobs.delete(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return {"deleted": job_id}
 
 @app.post("/adjust-colors")
 async def adjust_colors(
@@ -1098,83 +3153,46 @@ async def adjust_colors(
     adjustments: ColorAdjustment = Body(...)
 ):
     """Apply color adjustments to image and return adjusted image with histogram."""
-    try:
-        img_bgr = engine.processor.base64_to_cv2(image_base64)
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        
-        adjusted_rgb = engine.color_adjuster.apply_all_adjustments(img_rgb, adjustments)
-        histogram = engine.color_adjuster.calculate_histogram(adjusted_rgb)
-        
-        adjusted_base64 = engine.processor.cv2_to_base64(cv2.cvtColor(adjusted_rgb, cv2.COLOR_RGB2BGR))
-        
-        return {
-            "adjusted_image": adjusted_base64,
-            "histogram": histogram
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await separation_pool.run(adjust_colors_job, image_base64, adjustments)
 
 @app.post("/match-pantone")
 async def match_pantone(
-    colors_hex: List[str] = Body(...)
+    colors_hex: List[str] = Body(...),
+    k: int = 1,
+    metric: DeltaEMetric = DeltaEMetric.CIE76
 ):
     """Match hex colors to Pantone library."""
     try:
-        colors_lab = []
-        for hex_color in colors_hex:
-            rgb = np.array([int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)])
-            lab = color.rgb2lab(rgb.reshape(1, 1, 3) / 255.0)[0, 0]
-            colors_lab.append(lab)
+        rgb = np.array([[int(hex_color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)]
+                        for hex_color in colors_hex], dtype=np.float64).reshape(-1, 3)
+        colors_lab = color.rgb2lab(rgb.reshape(1, -1, 3) / 255.0)[0]
         
-        matches = engine.pantone_matcher.match_palette(colors_lab)
+        matches = engine.pantone_matcher.match_palette(colors_lab, metric=metric)
         
-        return {
+        response = {
             "matches": matches,
             "count": len(matches)
         }
+        
+        if k > 1:
+            distances, indices = engine.pantone_matcher.match_many(colors_lab, k=k, metric=metric)
+            response["candidates"] = [
+                [{
+                    "pantone": engine.pantone_matcher.pantones[idx]['pantone'],
+                    "hex": engine.pantone_matcher.pantones[idx]['hex'],
+                    "distance": float(dist)
+                } for dist, idx in zip(row_dist, row_idx)]
+                for row_dist, row_idx in zip(distances, indices)
+            ]
+        
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/analyze")
-async def analyze_image(image_base64: str = Body(...)):
+async def analyze_image(image_base64: str = Body(...), count_mode: ColorCountMode = ColorCountMode.AUTO):
     """Analyze image and suggest best separation method."""
-    try:
-        img_bgr = engine.processor.base64_to_cv2(image_base64)
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        
-        gray = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (img_rgb.shape[0] * img_rgb.shape[1])
-        unique_colors = len(np.unique(img_rgb.reshape(-1, 3), axis=0))
-        
-        # Calculate histogram
-        histogram = engine.color_adjuster.calculate_histogram(img_rgb)
-        
-        if edge_density > 0.3:
-            suggested_method = SeparationMethod.GRADIENT_AWARE
-        elif unique_colors > 100:
-            suggested_method = SeparationMethod.SIMULATED_PROCESS
-        else:
-            suggested_method = SeparationMethod.MEDIAN_CUT
-        
-        if unique_colors > 500:
-            suggested_colors = 8
-        elif unique_colors > 100:
-            suggested_colors = 6
-        else:
-            suggested_colors = 4
-        
-        return {
-            "edge_density": round(edge_density * 100, 1),
-            "unique_colors": unique_colors,
-            "suggested_method": suggested_method.value,
-            "suggested_colors": suggested_colors,
-            "image_size": f"{img_rgb.shape[1]}x{img_rgb.shape[0]}",
-            "histogram": histogram
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await separation_pool.run(analyze_job, image_base64, count_mode)
 
 @app.post("/compare")
 async def compare_methods(
@@ -1182,41 +3200,7 @@ async def compare_methods(
     methods: List[str] = Body(["gradient_aware", "median_cut", "simulated_process"])
 ):
     """Compare different separation methods."""
-    try:
-        results = []
-        
-        for method_name in methods:
-            try:
-                method = SeparationMethod(method_name)
-                request = ProcessRequest(
-                    image_base64=image_base64,
-                    separation_method=method,
-                    max_colors=6,
-                    use_underbase=True,
-                    fabric_color="#000000"
-                )
-                
-                result = await engine.separate_image(request)
-                
-                results.append({
-                    "method": method.value,
-                    "channel_count": len(result.channels),
-                    "quality_score": result.separation_quality,
-                    "ink_estimate": result.ink_estimate,
-                    "recommendations": result.recommendations[:2]
-                })
-            except:
-                continue
-        
-        results.sort(key=lambda x: x["quality_score"], reverse=True)
-        
-        return {
-            "comparison": results,
-            "best_method": results[0]["method"] if results else None
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return await separation_pool.run(compare_job, image_base64, methods)
 
 if __name__ == "__main__":
     uvicorn.run(
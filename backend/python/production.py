@@ -1,17 +1,29 @@
 # production.py - Halftone and Production Form Service
 # To run: uvicorn production:app --host 0.0.0.0 --port 8004
+import asyncio
 import base64
 import io
-from typing import List, Dict
+import os
+import struct
+import tempfile
+import weakref
+import zlib
+from typing import List, Dict, Optional
+import numpy as np
 from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 from PIL import Image, ImageDraw, ImageFont
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.utils import ImageReader
 from reportlab.lib.units import inch
 
+from screening import HalftoneScreen, StreamingPDF, screen_halftone
+from worker_pool import BoundedWorkerPool
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +33,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Screening and PDF rendering run here, off the event loop
+production_pool = BoundedWorkerPool("production")
+
 # --- Pydantic Models ---
 class HalftoneRequest(BaseModel):
     image_b64: str
@@ -30,6 +45,11 @@ class HalftoneRequest(BaseModel):
     channel_name: str
     mesh_count: int
     print_order: int
+    # Output resolution; unset keeps the legacy scale (artwork width = one inch)
+    dpi: Optional[float] = Field(None, gt=0)
+    # "tiff" (1-bit, compressed per ``compression``) or "pdf"
+    output: str = "tiff"
+    compression: str = "group4"
 
 class ProductionFormRequest(BaseModel):
     job_name: str
@@ -37,114 +57,209 @@ class ProductionFormRequest(BaseModel):
     channels: List[Dict]
 
 # --- Core Logic ---
-def create_halftone_bitmap(gray_image: Image.Image, lpi: float, angle: float, shape: str) -> Image.Image:
-    """
-    Simulates the creation of a 1-bit halftone bitmap from a grayscale image.
-    This provides a visual representation for demonstration purposes. A real-world
-    implementation would use complex digital screening algorithms (RIP software).
-    """
-    width, height = gray_image.size
-    bitmap = Image.new("1", (width, height), color=1) # White canvas (1-bit)
-    draw = ImageDraw.Draw(bitmap)
-    pixels = gray_image.load()
-    
-    # Calculate cell size based on Lines Per Inch (LPI)
-    cell_size = int(width / lpi)
-    if cell_size < 2: cell_size = 2 # Prevent zero or one pixel cells
-
-    # Iterate over the image in halftone cells
-    for x in range(0, width, cell_size):
-        for y in range(0, height, cell_size):
-            # Calculate the average intensity of the pixels in the cell
-            intensity_sum = 0
-            num_pixels = 0
-            for i in range(cell_size):
-                for j in range(cell_size):
-                    if x + i < width and y + j < height:
-                        intensity_sum += pixels[x + i, y + j]
-                        num_pixels += 1
-            
-            if num_pixels == 0: continue
-            
-            # Normalize intensity (0.0 = black, 1.0 = white)
-            intensity = (intensity_sum / num_pixels) / 255.0
-            # Dot size is inversely proportional to intensity
-            dot_size_factor = (1.0 - intensity)
-            
-            cx, cy = x + cell_size / 2, y + cell_size / 2
-            
-            # Draw the dot if it has a size
-            if dot_size_factor > 0.1:
-                if shape == 'ellipse':
-                    rx = dot_size_factor * (cell_size / 1.8)
-                    ry = dot_size_factor * (cell_size / 2.2)
-                    draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=0)
-                elif shape == 'round':
-                    radius = dot_size_factor * (cell_size / 2.0)
-                    draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=0)
-                elif shape == 'line':
-                    thickness = int(dot_size_factor * (cell_size / 2.0))
-                    if thickness > 0:
-                        draw.line((x, cy, x + cell_size, cy), fill=0, width=thickness)
-
-    # TODO: Implement rotation based on the 'angle' parameter
-    return bitmap
-
-@app.post("/generate-film")
-async def generate_film(request: HalftoneRequest):
+# Film rows rendered per strip (and TIFF RowsPerStrip)
+FILM_STRIP_ROWS = 256
+TIFF_COMPRESSION = {"group4": 4, "packbits": 32773}
+FILM_MEDIA_TYPES = {"tiff": "image/tiff", "pdf": "application/pdf"}
+
+def create_halftone_bitmap(gray_image: Image.Image, lpi: float, angle: float, shape: str,
+                           dpi: Optional[float] = None) -> Image.Image:
     """
-    Generates a single production-ready film positive as a PNG image,
-    complete with registration marks and information text.
+    Screens a grayscale image into a 1-bit halftone bitmap (white canvas,
+    black dots) at the given LPI and screen angle. ``shape`` is one of
+    round, ellipse, line or square. Without ``dpi`` the artwork width is
+    taken as one inch, matching earlier films.
     """
+    gray = np.asarray(gray_image.convert("L"))
+    ink = screen_halftone(gray, lpi, angle, shape, dpi or gray.shape[1])
+    return Image.fromarray(~ink)
+
+def registration_mark(dpi: float) -> np.ndarray:
+    """Ink mask of a registration mark (circle and crosshair) sized in points, at the film DPI."""
+    radius = 10 * dpi / 72
+    reach = int(np.ceil(20 * dpi / 72))
+    half_line = max(1.0, dpi / 72) / 2
+    d = np.arange(-reach, reach + 1, dtype=np.float64)
+    dy, dx = np.meshgrid(d, d, indexing="ij")
+    ring = np.abs(np.hypot(dx, dy) - radius) <= half_line
+    cross = (np.abs(dy) <= half_line) | (np.abs(dx) <= half_line)
+    return ring | cross
+
+def film_label(text: str, dpi: float) -> np.ndarray:
+    """Ink mask of the production info line, set at 10 pt for the film DPI."""
+    size = max(8, int(round(10 * dpi / 72)))
     try:
-        image_data = base64.b64decode(request.image_b64.split(',')[1])
-        channel_img = Image.open(io.BytesIO(image_data)).convert('L')
-        
-        halftone_bitmap = create_halftone_bitmap(channel_img, request.lpi, request.angle, request.dot_shape)
-        
-        # Create a larger canvas for the film, adding margins
-        margin = int(1 * 72) # 1 inch in pixels (assuming 72 DPI for this context)
-        new_width = channel_img.width + 2 * margin
-        new_height = channel_img.height + 2 * margin
-        film_output = Image.new("1", (new_width, new_height), 1) # White background
-        
-        # Paste the halftone art in the center
-        film_output.paste(halftone_bitmap, (margin, margin))
-        
-        draw = ImageDraw.Draw(film_output)
+        # Use a common system font; provide a fallback
+        font = ImageFont.truetype("arial.ttf", size)
+    except IOError:
         try:
-            # Use a common system font; provide a fallback
-            font = ImageFont.truetype("arial.ttf", 24)
-        except IOError:
+            font = ImageFont.load_default(size)
+        except TypeError:  # Pillow < 10.1 only has the fixed bitmap font
             font = ImageFont.load_default()
+    left, top, right, bottom = font.getbbox(text)
+    label = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+    ImageDraw.Draw(label).text((-left, -top), text, font=font, fill=255)
+    return np.asarray(label) >= 128
 
-        # Function to draw a standard registration mark
-        def draw_reg_mark(x, y, radius=10, crosshair_len=20):
-            draw.ellipse((x - radius, y - radius, x + radius, y + radius), outline=0, width=1)
-            draw.line((x - crosshair_len, y, x + crosshair_len, y), fill=0, width=1)
-            draw.line((x, y - crosshair_len, x, y + crosshair_len), fill=0, width=1)
-
-        # Draw registration marks at the center of each edge
-        draw_reg_mark(new_width // 2, margin // 2)
-        draw_reg_mark(new_width // 2, new_height - margin // 2)
-        draw_reg_mark(margin // 2, new_height // 2)
-        draw_reg_mark(new_width - margin // 2, new_height // 2)
-        
-        # Add production info text at the bottom
-        info_text = f"Print Order: {request.print_order} | Channel: {request.channel_name} | {request.lpi} LPI @ {request.angle} deg | Mesh: {request.mesh_count}"
-        draw.text((margin, new_height - margin / 2), info_text, font=font, fill=0, anchor="lm")
-
-        # Encode the final film to base64
-        buffered = io.BytesIO()
-        film_output.save(buffered, format="PNG")
-        film_b64 = "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode("utf-8")
-        
-        return {"film_b64": film_b64}
+def stamp(strip: np.ndarray, y0: int, mask: np.ndarray, top: int, left: int):
+    """OR a mask placed at (top, left) in film coordinates into a strip starting at film row y0."""
+    rows, width = strip.shape
+    r0, r1 = max(top, y0), min(top + mask.shape[0], y0 + rows)
+    c0, c1 = max(left, 0), min(left + mask.shape[1], width)
+    if r0 < r1 and c0 < c1:
+        strip[r0 - y0:r1 - y0, c0:c1] |= mask[r0 - top:r1 - top, c0 - left:c1 - left]
+
+def film_strips(request: HalftoneRequest, rows: int = FILM_STRIP_ROWS):
+    """
+    Renders the film positive top to bottom: one-inch margins at the film
+    DPI (72 px without one), the screened art, registration marks at the centre of each edge
+    and the production info line. Yields (width, height, dpi) and then
+    boolean ink strips of ``rows`` rows, so no full-size bitmap is ever
+    built.
+    """
+    image_data = base64.b64decode(request.image_b64.split(',')[1])
+    gray = np.asarray(Image.open(io.BytesIO(image_data)).convert('L'))
+    art_h, art_w = gray.shape
+    dpi = request.dpi or art_w  # Legacy scale: artwork width = one inch
+    screen = HalftoneScreen(gray, request.lpi, request.angle, request.dot_shape, dpi)
+
+    # Without a DPI the layout keeps the legacy 72 px margin, with marks and label sized for 72 DPI
+    layout_dpi = request.dpi or 72
+    margin = int(round(layout_dpi))  # 1 inch
+    width, height = art_w + 2 * margin, art_h + 2 * margin
+    yield width, height, dpi
+
+    mark = registration_mark(layout_dpi)
+    reach = mark.shape[0] // 2
+    marks = [(margin // 2 - reach, width // 2 - reach), (height - margin // 2 - reach, width // 2 - reach),
+             (height // 2 - reach, margin // 2 - reach), (height // 2 - reach, width - margin // 2 - reach)]
+    info_text = f"Print Order: {request.print_order} | Channel: {request.channel_name} | {request.lpi} LPI @ {request.angle} deg | Mesh: {request.mesh_count}"
+    label = film_label(info_text, layout_dpi)
+    # Below the bottom registration mark, which reaches 20 pt under the margin's midline
+    label_at = (height - margin // 8 - label.shape[0] // 2, margin)
+
+    for y0 in range(0, height, rows):
+        strip = np.zeros((min(rows, height - y0), width), dtype=bool)
+        a0, a1 = max(y0, margin), min(y0 + strip.shape[0], margin + art_h)
+        if a0 < a1:
+            screen.rows(a0 - margin, a1 - margin, out=strip[a0 - y0:a1 - y0, margin:margin + art_w])
+        for top, left in marks:
+            stamp(strip, y0, mark, top, left)
+        stamp(strip, y0, label, *label_at)
+        yield strip
+
+def tiff_strip(paper: np.ndarray, compression: str) -> bytes:
+    """Compress one strip (True = white) with PIL and return its raw TIFF strip data."""
+    buffer = io.BytesIO()
+    Image.fromarray(paper).save(buffer, format="TIFF", compression=compression, strip_size=1 << 30)
+    encoded = Image.open(buffer)
+    offset, = encoded.tag_v2[273]
+    size, = encoded.tag_v2[279]
+    return buffer.getvalue()[offset:offset + size]
+
+def write_film_tiff(out, strips, width: int, height: int, dpi: float, compression: str, rows: int):
+    """
+    Writes a 1-bit BlackIsZero TIFF (paper is 1, ink is 0) one strip at a time:
+    header first, compressed strips as they are rendered, then the IFD,
+    whose offset is patched into the header at the end.
+    """
+    out.write(b"II*\x00\x00\x00\x00\x00")
+    offsets, sizes = [], []
+    for strip in strips:
+        data = tiff_strip(~strip, compression)
+        offsets.append(out.tell())
+        sizes.append(len(data))
+        out.write(data)
+    if out.tell() % 2:
+        out.write(b"\x00")
+
+    # The strips hold the paper mask (True = white), so BlackIsZero prints the ink black
+    resolution = (int(round(dpi * 100)), 100)
+    entries = [
+        (256, 4, [width]), (257, 4, [height]), (258, 3, [1]),
+        (259, 3, [TIFF_COMPRESSION[compression]]), (262, 3, [1]),
+        (273, 4, offsets), (277, 3, [1]), (278, 4, [rows]), (279, 4, sizes),
+        (282, 5, resolution), (283, 5, resolution), (296, 3, [2]),
+    ]
+    ifd_offset = out.tell()
+    extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd, extra = [struct.pack("<H", len(entries))], []
+    for tag, kind, values in entries:
+        fmt = {3: "H", 4: "I", 5: "I"}[kind]
+        count = len(values) // 2 if kind == 5 else len(values)
+        payload = struct.pack("<%d%s" % (len(values), fmt), *values)
+        if len(payload) <= 4:
+            ifd.append(struct.pack("<HHI", tag, kind, count) + payload.ljust(4, b"\x00"))
+        else:
+            ifd.append(struct.pack("<HHII", tag, kind, count, extra_offset))
+            extra.append(payload)
+            extra_offset += len(payload)
+    ifd.append(struct.pack("<I", 0))
+    out.write(b"".join(ifd + extra))
+    out.seek(4)
+    out.write(struct.pack("<I", ifd_offset))
+
+def write_film_pdf(out, strips, width: int, height: int, dpi: float):
+    """Writes the film as a one-page PDF at true size, Flate-compressing the 1-bit rows strip by strip."""
+    pdf = StreamingPDF()
+    out.write(pdf.open())
+    image_id, header = pdf.begin_image(width, height)
+    out.write(header)
+    compressor = zlib.compressobj(6)
+    for strip in strips:
+        # DeviceGray 1 bpc: 0 is black, so pack the paper (not the ink) as ones
+        out.write(pdf.write(compressor.compress(np.packbits(~strip, axis=1).tobytes())))
+    out.write(pdf.write(compressor.flush()))
+    out.write(pdf.end_image())
+    page_w, page_h = width * 72.0 / dpi, height * 72.0 / dpi
+    out.write(pdf.add_page(page_w, page_h, image_id, b"q %.4f 0 0 %.4f 0 0 cm /Film Do Q" % (page_w, page_h)))
+    out.write(pdf.close())
+
+def render_film(request: HalftoneRequest) -> dict:
+    """
+    Renders a single production-ready film positive, complete with
+    registration marks and information text, into a temporary file that
+    the endpoint streams back. Only one strip is in memory at a time.
+    """
+    try:
+        strips = film_strips(request)
+        width, height, dpi = next(strips)
+        with tempfile.NamedTemporaryFile(prefix="film_", suffix="." + request.output, delete=False) as out:
+            path = out.name
+            try:
+                if request.output == "pdf":
+                    write_film_pdf(out, strips, width, height, dpi)
+                else:
+                    write_film_tiff(out, strips, width, height, dpi, request.compression, FILM_STRIP_ROWS)
+            except Exception:
+                os.unlink(path)
+                raise
+        return {"path": path, "width": width, "height": height}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate-form", response_class=Response)
-async def generate_production_form(request: ProductionFormRequest):
+def discard_file(path: str):
+    """Remove a rendered film if it is still on disk."""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def discard_film(task: asyncio.Future):
+    """Done-callback for a render whose request went away: drop its film."""
+    if not task.cancelled() and task.exception() is None:
+        discard_file(task.result()["path"])
+
+def stream_file(path: str, chunk_size: int = 1 << 20):
+    """Stream a rendered film from disk and remove it afterwards."""
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+    finally:
+        discard_file(path)
+
+def render_production_form(request: ProductionFormRequest) -> Response:
     """
     Generates a PDF production form with job details, a preview image,
     and a list of color channels and their settings.
@@ -192,6 +307,43 @@ async def generate_production_form(request: ProductionFormRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-film", response_class=StreamingResponse)
+async def generate_film(request: HalftoneRequest):
+    """Generates a single production-ready film positive as a 1-bit TIFF or PDF."""
+    if request.output not in FILM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="output must be 'tiff' or 'pdf'")
+    if request.output == "tiff" and request.compression not in TIFF_COMPRESSION:
+        raise HTTPException(status_code=400, detail="compression must be 'group4' or 'packbits'")
+
+    # The worker finishes the film even if the client disconnects meanwhile;
+    # the shielded task then removes it once the render completes
+    render = asyncio.ensure_future(production_pool.run(render_film, request))
+    try:
+        film = await asyncio.shield(render)
+    except asyncio.CancelledError:
+        render.add_done_callback(discard_film)
+        raise
+
+    filename = f"{request.print_order:02d}_{request.channel_name.replace(' ', '_')}.{'tif' if request.output == 'tiff' else 'pdf'}"
+    response = StreamingResponse(
+        stream_file(film["path"]),
+        media_type=FILM_MEDIA_TYPES[request.output],
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        background=BackgroundTask(discard_file, film["path"])
+    )
+    # A body that is never iterated never reaches stream_file's finally
+    weakref.finalize(response, discard_file, film["path"])
+    return response
+
+@app.post("/generate-form", response_class=Response)
+async def generate_production_form(request: ProductionFormRequest):
+    """Generates a PDF production form for the job."""
+    return await production_pool.run(render_production_form, request)
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return production_pool.stats()
+
 @app.get("/")
 def root():
     """Root endpoint to check service status."""
@@ -0,0 +1,185 @@
+# screening.py
+# AM halftone screening shared by the film services (production, halftone):
+# rotated, tone-linear threshold matrices applied to 8-bit grayscale art, and
+# a streaming PDF writer for the resulting 1-bit films.
+
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Spot functions over cell coordinates (u, v) in [-0.5, 0.5); lower values ink first
+SPOT_FUNCTIONS = {
+    "round": lambda u, v: u * u + v * v,
+    "ellipse": lambda u, v: u * u + (1.22 * v) ** 2,  # 1.8:2.2 aspect, as drawn before
+    "line": lambda u, v: np.abs(v),
+    "square": lambda u, v: np.maximum(np.abs(u), np.abs(v)),
+}
+
+@lru_cache(maxsize=16)
+def threshold_matrix(shape: str, resolution: int = 64) -> np.ndarray:
+    """
+    Tone-linear threshold matrix for one halftone cell: the spot function
+    sampled on a resolution x resolution grid and replaced by its rank, so
+    a cell with coverage c inks exactly the fraction c of its area.
+    Flattened, in 0-255 units to compare directly with 8-bit tone.
+    """
+    spot = SPOT_FUNCTIONS.get(shape, SPOT_FUNCTIONS["round"])
+    centers = (np.arange(resolution) + 0.5) / resolution - 0.5
+    u, v = np.meshgrid(centers, centers, indexing="ij")
+    values = spot(u, v).ravel()
+    
+    ranks = np.empty(values.size, dtype=np.float32)
+    ranks[np.argsort(values, kind="stable")] = (np.arange(values.size) + 0.5) / values.size * 255
+    ranks.setflags(write=False)
+    return ranks
+
+class HalftoneScreen:
+    """
+    AM screening with a rotated threshold matrix. Each rotated cell takes
+    one tone, read from a cell-sized box average at the cell center, so
+    dots stay whole and symmetric; pixels then compare against the cell's
+    threshold matrix. Rows are screened on demand, so callers can render
+    films strip by strip without a full-size bitmap.
+    """
+
+    def __init__(self, gray: np.ndarray, lpi: float, angle: float, shape: str, dpi: float,
+                 resolution: int = 64):
+        height, width = gray.shape
+        cell = max(dpi / lpi, 2.0)  # Cell pitch in output pixels
+        theta = np.deg2rad(angle)
+        cos_t, sin_t = np.cos(theta), np.sin(theta)
+        self.shape = (height, width)
+        self.bits = int(np.log2(resolution))
+        self.mask = resolution - 1
+        
+        # Screen coordinates in matrix units: u runs along the screen angle
+        # (counter-clockwise, y down). Offsets keep them positive so integer
+        # truncation equals floor and the low bits index the matrix.
+        scale = resolution / cell
+        corners = np.array([[0, 0], [width, 0], [0, height], [width, height]], dtype=np.float64)
+        u_corner = (corners[:, 0] * cos_t - corners[:, 1] * sin_t) * scale
+        v_corner = (corners[:, 0] * sin_t + corners[:, 1] * cos_t) * scale
+        u_offset = resolution * (np.ceil(-u_corner.min() / resolution) + 1)
+        v_offset = resolution * (np.ceil(-v_corner.min() / resolution) + 1)
+        u_cells = int((u_corner.max() + u_offset) / resolution) + 2
+        self.v_cells = int((v_corner.max() + v_offset) / resolution) + 2
+        
+        # Tone per cell: box average sampled at each cell center
+        box = max(1, int(round(cell)))
+        blurred = cv2.blur(gray, (box, box)) if box > 1 else gray
+        cu, cv_ = np.meshgrid(np.arange(u_cells), np.arange(self.v_cells), indexing="ij")
+        cu = (cu + 0.5) * resolution - u_offset
+        cv_ = (cv_ + 0.5) * resolution - v_offset
+        cx = np.clip(np.rint((cu * cos_t + cv_ * sin_t) / scale), 0, width - 1).astype(np.intp)
+        cy = np.clip(np.rint((-cu * sin_t + cv_ * cos_t) / scale), 0, height - 1).astype(np.intp)
+        # Ink amount per cell on the matrix's 0-255 scale (dark = more ink)
+        self.cell_ink = (255 - blurred[cy, cx]).astype(np.float32).ravel()
+        
+        self.matrix = threshold_matrix(shape, resolution)
+        self.u_x = (np.arange(width) * cos_t * scale + u_offset).astype(np.float32)
+        self.v_x = (np.arange(width) * sin_t * scale + v_offset).astype(np.float32)
+        self.u_y, self.v_y = sin_t * scale, cos_t * scale
+
+    def rows(self, y0: int, y1: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Boolean ink mask (True = dot) for image rows y0..y1."""
+        ys = np.arange(y0, y1, dtype=np.float64)[:, None]
+        u = (self.u_x - (ys * self.u_y).astype(np.float32)).astype(np.int32)
+        v = (self.v_x + (ys * self.v_y).astype(np.float32)).astype(np.int32)
+        
+        cells = (u >> self.bits) * self.v_cells + (v >> self.bits)
+        within = ((u & self.mask) << self.bits) | (v & self.mask)
+        if out is None:
+            out = np.empty((y1 - y0, self.shape[1]), dtype=bool)
+        return np.less(self.matrix.take(within), self.cell_ink.take(cells), out=out)
+
+def screen_halftone(gray: np.ndarray, lpi: float, angle: float, shape: str, dpi: float,
+                    rows: int = 512, resolution: int = 64) -> np.ndarray:
+    """Screen a whole grayscale image; returns the boolean ink mask (True = dot)."""
+    screen = HalftoneScreen(gray, lpi, angle, shape, dpi, resolution)
+    height = gray.shape[0]
+    ink = np.empty(gray.shape, dtype=bool)
+    for y0 in range(0, height, rows):
+        screen.rows(y0, min(height, y0 + rows), out=ink[y0:y0 + rows])
+    return ink
+
+class StreamingPDF:
+    """
+    Minimal PDF writer that emits each object as soon as it is complete, so
+    films can be sent while later ones are still rendering. Image streams
+    take their data incrementally (their /Length is an indirect object
+    written after the data); page objects point at a Pages node whose
+    number is reserved up front and which is written, with the xref
+    table, by close().
+    """
+
+    def __init__(self):
+        self.offset = 0
+        self.xref = {}
+        self.pages = []
+        self.next_id = 4  # 1: catalog, 2: pages, 3: font
+        self.image = None
+
+    def _object(self, obj_id: int, body: bytes, stream: Optional[bytes] = None) -> bytes:
+        self.xref[obj_id] = self.offset
+        chunk = b"%d 0 obj\n" % obj_id + body
+        if stream is not None:
+            chunk += b"\nstream\n" + stream + b"\nendstream"
+        chunk += b"\nendobj\n"
+        self.offset += len(chunk)
+        return chunk
+
+    def _allocate(self, count: int) -> List[int]:
+        ids = list(range(self.next_id, self.next_id + count))
+        self.next_id += count
+        return ids
+
+    def open(self) -> bytes:
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        self.offset = len(header)
+        return header + self._object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    def begin_image(self, width: int, height: int) -> Tuple[int, bytes]:
+        """Start a 1-bit DeviceGray (0 = black), Flate-compressed image; returns its object id and header."""
+        image_id, length_id = self._allocate(2)
+        self.xref[image_id] = self.offset
+        chunk = (b"%d 0 obj\n<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray "
+                 b"/BitsPerComponent 1 /Filter /FlateDecode /Length %d 0 R >>\nstream\n"
+                 % (image_id, width, height, length_id))
+        self.offset += len(chunk)
+        self.image = (length_id, self.offset)
+        return image_id, chunk
+
+    def write(self, data: bytes) -> bytes:
+        """Pass compressed image data through, counting it toward the xref offsets."""
+        self.offset += len(data)
+        return data
+
+    def end_image(self) -> bytes:
+        length_id, start = self.image
+        length = self.offset - start
+        chunk = b"\nendstream\nendobj\n"
+        self.offset += len(chunk)
+        self.image = None
+        return chunk + self._object(length_id, b"%d" % length)
+
+    def add_page(self, page_w: float, page_h: float, image_id: int, content: bytes) -> bytes:
+        """A page of page_w x page_h points whose content draws the image as /Film, with Helvetica as /F1."""
+        content_id, page_id = self._allocate(2)
+        self.pages.append(page_id)
+        return (self._object(content_id, b"<< /Length %d >>" % len(content), content) +
+                self._object(page_id, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] "
+                                      b"/Resources << /XObject << /Film %d 0 R >> /Font << /F1 3 0 R >> >> "
+                                      b"/Contents %d 0 R >>" % (page_w, page_h, image_id, content_id)))
+
+    def close(self) -> bytes:
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self.pages)
+        chunks = self._object(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)))
+        chunks += self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self.offset
+        xref = [b"xref\n0 %d\n" % self.next_id, b"0000000000 65535 f \n"]
+        xref += [b"%010d 00000 n \n" % self.xref[obj_id] for obj_id in range(1, self.next_id)]
+        trailer = b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (self.next_id, xref_offset)
+        return chunks + b"".join(xref) + trailer
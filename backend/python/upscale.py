@@ -6,6 +6,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from PIL import Image
 
+from worker_pool import BoundedWorkerPool
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -15,14 +17,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+upscale_pool = BoundedWorkerPool("upscale")
+
 class Request(BaseModel):
     image_b64: str
     target_width: int = 0
     target_height: int = 0
     dpi: int = 300
 
-@app.post("/upscale")
-async def upscale(req: Request):
+def upscale_image(req: Request) -> dict:
     try:
         # Robust Base64 Decoding
         b64 = req.image_b64
@@ -43,6 +46,14 @@ async def upscale(req: Request):
         print(f"Upscale Error: {e}")
         raise HTTPException(500, str(e))
 
+@app.post("/upscale")
+async def upscale(req: Request):
+    return await upscale_pool.run(upscale_image, req)
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return upscale_pool.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -1,13 +1,17 @@
 # vectorizer.py
 from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from PIL import Image
 import io
+import os
 import base64
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import cv2
 
+from worker_pool import BoundedWorkerPool
+
 app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
@@ -16,92 +20,273 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Tracing runs here, off the event loop
+vectorizer_pool = BoundedWorkerPool("vectorizer")
+# Per-label contour tracing within one request
+trace_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ECL_VECTORIZER_TRACE_THREADS", os.cpu_count() or 1)),
+    thread_name_prefix="trace"
+)
+
+# Pixels used to fit the palette; larger images are box-downsampled first
+PALETTE_PIXELS = 1 << 18
+
 class VectorizeRequest(BaseModel):
     image_b64: str
     max_colors: int = 6
     generate_underbase: bool = True
+    # "polygon": every traced vertex; "curves": simplified, Bezier-fitted, relative coordinates
+    mode: str = "polygon"
+    # Curve mode: simplification tolerance (px), corner threshold (Potrace alphamax), decimals
+    tolerance: float = Field(1.0, ge=0.1, le=10)
+    alphamax: float = Field(1.0, ge=0, le=1.34)
+    precision: int = Field(1, ge=0, le=3)
 
 def rgb_to_hex(rgb):
     return "#{:02x}{:02x}{:02x}".format(rgb[0], rgb[1], rgb[2])
 
-@app.post("/vectorize")
-async def vectorize_image(request: VectorizeRequest):
-    try:
-        if "base64," in request.image_b64:
-            img_str = request.image_b64.split("base64,")[1]
+def decode_image(image_b64: str) -> Image.Image:
+    if "base64," in image_b64:
+        img_str = image_b64.split("base64,")[1]
+    else:
+        img_str = image_b64
+    return Image.open(io.BytesIO(base64.b64decode(img_str))).convert("RGBA")
+
+def quantize_labels(rgb_img: Image.Image, max_colors: int):
+    """
+    Quantize once to a label map: returns (labels, palette, counts) where
+    labels[y, x] indexes palette (an (n, 3) uint8 array). The palette is
+    fit on a bounded proxy; every pixel then maps to its nearest palette
+    color through a lookup table over 15-bit RGB, so large images cost
+    one table lookup per pixel.
+    """
+    proxy = rgb_img
+    if rgb_img.width * rgb_img.height > PALETTE_PIXELS:
+        scale = (PALETTE_PIXELS / (rgb_img.width * rgb_img.height)) ** 0.5
+        proxy = rgb_img.resize((max(1, int(rgb_img.width * scale)), max(1, int(rgb_img.height * scale))),
+                               Image.Resampling.BOX)
+    quantized = proxy.quantize(colors=max_colors, method=Image.Quantize.MAXCOVERAGE)
+    used = np.flatnonzero(np.bincount(np.asarray(quantized).ravel(), minlength=256))
+    palette = np.array(quantized.getpalette()[:768], dtype=np.uint8).reshape(-1, 3)[used]
+    
+    # Nearest palette entry for the center of every 5-bit-per-channel bin
+    centers = (np.indices((32, 32, 32)).reshape(3, -1).T * 8 + 4).astype(np.int32)
+    distances = ((centers[:, None, :] - palette[None, :, :].astype(np.int32)) ** 2).sum(axis=2)
+    lut = np.argmin(distances, axis=1).astype(np.uint8)
+    
+    rgb = np.asarray(rgb_img)
+    keys = ((rgb[:, :, 0].astype(np.uint16) >> 3) << 10) | ((rgb[:, :, 1] >> 3).astype(np.uint16) << 5) | (rgb[:, :, 2] >> 3)
+    labels = lut[keys]
+    counts = np.bincount(labels.ravel(), minlength=len(palette))
+    return labels, palette, counts
+
+def label_regions(labels: np.ndarray, counts: np.ndarray, skip=()):
+    """
+    Group pixels by label in one pass (a stable radix sort of the label
+    map) and yield (label, mask, (x0, y0)) with each mask cropped to the
+    label's bounding box plus a 1 px border, so per-label work scales with
+    the label's extent rather than the whole image. `counts` must be the
+    true pixel counts of every label, since they locate each label's slice
+    of the sorted order; labels in `skip` are not yielded.
+    """
+    height, width = labels.shape
+    order = np.argsort(labels.ravel(), kind="stable")
+    ends = np.cumsum(counts)
+    for label in np.flatnonzero(counts):
+        if label in skip:
+            continue
+        ys, xs = np.divmod(order[ends[label] - counts[label]:ends[label]], width)
+        y0, y1 = max(int(ys.min()) - 1, 0), min(int(ys.max()) + 2, height)
+        x0, x1 = max(int(xs.min()) - 1, 0), min(int(xs.max()) + 2, width)
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        mask[ys - y0, xs - x0] = 255
+        yield int(label), mask, (x0, y0)
+
+def contour_path(cnt: np.ndarray) -> str:
+    # Coordinate pairs after "L" repeat the lineto, so one L per subpath is enough
+    points = cnt.reshape(-1).tolist()
+    return f"M{points[0]} {points[1]}L" + " ".join(map(str, points[2:])) + "Z"
+
+def format_fixed(values, precision: int) -> str:
+    """
+    Compact SVG numbers for integers in units of 10**-precision: no
+    trailing zeros, no leading "0", and no space before a minus sign.
+    """
+    if precision == 0:
+        text = " ".join(map(str, values))
+    else:
+        scale = 10 ** precision
+        parts = []
+        for value in values:
+            whole, frac = divmod(abs(value), scale)
+            number = f"{whole}.{frac:0{precision}d}".rstrip("0") if frac else str(whole)
+            if number.startswith("0."):
+                number = number[1:]
+            parts.append("-" + number if value < 0 else number)
+        text = " ".join(parts)
+    return text.replace(" -", "-")
+
+def curve_commands(poly: np.ndarray, tolerance: float, alphamax: float, scale: int):
+    """
+    Potrace-style smoothing of a simplified closed polygon. Each vertex
+    becomes either a corner (straight edges meet at it) or a cubic Bezier
+    between the midpoints of its two edges, with control points pulled
+    toward the vertex by alpha. Alpha follows Potrace: it grows with the
+    vertex's distance from the chord of its neighbours, measured in units
+    of the simplification tolerance, and vertices at or above alphamax
+    stay corners. Consecutive curves with equal alpha use the "s"
+    shorthand. Returns the subpath start and its commands as (letter,
+    absolute points), in integer units of 1/scale.
+    """
+    v = poly.reshape(-1, 2).astype(np.float64)
+    n = len(v)
+    prev, nxt = np.roll(v, 1, axis=0), np.roll(v, -1, axis=0)
+    mids = (v + nxt) / 2
+    span = nxt - prev
+    cross = np.abs((v - prev)[:, 0] * span[:, 1] - (v - prev)[:, 1] * span[:, 0])
+    l1 = np.abs(span).sum(axis=1) * max(tolerance, 0.5)
+    dd = np.divide(cross, l1, out=np.zeros(n), where=l1 > 0)
+    alpha = np.where(dd > 1, 1 - 1 / np.maximum(dd, 1), 0) / 0.75
+    corner = alpha >= alphamax
+    alpha = np.clip(alpha, 0.55, 1.0)[:, None]
+    
+    mids_prev = np.roll(mids, 1, axis=0)
+    c1 = mids_prev + alpha * (v - mids_prev)
+    c2 = mids + alpha * (v - mids)
+    V, M, C1, C2 = (np.rint(a * scale).astype(np.int64).tolist() for a in (v, mids, c1, c2))
+    
+    commands = []
+    for i in range(n):
+        if corner[i]:
+            commands.append(("l", [V[i]]))
+            if not corner[(i + 1) % n]:
+                commands.append(("l", [M[i]]))
+        elif i and not corner[i - 1] and all(
+                abs(2 * m - c2 - c1) <= 1 for m, c2, c1 in zip(M[i - 1], C2[i - 1], C1[i])):
+            # First control point mirrors the previous one (equal alphas, within rounding)
+            commands.append(("s", [C2[i], M[i]]))
         else:
-            img_str = request.image_b64
-            
-        image_data = base64.b64decode(img_str)
-        original_img = Image.open(io.BytesIO(image_data)).convert("RGBA")
+            commands.append(("c", [C1[i], C2[i], M[i]]))
+    return M[-1], commands
+
+def curve_path(subpaths, precision: int) -> str:
+    """
+    Serialize subpaths [(start, commands)] with relative coordinates. Points
+    are rounded before differencing, so relative steps never drift; a
+    repeated command letter is omitted, as SVG allows.
+    """
+    out = []
+    origin = [0, 0]  # After "z" the current point is the subpath start
+    for start, commands in subpaths:
+        out.append("m" + format_fixed([start[0] - origin[0], start[1] - origin[1]], precision))
+        current, letter = start, "m"
+        for command, points in commands:
+            values = []
+            for x, y in points:
+                values += [x - current[0], y - current[1]]
+            current = points[-1]
+            numbers = format_fixed(values, precision)
+            if command == letter:
+                out.append(numbers if numbers.startswith("-") else " " + numbers)
+            else:
+                out.append(command + numbers)
+            letter = command
+        out.append("z")
+        origin = start
+    return "".join(out)
+
+def trace_label(mask: np.ndarray, origin, request: VectorizeRequest, min_area: float = 20):
+    """
+    Trace one label's mask into path data; returns (path_d, source_nodes,
+    nodes). RETR_CCOMP returns outer boundaries and their holes in a single
+    pass; holes are kept as extra subpaths so an even-odd fill leaves them
+    open. Polygon mode emits every contour vertex; curve mode simplifies
+    each contour to the tolerance and fits Beziers.
+    """
+    # Smooth mask slightly to reduce noise
+    kernel = np.ones((3, 3), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE, offset=origin)
+    if hierarchy is None:
+        return "", 0, 0
+    
+    kept = []
+    for i, (_, _, first_hole, parent) in enumerate(hierarchy[0]):
+        if parent != -1 or cv2.contourArea(contours[i]) < min_area:
+            continue # Holes are emitted with their outer boundary; skip noise
+        kept.append(contours[i])
+        hole = first_hole
+        while hole != -1:
+            if cv2.contourArea(contours[hole]) >= min_area:
+                kept.append(contours[hole])
+            hole = hierarchy[0][hole][0]
+    source_nodes = sum(len(cnt) for cnt in kept)
+    
+    if request.mode == "polygon":
+        return "".join(contour_path(cnt) for cnt in kept), source_nodes, source_nodes
+    
+    subpaths = []
+    for cnt in kept:
+        poly = cv2.approxPolyDP(cnt, request.tolerance, True)
+        if len(poly) >= 3:
+            subpaths.append(curve_commands(poly, request.tolerance, request.alphamax, 10 ** request.precision))
+    nodes = sum(len(commands) for _, commands in subpaths)
+    return curve_path(subpaths, request.precision), source_nodes, nodes
+
+def vectorize_svg(request: VectorizeRequest):
+    """Returns the SVG document and node statistics for the trace."""
+    try:
+        original_img = decode_image(request.image_b64)
         
         # --- FIX: Convert to RGB for Quantization to avoid Octree Error ---
         rgb_img = original_img.convert("RGB")
         
-        # Quantize to reduce colors to solid blocks
-        quantized = rgb_img.quantize(colors=request.max_colors, method=Image.Quantize.MAXCOVERAGE).convert("RGB")
+        # Quantize to reduce colors to solid blocks, once, as a label map
+        labels, palette, counts = quantize_labels(rgb_img, request.max_colors)
+        height, width = labels.shape
         
-        # Re-apply alpha channel from original if needed, or treat white as transparent
-        # For vectorization, we usually trace shapes.
+        # Ignore pure white if it's the background
+        white = set(np.flatnonzero(np.all(palette == 255, axis=1)).tolist())
         
-        width, height = quantized.size
-        svg_groups = []
+        # Labels trace independently, and OpenCV releases the GIL while tracing
+        regions = list(label_regions(labels, counts, skip=white))
+        traces = list(trace_executor.map(lambda region: trace_label(region[1], region[2], request), regions))
         
-        # Get colors
-        colors = quantized.getcolors(width * height)
-        if not colors:
-            # Fallback if getcolors returns None (too many colors)
-            quantized = quantized.quantize(colors=request.max_colors)
-            colors = quantized.getcolors(width * height)
-
-        img_array = np.array(quantized)
-
-        for count, color_tuple in colors:
-            # color_tuple is (R, G, B)
-            # Ignore pure white if it's the background
-            if color_tuple == (255, 255, 255): 
-                continue
-                
-            hex_color = rgb_to_hex(color_tuple)
-            
-            # Create mask for this specific color
-            # Use OpenCV for contour tracing (much faster than Shapely)
-            lower = np.array(color_tuple, dtype="uint8")
-            upper = np.array(color_tuple, dtype="uint8")
-            
-            # Convert PIL RGB to OpenCV BGR
-            opencv_img = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
-            mask = cv2.inRange(opencv_img, lower[::-1], upper[::-1]) # BGR check
-            
-            # Smooth mask slightly to reduce noise
-            kernel = np.ones((3,3), np.uint8)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-            
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            path_d = []
-            for cnt in contours:
-                if cv2.contourArea(cnt) < 20: continue # Skip noise
-                
-                # Build SVG Path String
-                start_point = cnt[0][0]
-                path_segment = f"M {start_point[0]},{start_point[1]} "
-                
-                for point in cnt[1:]:
-                    p = point[0]
-                    path_segment += f"L {p[0]},{p[1]} "
-                
-                path_segment += "Z"
-                path_d.append(path_segment)
-            
+        # Largest areas first, so smaller shapes paint on top of them
+        svg = [f'<svg viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg">']
+        for (label, _, _), (path_d, _, _) in sorted(zip(regions, traces), key=lambda item: -counts[item[0][0]]):
             if path_d:
-                full_path = " ".join(path_d)
-                svg_groups.append(f'<path fill="{hex_color}" d="{full_path}" />')
-
-        svg_content = f'<svg viewBox="0 0 {width} {height}" xmlns="http://www.w3.org/2000/svg">{ "".join(svg_groups) }</svg>'
+                svg.append(f'<path fill="{rgb_to_hex(palette[label])}" fill-rule="evenodd" d="{path_d}"/>')
+        svg.append("</svg>")
         
-        return Response(content=svg_content, media_type="image/svg+xml")
+        source_nodes = sum(trace[1] for trace in traces)
+        nodes = sum(trace[2] for trace in traces)
+        stats = {
+            "mode": request.mode,
+            "source_nodes": source_nodes,
+            "nodes": nodes,
+            "node_reduction": round(source_nodes / nodes, 2) if nodes else 1.0
+        }
+        return "".join(svg), stats
 
     except Exception as e:
         print(f"Vector Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/vectorize")
+async def vectorize_image(request: VectorizeRequest):
+    if request.mode not in ("polygon", "curves"):
+        raise HTTPException(status_code=400, detail="mode must be 'polygon' or 'curves'")
+    svg_content, stats = await vectorizer_pool.run(vectorize_svg, request)
+    return Response(content=svg_content, media_type="image/svg+xml", headers={
+        "X-Vector-Mode": stats["mode"],
+        "X-Vector-Source-Nodes": str(stats["source_nodes"]),
+        "X-Vector-Nodes": str(stats["nodes"]),
+        "X-Vector-Node-Reduction": str(stats["node_reduction"]),
+        "Access-Control-Expose-Headers": "X-Vector-Mode, X-Vector-Source-Nodes, X-Vector-Nodes, X-Vector-Node-Reduction"
+    })
+
+@app.get("/pool/stats")
+async def pool_stats():
+    return vectorizer_pool.stats()
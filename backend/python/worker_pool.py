@@ -0,0 +1,153 @@
+# worker_pool.py
+# Shared execution layer for the FastAPI services: runs CPU-bound endpoint
+# work off the asyncio event loop on a bounded thread or process pool, and
+# sheds load with 503 + Retry-After once the queue is full.
+#
+# Per-service configuration (NAME is the pool name, upper-cased):
+#   ECL_<NAME>_POOL     thread | process   (default: thread; pools built with
+#                       thread_only=True refuse process, since their jobs
+#                       carry unpicklable callbacks or shared state)
+#   ECL_<NAME>_WORKERS  worker count       (default: CPU count)
+#   ECL_<NAME>_QUEUE    waiting jobs allowed beyond the running ones
+
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import HTTPException
+
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict):
+    """Run fn in the worker and report wall-clock start/end for metrics."""
+    started = time.time()
+    result = fn(*args, **kwargs)
+    return started, time.time(), result
+
+
+class BoundedWorkerPool:
+    """Bounded executor with queue-depth, wait-time and run-time metrics"""
+
+    def __init__(self, name: str, max_workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 kind: Optional[str] = None, window: int = 256, thread_only: bool = False):
+        prefix = f"ECL_{name.upper()}_"
+        self.name = name
+        self.kind = os.getenv(prefix + "POOL", kind or "thread")
+        if thread_only and self.kind != "thread":
+            raise ValueError(f"{prefix}POOL={self.kind} is not supported: {name} jobs must run in-process")
+        self.max_workers = int(os.getenv(prefix + "WORKERS", max_workers or os.cpu_count() or 1))
+        self.max_queue = int(os.getenv(prefix + "QUEUE", max_queue if max_queue is not None else self.max_workers * 4))
+
+        if self.kind == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.wait_times = deque(maxlen=window)
+        self.run_times = deque(maxlen=window)
+
+    def retry_after(self) -> int:
+        """Seconds until a queue slot should free up, from recent run times."""
+        avg_run = sum(self.run_times) / len(self.run_times) if self.run_times else 1.0
+        backlog = max(1, self.in_flight - self.max_workers + 1)
+        return max(1, math.ceil(avg_run * backlog / self.max_workers))
+
+    def _reject_if_saturated(self):
+        # Caller holds self.lock
+        if self.in_flight >= self.max_workers + self.max_queue:
+            self.counters["rejected"] += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"{self.name} is at capacity, retry later",
+                headers={"Retry-After": str(self.retry_after())}
+            )
+
+    def check_capacity(self):
+        """Raise 503 now if a job submitted at this moment would be rejected."""
+        with self.lock:
+            self._reject_if_saturated()
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the pool, or reject with 503 if saturated."""
+        return await self._run(fn, args, kwargs, admit=True)
+
+    async def run_admitted(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) for a request that already passed
+        check_capacity: it is queued and counted but never rejected, so a
+        streamed response cannot fail partway through. Callers keep their
+        own submissions bounded.
+        """
+        return await self._run(fn, args, kwargs, admit=False)
+
+    async def _run(self, fn: Callable, args: tuple, kwargs: dict, admit: bool) -> Any:
+        with self.lock:
+            if admit:
+                self._reject_if_saturated()
+            self.in_flight += 1
+            self.counters["submitted"] += 1
+
+        submitted = time.time()
+        try:
+            future = self.executor.submit(_timed_call, fn, args, kwargs)
+        except BaseException:
+            with self.lock:
+                self.in_flight -= 1
+                self.counters["failed"] += 1
+            raise
+        # The slot is released when the worker actually finishes, not when the
+        # awaiting request goes away: a cancelled caller cannot stop a job that
+        # is already running, so it keeps counting against capacity until done.
+        future.add_done_callback(lambda done: self._finished(done, submitted))
+        _, _, result = await asyncio.wrap_future(future)
+        return result
+
+    def _finished(self, future: Future, submitted: float):
+        with self.lock:
+            self.in_flight -= 1
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.counters["failed"] += 1
+                return
+            started, finished, _ = future.result()
+            self.counters["completed"] += 1
+            self.wait_times.append(max(0.0, started - submitted))
+            self.run_times.append(finished - started)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of queue depth and latency for capacity planning."""
+        def summarize(samples):
+            if not samples:
+                return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+            ordered = sorted(samples)
+            return {
+                "avg": round(sum(ordered) / len(ordered), 4),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+                "max": round(ordered[-1], 4)
+            }
+
+        with self.lock:
+            running = min(self.in_flight, self.max_workers)
+            return dict(
+                self.counters,
+                name=self.name,
+                kind=self.kind,
+                max_workers=self.max_workers,
+                max_queue=self.max_queue,
+                running=running,
+                queue_depth=self.in_flight - running,
+                wait_seconds=summarize(self.wait_times),
+                run_seconds=summarize(self.run_times)
+            )